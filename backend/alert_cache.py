@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+from threading import Lock
+
+from sqlalchemy import case, func, select
+
+from models import db, Alert
+from alert_stream import alert_hub
+
+
+def _as_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+class AlertStateCache:
+    """
+    Per (user_id, alert_type) dedup state for should_create_alert: how many
+    alerts of that type are still unresolved and when the latest one
+    happened. Warm-loaded with one grouped query at start-up and then kept
+    current from committed alert changes published by the alert hub, so the
+    dedup decision does not need to query the alert table.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = Lock()
+
+    def init_app(self, app) -> None:
+        with app.app_context():
+            rows = db.session.execute(
+                select(
+                    Alert.user_id,
+                    Alert.type,
+                    func.sum(case((Alert.is_resolved == False, 1), else_=0)),  # noqa: E712
+                    func.max(Alert.timestamp),
+                ).group_by(Alert.user_id, Alert.type)
+            ).all()
+        with self._lock:
+            self._states = {
+                (user_id, alert_type): [open_count or 0, _as_utc(last_ts) if last_ts else None]
+                for user_id, alert_type, open_count, last_ts in rows
+            }
+        alert_hub.add_listener(self.apply)
+
+    def apply(self, event_name: str, alert: dict) -> None:
+        """Alert hub listener, called after each committed alert change."""
+        key = (alert['user_id'], alert['type'])
+        with self._lock:
+            state = self._states.setdefault(key, [0, None])
+            if event_name == 'alert':
+                if not alert['is_resolved']:
+                    state[0] += 1
+                timestamp = _as_utc(datetime.fromisoformat(alert['timestamp']))
+                if state[1] is None or timestamp > state[1]:
+                    state[1] = timestamp
+            elif event_name == 'alert_update':
+                # Only changes of is_resolved are published as updates
+                state[0] += -1 if alert['is_resolved'] else 1
+                state[0] = max(state[0], 0)
+
+    def has_open(self, user_id: int, alert_type: str) -> bool:
+        state = self._states.get((user_id, alert_type))
+        return bool(state and state[0])
+
+    def last_timestamp(self, user_id: int, alert_type: str):
+        state = self._states.get((user_id, alert_type))
+        return state[1] if state else None
+
+
+alert_state_cache = AlertStateCache()
@@ -0,0 +1,344 @@
+"""
+Declarative alert rules evaluated on every stored batch of wearable samples.
+
+Rules are declared globally (the JSON list in ALERT_RULES_FILE, by default
+DEFAULT_RULES) and per patient (Patient.alert_rules, set through
+PUT /api/patients/<id>/thresholds); a patient gets both. A rule is a dict:
+
+    {"type": "HR_HIGH", "metric": "heart_rate", "above": "max_hr"}
+    {"type": "TACHYCARDIA", "metric": "heart_rate", "above": 110, "for_seconds": 600}
+    {"type": "HR_JUMP", "metric": "heart_rate", "rise": 30, "within_seconds": 60}
+
+  type              alert type raised
+  metric            'heart_rate' (bpm) or 'imu_magnitude' (length of the
+                    accelerometer vector)
+  above / below     threshold rule: a sample beyond the limit, a number or a
+                    patient threshold ('min_hr', 'max_hr')
+  for_seconds       with above/below, duration rule: every sample beyond the
+                    limit for at least that long
+  rise / fall / change
+                    rate-of-change rule: the value moved by at least that much
+  within_seconds    ... within that window (required with rise/fall/change)
+  cooldown_seconds  minimum spacing of two alerts of this type (default 180)
+  message           str.format template with {value} (default '<type>: {value}')
+
+Each distinct declaration is compiled once. Duration and rate-of-change
+rules keep their per-patient state in one RuleStateStore and update it
+incrementally, sample by sample, so evaluating a batch never queries the
+database whatever the number of rules. Alerts are deduplicated like the
+device-reported ones: none while one of the type is open or within its
+cooldown, and at most one per type per batch.
+"""
+import functools
+import json
+import math
+from collections import deque
+from datetime import timedelta, timezone
+from threading import Lock
+
+from models import Alert, HeartRate, IMUData
+from alert_cache import alert_state_cache
+
+# Default minimum spacing between two alerts of the same type for a user
+ALERT_COOLDOWN = timedelta(minutes=3)
+
+DEFAULT_RULES = [
+    {'type': 'HR_LOW', 'metric': 'heart_rate', 'below': 'min_hr', 'message': 'Heart rate low: {value}'},
+    {'type': 'HR_HIGH', 'metric': 'heart_rate', 'above': 'max_hr', 'message': 'Heart rate high: {value}'},
+]
+
+# Patient columns a limit may name
+PATIENT_LIMITS = ('min_hr', 'max_hr')
+
+# metric -> (model it is computed from, value of one row)
+METRICS = {
+    'heart_rate': (HeartRate, lambda row: row['value']),
+    'imu_magnitude': (IMUData, lambda row: math.sqrt(row['x_axis'] ** 2 + row['y_axis'] ** 2 + row['z_axis'] ** 2)),
+}
+
+_KEYS = {'type', 'metric', 'above', 'below', 'for_seconds', 'rise', 'fall', 'change',
+         'within_seconds', 'cooldown_seconds', 'message'}
+
+
+class RuleError(ValueError):
+    """An invalid rule declaration."""
+
+
+def should_create_alert(user_id: int, alert_type: str, timestamp, cooldown: timedelta = ALERT_COOLDOWN) -> bool:
+    """
+    Avoid spamming identical alerts by skipping new ones when there is already
+    an unresolved alert of the same type or a very recent one within the
+    cooldown window. Answered from the in-memory alert state cache.
+    """
+    if alert_state_cache.has_open(user_id, alert_type):
+        return False
+
+    recent_ts = alert_state_cache.last_timestamp(user_id, alert_type)
+    if recent_ts and (timestamp - recent_ts) < cooldown:
+        return False
+
+    return True
+
+
+def _epoch(timestamp) -> float:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class ThresholdRule:
+    """Fires on every sample beyond the limit."""
+
+    stateful = False
+
+    def __init__(self, spec: dict, direction: str):
+        self.key = json.dumps(spec, sort_keys=True)
+        self.alert_type = spec['type']
+        self.metric = spec['metric']
+        self.cooldown = timedelta(seconds=spec.get('cooldown_seconds', ALERT_COOLDOWN.total_seconds()))
+        self.message = spec.get('message', f"{spec['type']}: {{value}}")
+        self.above = direction == 'above'
+        self.limit = spec[direction]
+
+    def format_message(self, value) -> str:
+        try:
+            return self.message.format(value=value)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            # A template validated before values were checked as floats
+            return f'{self.alert_type}: {value}'
+
+    def beyond(self, patient, value) -> bool:
+        limit = getattr(patient, self.limit) if isinstance(self.limit, str) else self.limit
+        return value > limit if self.above else value < limit
+
+    def new_state(self):
+        return None
+
+    def step(self, state, patient, t: float, value) -> bool:
+        return self.beyond(patient, value)
+
+
+class DurationRule(ThresholdRule):
+    """Fires once the samples have stayed beyond the limit for `for_seconds`."""
+
+    stateful = True
+
+    def __init__(self, spec: dict, direction: str):
+        super().__init__(spec, direction)
+        self.seconds = spec['for_seconds']
+
+    def new_state(self):
+        return [None]  # start of the current run beyond the limit
+
+    def step(self, state, patient, t: float, value) -> bool:
+        if not self.beyond(patient, value):
+            state[0] = None
+            return False
+        if state[0] is None:
+            state[0] = t
+        return t - state[0] >= self.seconds
+
+
+class RateRule(ThresholdRule):
+    """Fires when the value rose/fell/changed by `delta` within `within_seconds`."""
+
+    stateful = True
+
+    def __init__(self, spec: dict, direction: str):
+        super().__init__(spec, direction)
+        self.direction = direction
+        self.delta = spec[direction]
+        self.seconds = spec['within_seconds']
+
+    def new_state(self):
+        # Monotonic deques of (t, value): window minimum and maximum at the front
+        return deque(), deque()
+
+    def step(self, state, patient, t: float, value) -> bool:
+        lows, highs = state
+        horizon = t - self.seconds
+        for window in state:
+            while window and window[0][0] < horizon:
+                window.popleft()
+        while lows and lows[-1][1] >= value:
+            lows.pop()
+        lows.append((t, value))
+        while highs and highs[-1][1] <= value:
+            highs.pop()
+        highs.append((t, value))
+
+        rise, fall = value - lows[0][1], highs[0][1] - value
+        if self.direction == 'rise':
+            return rise >= self.delta
+        if self.direction == 'fall':
+            return fall >= self.delta
+        return max(rise, fall) >= self.delta
+
+
+def _positive(spec: dict, key: str) -> None:
+    value = spec[key]
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0:
+        raise RuleError(f'{key} must be a positive number')
+
+
+def compile_rule(spec) -> ThresholdRule:
+    """Validate one rule declaration and compile it."""
+    if not isinstance(spec, dict):
+        raise RuleError('rule must be an object')
+    unknown = set(spec) - _KEYS
+    if unknown:
+        raise RuleError(f'unknown rule keys: {", ".join(sorted(unknown))}')
+    if not isinstance(spec.get('type'), str) or not spec['type']:
+        raise RuleError('type required')
+    if spec.get('metric') not in METRICS:
+        raise RuleError(f'metric must be one of {", ".join(METRICS)}')
+    if 'cooldown_seconds' in spec and spec['cooldown_seconds'] != 0:
+        _positive(spec, 'cooldown_seconds')
+    if 'message' in spec:
+        # Values are floats: packed uploads, imu_magnitude
+        try:
+            spec['message'].format(value=0.0)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            raise RuleError('message must be a template with {value} only')
+
+    conditions = [key for key in ('above', 'below', 'rise', 'fall', 'change') if key in spec]
+    if len(conditions) != 1:
+        raise RuleError('exactly one of above, below, rise, fall or change required')
+    direction = conditions[0]
+
+    if direction in ('above', 'below'):
+        limit = spec[direction]
+        if isinstance(limit, str):
+            if limit not in PATIENT_LIMITS:
+                raise RuleError(f'{direction} must be a number or one of {", ".join(PATIENT_LIMITS)}')
+        elif isinstance(limit, bool) or not isinstance(limit, (int, float)):
+            raise RuleError(f'{direction} must be a number or one of {", ".join(PATIENT_LIMITS)}')
+        if 'within_seconds' in spec:
+            raise RuleError('within_seconds only applies to rise, fall and change')
+        if 'for_seconds' in spec:
+            _positive(spec, 'for_seconds')
+            return DurationRule(spec, direction)
+        return ThresholdRule(spec, direction)
+
+    _positive(spec, direction)
+    if 'within_seconds' not in spec:
+        raise RuleError(f'within_seconds required with {direction}')
+    _positive(spec, 'within_seconds')
+    if 'for_seconds' in spec:
+        raise RuleError('for_seconds only applies to above and below')
+    return RateRule(spec, direction)
+
+
+def compile_rules(specs) -> dict:
+    """Compile a list of rule declarations into {metric: tuple of rules}."""
+    if not isinstance(specs, list):
+        raise RuleError('rules must be a list')
+    rules = {}
+    for i, spec in enumerate(specs):
+        try:
+            rule = compile_rule(spec)
+        except RuleError as e:
+            raise RuleError(f'rule {i}: {e}')
+        rules.setdefault(rule.metric, []).append(rule)
+    return {metric: tuple(metric_rules) for metric, metric_rules in rules.items()}
+
+
+@functools.lru_cache(maxsize=4096)
+def _patient_rules(text: str) -> dict:
+    # Patient.alert_rules as stored: validated when it was set
+    return compile_rules(json.loads(text))
+
+
+class RuleStateStore:
+    """
+    Evaluation state of the duration and rate-of-change rules per (user id,
+    rule declaration), with the time of the last sample each one saw so
+    late samples are not applied out of order.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self.lock = Lock()
+
+    def get(self, user_id: int, rule) -> list:
+        """[last sample time, rule state]; call with `lock` held."""
+        key = (user_id, rule.key)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = [-math.inf, rule.new_state()]
+        return state
+
+    def clear(self) -> None:
+        with self.lock:
+            self._states.clear()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+
+class AlertRuleEngine:
+    """Global and per-patient rule sets and the state store shared by all rules."""
+
+    def __init__(self):
+        self.global_rules = compile_rules(DEFAULT_RULES)
+        self.state = RuleStateStore()
+
+    def init_app(self, app) -> None:
+        specs = DEFAULT_RULES
+        if app.config['ALERT_RULES_FILE']:
+            with open(app.config['ALERT_RULES_FILE'], encoding='utf-8') as f:
+                specs = json.load(f)
+        self.global_rules = compile_rules(specs)
+        self.state.clear()
+
+    def rules(self, patient, metric: str) -> tuple:
+        """Compiled rules on `metric` for `patient` (PatientThresholds)."""
+        rules = self.global_rules.get(metric, ())
+        if patient.alert_rules:
+            rules += _patient_rules(patient.alert_rules).get(metric, ())
+        return rules
+
+    def evaluate(self, patient, model, rows: list, state: RuleStateStore = None) -> list:
+        """
+        Run every rule on the metrics of `model` over freshly stored rows
+        (HeartRate/IMUData column dicts) and return the new Alerts, not yet
+        added to a session. `state` defaults to the engine's store; give a
+        separate one to evaluate samples outside the live stream.
+        """
+        if state is None:
+            state = self.state
+        alerts = {}
+        for metric, (metric_model, value_of) in METRICS.items():
+            if metric_model is not model:
+                continue
+            rules = self.rules(patient, metric)
+            if not rules:
+                continue
+            samples = sorted(((_epoch(row['timestamp']), value_of(row), row['timestamp']) for row in rows),
+                             key=lambda sample: sample[0])
+            with state.lock:
+                for rule in rules:
+                    self._run(rule, patient, samples, state, alerts)
+        return list(alerts.values())
+
+    def _run(self, rule, patient, samples: list, state: RuleStateStore, alerts: dict) -> None:
+        user_id = patient.user_id
+        # An open alert blocks the rule for the whole batch; stateless rules can skip it
+        blocked = rule.alert_type in alerts or alert_state_cache.has_open(user_id, rule.alert_type)
+        if blocked and not rule.stateful:
+            return
+        rule_state = state.get(user_id, rule) if rule.stateful else [-math.inf, None]
+        for t, value, timestamp in samples:
+            if t < rule_state[0]:
+                continue
+            rule_state[0] = t
+            if rule.step(rule_state[1], patient, t, value) and not blocked:
+                if should_create_alert(user_id, rule.alert_type, timestamp, rule.cooldown):
+                    alerts[rule.alert_type] = Alert(user_id=user_id, type=rule.alert_type,
+                                                    message=rule.format_message(value), timestamp=timestamp)
+                    blocked = True
+                    if not rule.stateful:
+                        return
+
+
+rule_engine = AlertRuleEngine()
@@ -0,0 +1,126 @@
+import json
+import queue
+from threading import Lock
+
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.orm import Session
+
+from models import Alert, AlertEvent
+from shared_state import shared_state
+
+
+class Subscriber:
+    """One open alert stream. `user_id` is None for caregivers (all alerts)."""
+
+    def __init__(self, user_id, maxsize: int):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        # Set when the client fell too far behind; it has to reconnect and
+        # catch up with Last-Event-ID instead of silently missing alerts.
+        self.overflowed = False
+
+    def wants(self, alert: dict) -> bool:
+        return self.user_id is None or alert['user_id'] == self.user_id
+
+
+class AlertHub:
+    """
+    In-process pub/sub hub for alert changes. Alerts are captured when the
+    session flushes them and published only once the transaction commits, so
+    every code path that adds or resolves an Alert is covered and subscribers
+    never see rolled back rows.
+
+    Two kinds of event are published: `alert` for a new alert and
+    `alert_update` when an alert's is_resolved flag changes, each with the
+    `seq` of its AlertEvent row. Besides stream subscribers, in-process
+    caches register listeners that are called synchronously with
+    (event_name, alert) on every commit. Changes committed by other worker
+    processes arrive through shared_state and are published the same way.
+
+    A stream holds its server thread while open, so at most
+    ALERT_STREAM_MAX_CLIENTS are subscribed per process, leaving the other
+    threads to requests.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._listeners = set()
+        self._lock = Lock()
+        self.queue_size = 100
+        self.max_subscribers = 4
+
+    def init_app(self, app) -> None:
+        self.queue_size = app.config['ALERT_STREAM_QUEUE_SIZE']
+        self.max_subscribers = app.config['ALERT_STREAM_MAX_CLIENTS']
+        shared_state.subscribe('alerts', lambda message: self.publish(*message))
+
+    def subscribe(self, user_id=None):
+        """A new Subscriber, or None when ALERT_STREAM_MAX_CLIENTS streams are open."""
+        subscriber = Subscriber(user_id, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def add_listener(self, listener) -> None:
+        with self._lock:
+            self._listeners.add(listener)
+
+    def publish(self, event_name: str, alert: dict, seq: int = None) -> None:
+        with self._lock:
+            listeners = list(self._listeners)
+            subscribers = list(self._subscribers)
+        for listener in listeners:
+            listener(event_name, alert)
+        for subscriber in subscribers:
+            if not subscriber.wants(alert):
+                continue
+            try:
+                subscriber.queue.put_nowait((event_name, alert, seq))
+            except queue.Full:
+                subscriber.overflowed = True
+
+
+def format_event(event_name: str, alert: dict, seq: int = None) -> str:
+    """Serialize one alert change as a Server-Sent Events message with id `seq`."""
+    event_id = '' if seq is None else f'id: {seq}\n'
+    return f'{event_id}event: {event_name}\ndata: {json.dumps(alert)}\n\n'
+
+
+alert_hub = AlertHub()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_alert_changes(session, flush_context):
+    changes = [('alert', obj) for obj in session.new if isinstance(obj, Alert)]
+    changes += [
+        ('alert_update', obj) for obj in session.dirty
+        if isinstance(obj, Alert) and inspect(obj).attrs.is_resolved.history.has_changes()
+    ]
+    if not changes:
+        return
+    pending = session.info.setdefault('alert_events', [])
+    connection = session.connection()
+    for event_name, alert in changes:
+        # Same transaction as the change: it is logged if and only if it commits
+        seq = connection.execute(
+            insert(AlertEvent).values(alert_id=alert.id, event=event_name)
+        ).inserted_primary_key[0]
+        pending.append((event_name, alert.to_dict(), seq))
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_alert_changes(session):
+    for event_name, alert, seq in session.info.pop('alert_events', []):
+        alert_hub.publish(event_name, alert, seq)
+        shared_state.publish('alerts', [event_name, alert, seq])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_alert_changes(session):
+    session.info.pop('alert_events', None)
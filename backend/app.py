@@ -2,27 +2,95 @@ from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from config import Config
-from models import db
+from models import db, ensure_columns, ensure_indexes
 from routes import api
+from inactivity import inactivity_tracker
+from fall_detection import fall_detector
+from sensor_buffers import sensor_buffers
+from shared_state import shared_state
+from alert_stream import alert_hub
+from alert_cache import alert_state_cache
+from alert_rules import rule_engine
+from hr_baseline import hr_baseline
+from patient_cache import patient_cache
+from ingest_queue import ingest_queue
+from stream_owner import stream_owner, stream_owner_enabled
+from retention import retention_scheduler
+from password_hashing import password_hasher
+from backfill import import_recording_command
+from rollups import backfill_rollups_command
+from db_profile import apply_sqlite_profile, engine_options
+from metrics import metrics
+from app_logging import async_logging
 
-def create_app():
+def create_app(config_overrides=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if config_overrides:
+        app.config.update(config_overrides)
+    # Boşsa SHARED_STATE_URL'ye göre karar verilir; dedektörler başlangıçta
+    # yalnızca tek süreçte ya da akış sahibinde yüklenir
+    app.config['STREAM_OWNER_ENABLED'] = stream_owner_enabled(app.config)
+
+    # Kuyruk tabanlı JSON loglama; istek iş parçacığı konsola yazmaz
+    async_logging.init_app(app)
 
     # CORS ayarlarını etkinleştir (mobil uygulama için gerekli)
     CORS(app, resources={r"/*": {"origins": "*"}})
 
+    # Bağlantı havuzu ve SQLite PRAGMA profili (WAL, busy_timeout, önbellek)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
     db.init_app(app)
     JWTManager(app)
 
     app.register_blueprint(api)
 
     with app.app_context():
+        apply_sqlite_profile(app)
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+
+    # Worker süreçleri arasında önbellek tutarlılığı (SHARED_STATE_URL)
+    shared_state.init_app(app)
+
+    # Hareketsizlik takibini son IMU kayıtlarından yeniden oluştur
+    inactivity_tracker.init_app(app)
+    alert_hub.init_app(app)
+    alert_state_cache.init_app(app)
+    # Uyarı kuralları bir kez derlenir; durumları bellekte tutulur
+    rule_engine.init_app(app)
+    # Nabız temel çizgisi: son anlık görüntüden yüklenir, periyodik olarak yazılır
+    hr_baseline.init_app(app)
+    patient_cache.init_app(app)
+    sensor_buffers.init_app(app)
+    fall_detector.init_app(app)
+    ingest_queue.init_app(app)
+    # Birden fazla süreçte akış dedektörlerini tek süreç çalıştırır
+    stream_owner.init_app(app)
+    retention_scheduler.init_app(app)
+    # Parola özetleme ayrı süreç havuzunda (giriş patlamaları veri alımını yavaşlatmasın)
+    password_hasher.init_app(app)
+    # Çevrimdışı kayıtların toplu içe aktarımı: flask import-recording
+    app.cli.add_command(import_recording_command)
+    # Özet tabloları öncesinden kalan ham satırlar için: flask backfill-rollups
+    app.cli.add_command(backfill_rollups_command)
+
+    # İstek ve sorgu ölçümleri (METRICS_ENABLED ve METRICS_TOKEN varsa /metrics)
+    metrics.init_app(app)
+    metrics.export('patient_cache_hits_total', 'counter', 'Patient threshold cache hits.', lambda: patient_cache.stats()['hits'])
+    metrics.export('patient_cache_misses_total', 'counter', 'Patient threshold cache misses.', lambda: patient_cache.stats()['misses'])
+    metrics.export('patient_cache_size', 'gauge', 'Patients held in the threshold cache.', lambda: patient_cache.stats()['size'])
+    metrics.export('sensor_buffer_bytes', 'gauge', 'Memory held by the per-patient sensor buffers.', sensor_buffers.memory_bytes)
+    metrics.export('hr_baseline_patients', 'gauge', 'Patients with a heart rate baseline in memory.', lambda: len(hr_baseline))
+    metrics.export('ingest_queue_depth', 'gauge', 'Rows waiting for the ingest writer.', ingest_queue.depth)
+    metrics.export('ingest_queue_failed_rows_total', 'counter', 'Queued rows dropped after failed commits.', lambda: ingest_queue.failed_rows)
 
     return app
 
 if __name__ == '__main__':
     app = create_app()
+    # Development server only; production runs under gunicorn:
+    #   gunicorn -c gunicorn.conf.py wsgi:app
     # Host '0.0.0.0' allows access from other devices on the LAN
     app.run(host='0.0.0.0', port=5000, debug=True)
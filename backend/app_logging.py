@@ -0,0 +1,139 @@
+import atexit
+import copy
+import itertools
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+ROOT_LOGGER = 'healthcare'
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields) -> None:
+    """Log `event` with structured `fields`; skipped cheaply below the configured level."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, event and the event fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif getattr(record, 'exc_formatted', None):
+            # Formatted by _DroppingQueueHandler.prepare() before queueing
+            entry['exc'] = record.exc_formatted
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Pass one in `every` records below WARNING; warnings and errors always pass."""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        return next(self._counter) % self.every == 0
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: records are dropped when the queue is full."""
+
+    _exc_formatter = logging.Formatter()
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Copy of `record` that can cross to the listener thread: args merged
+        into the message and the traceback formatted into `exc_formatted`.
+        The default prepare() appends the traceback to the message instead,
+        which would end up in `event`.
+        """
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_formatted = self._exc_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AsyncLogging:
+    """
+    Structured logging for the `healthcare.*` loggers. Request threads only
+    put records on a bounded queue; a QueueListener thread formats them as
+    JSON lines and writes them to stderr (or the handler given to init_app).
+    High-volume ingest events are sampled with LOG_INGEST_SAMPLE_EVERY.
+    """
+
+    def __init__(self):
+        self._listener = None
+        self._handler = None
+
+    def init_app(self, app, handler: logging.Handler = None) -> None:
+        self.stop()
+
+        if handler is None:
+            handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+
+        self._handler = _DroppingQueueHandler(queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE']))
+        self._listener = QueueListener(self._handler.queue, handler, respect_handler_level=True)
+
+        root = logging.getLogger(ROOT_LOGGER)
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(self._handler)
+        root.setLevel(app.config['LOG_LEVEL'].upper())
+        root.propagate = False
+
+        ingest = get_logger('ingest')
+        for old in list(ingest.filters):
+            ingest.removeFilter(old)
+        ingest.addFilter(SamplingFilter(app.config['LOG_INGEST_SAMPLE_EVERY']))
+
+        self._listener.start()
+        atexit.register(self.stop)
+
+    @property
+    def dropped(self) -> int:
+        return self._handler.dropped if self._handler is not None else 0
+
+    def stop(self) -> None:
+        """Write out everything queued so far and stop the listener thread."""
+        if self._listener is None:
+            return
+        self._listener.stop()
+        self._listener = None
+        atexit.unregister(self.stop)
+
+
+async_logging = AsyncLogging()
@@ -0,0 +1,21 @@
+"""
+ASGI entry point of the asyncio ingest service (asgi_ingest.py), serving
+only the /api/wearable/* endpoints next to the Flask app (wsgi.py):
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --no-access-log
+
+Point the wristlets at this port. Both servers must share SHARED_STATE_URL
+so threshold changes and alerts reach each other's caches and alert streams,
+and the stream detectors run in one of the processes (see stream_owner.py).
+"""
+import os
+
+# Same default as gunicorn.conf.py
+if not os.environ.get('SHARED_STATE_URL'):
+    instance = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+    os.environ['SHARED_STATE_URL'] = f'sqlite:///{os.path.join(instance, "shared_state.db")}'
+
+from app import create_app  # noqa: E402
+from asgi_ingest import IngestService  # noqa: E402
+
+app = IngestService(create_app())
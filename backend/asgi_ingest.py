@@ -0,0 +1,326 @@
+"""
+Asyncio ingest service for the /api/wearable/* endpoints, for deployments
+with many wristlets keeping connections open at the same time. It is a
+plain ASGI application (see asgi.py) in front of an async SQLAlchemy engine
+(aiosqlite for SQLite, asyncpg for PostgreSQL) on the same database and
+models as the Flask app, and applies the same parsing and alerting rules
+(wearable.py). A waiting request costs a coroutine, not a thread: requests
+only hold a connection while their statements run.
+
+The in-memory caches (patients, alert dedup) are this process's own; they
+follow changes made by the Flask workers through shared_state, so both must
+use the same SHARED_STATE_URL. With it set, the stream detectors do not run
+here but in the stream owner (see stream_owner), which sees the samples of
+every process.
+"""
+import asyncio
+import contextlib
+import json
+
+import jwt
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from models import db, Patient, HeartRate, IMUData
+from patient_cache import patient_cache
+from inactivity import inactivity_tracker
+from ingest_queue import ingest_queue
+from rollups import rollup_upsert
+from db_profile import apply_sqlite_profile
+from app_logging import get_logger
+from identity import may_have_patient_profile
+from wearable import (
+    IngestError, parse_timestamp, packed_rows, heart_rate_rows, imu_rows, imu_batch_rows,
+    button_alert, reported_inactivity_alert, device_fall_alert, record_samples,
+)
+from stream_owner import stream_owner
+import packed_ingest
+
+log = get_logger('asgi_ingest')
+
+# Async driver for each backend of SQLALCHEMY_DATABASE_URI
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+JSON_HEADERS = [(b'content-type', b'application/json')]
+
+
+class HTTPError(Exception):
+    """Ends a request early with `status` and JSON `body`."""
+
+    def __init__(self, status: int, body: dict):
+        super().__init__(status, body)
+        self.status = status
+        self.body = body
+
+
+class Request:
+    """Body and content type of one upload, and the claims of its access token."""
+
+    def __init__(self, mimetype: str, body: bytes, claims: dict):
+        self.mimetype = mimetype
+        self.body = body
+        self.claims = claims
+
+    def json(self) -> dict:
+        """The body as a JSON object, rejected the way Flask's request.get_json() would be."""
+        if self.mimetype != 'application/json' and not self.mimetype.endswith('+json'):
+            raise IngestError('Content-Type must be application/json', 415)
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise IngestError('Invalid JSON body')
+        if not isinstance(data, dict):
+            raise IngestError('JSON object required')
+        return data
+
+
+def async_database_url(app):
+    """ASYNC_DATABASE_URL, or the Flask app's database URL with its async driver. Needs an app context."""
+    if app.config['ASYNC_DATABASE_URL']:
+        return app.config['ASYNC_DATABASE_URL']
+    url = db.engine.url
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver for {backend}, set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class IngestService:
+    """
+    ASGI application serving the wearable endpoints of `app` (a Flask app
+    from create_app, which also sets up the shared in-memory state). Tokens
+    are the JWTs issued by /auth/login, verified with the same settings as
+    Flask-JWT-Extended. Error responses match the Flask endpoints.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.engine = None
+        self.sessions = None
+        self.write_lock = None
+        self.max_body = app.config['INGEST_MAX_BODY_BYTES']
+        self.max_samples = app.config['IMU_BATCH_MAX_SAMPLES']
+        self.routes = {
+            '/api/wearable/heart_rate': self.heart_rate,
+            '/api/wearable/imu': self.imu,
+            '/api/wearable/imu/batch': self.imu_batch,
+            '/api/wearable/button': self.button,
+            '/api/wearable/inactivity': self.inactivity,
+            '/api/wearable/fall': self.fall,
+        }
+
+    def start(self) -> None:
+        """Create the async engine; called at lifespan start-up, or on the first request."""
+        if self.engine is not None:
+            return
+        with self.app.app_context():
+            url = async_database_url(self.app)
+        self.engine = create_async_engine(url, **self.app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        apply_sqlite_profile(self.app, self.engine.sync_engine)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        # SQLite has a single writer: transactions queue here in arrival
+        # order instead of polling for the database lock (busy_timeout)
+        # while holding pooled connections
+        self.write_lock = asyncio.Lock() if self.engine.dialect.name == 'sqlite' else contextlib.nullcontext()
+
+    async def close(self) -> None:
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        handler = self.routes.get(scope['path'])
+        try:
+            if handler is None:
+                raise HTTPError(404, {'message': 'Not found'})
+            if scope['method'] != 'POST':
+                raise HTTPError(405, {'message': 'Method not allowed'})
+            headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+            user_id, claims = self._authenticate(headers)
+            body = await self._read_body(headers, receive)
+            if body is None:
+                # Client went away
+                return
+            self.start()
+            mimetype = headers.get('content-type', '').split(';')[0].strip().lower()
+            status, payload, extra_headers = await handler(user_id, Request(mimetype, body, claims))
+        except HTTPError as e:
+            status, payload, extra_headers = e.status, e.body, []
+        except IngestError as e:
+            status, payload, extra_headers = e.status, {'message': e.message}, []
+        except Exception:
+            log.error('request_failed', exc_info=True, extra={'fields': {'path': scope['path']}})
+            status, payload, extra_headers = 500, {'message': 'Internal server error'}, []
+
+        body = json.dumps(payload).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': JSON_HEADERS + [(b'content-length', str(len(body)).encode())] + extra_headers,
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _authenticate(self, headers: dict):
+        """(user id, claims) of the request's access token, checked like @jwt_required()."""
+        config = self.app.config
+        header = headers.get('authorization')
+        if not header:
+            raise HTTPError(401, {'msg': 'Missing Authorization Header'})
+        scheme, _, token = header.partition(' ')
+        if scheme != config['JWT_HEADER_TYPE'] or not token:
+            raise HTTPError(422, {'msg': "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'"})
+        try:
+            claims = jwt.decode(
+                token,
+                config['JWT_SECRET_KEY'],
+                algorithms=config['JWT_DECODE_ALGORITHMS'] or [config['JWT_ALGORITHM']],
+                leeway=config['JWT_DECODE_LEEWAY'],
+                audience=config['JWT_DECODE_AUDIENCE'],
+                issuer=config['JWT_DECODE_ISSUER'],
+            )
+        except jwt.ExpiredSignatureError:
+            raise HTTPError(401, {'msg': 'Token has expired'})
+        except jwt.InvalidTokenError as e:
+            raise HTTPError(422, {'msg': str(e)})
+        if claims.get('type') != 'access':
+            raise HTTPError(422, {'msg': 'Only non-refresh tokens are allowed'})
+        try:
+            return int(claims[config['JWT_IDENTITY_CLAIM']]), claims
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(422, {'msg': 'Invalid token identity'})
+
+    async def _read_body(self, headers: dict, receive):
+        """The request body, at most INGEST_MAX_BODY_BYTES; None if the client disconnected."""
+        too_large = HTTPError(413, {'message': f'Request body too large (max {self.max_body} bytes)'})
+        if int(headers.get('content-length') or 0) > self.max_body:
+            raise too_large
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body:
+                raise too_large
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    # --- Endpoints, see the routes of the same name in routes.py ---
+
+    async def heart_rate(self, user_id: int, request: Request):
+        if packed_ingest.is_packed(request.mimetype):
+            rows = packed_rows(HeartRate, user_id, request.mimetype, request.body, self.max_samples)
+        else:
+            rows = heart_rate_rows(user_id, request.json())
+        return await self._ingest(HeartRate, user_id, rows, request.claims, {'message': 'Heart rate data processed'})
+
+    async def imu(self, user_id: int, request: Request):
+        rows = imu_rows(user_id, request.json())
+        return await self._ingest(IMUData, user_id, rows, request.claims, {'message': 'IMU data processed'})
+
+    async def imu_batch(self, user_id: int, request: Request):
+        if packed_ingest.is_packed(request.mimetype):
+            rows = packed_rows(IMUData, user_id, request.mimetype, request.body, self.max_samples)
+        else:
+            rows = imu_batch_rows(user_id, request.json(), self.max_samples)
+        rows.sort(key=lambda row: row['timestamp'])
+        return await self._ingest(IMUData, user_id, rows, request.claims,
+                                  {'message': 'IMU batch processed', 'count': len(rows)})
+
+    async def button(self, user_id: int, request: Request):
+        data = request.json()
+        panic = data.get('panic_button_status')
+        if panic is None:
+            return 400, {'message': 'Status required'}, []
+        if panic:
+            await self._add_alert(button_alert(user_id, parse_timestamp(data.get('timestamp'))))
+        return 201, {'message': 'Button status processed'}, []
+
+    async def inactivity(self, user_id: int, request: Request):
+        data = request.json()
+        if not data.get('inactivity_detected'):
+            return 200, {'message': 'No inactivity detected'}, []
+        alert = reported_inactivity_alert(user_id, parse_timestamp(data.get('timestamp')))
+        if alert is None:
+            return 200, {'message': 'Inactivity already reported recently'}, []
+        await self._add_alert(alert)
+        return 201, {'message': 'Inactivity alert created'}, []
+
+    async def fall(self, user_id: int, request: Request):
+        data = request.json()
+        probability = data.get('probability')
+        if probability is None:
+            return 400, {'message': 'Probability required'}, []
+        alert = device_fall_alert(user_id, probability, data.get('bpm'), parse_timestamp(data.get('timestamp')))
+        if alert is None:
+            return 200, {'message': 'Fall already reported recently'}, []
+        await self._add_alert(alert)
+        return 201, {'message': 'Fall alert created'}, []
+
+    # --- Storage ---
+
+    async def _ingest(self, model, user_id: int, rows: list, claims: dict, response: dict):
+        """
+        Async counterpart of store_samples plus the alert checks: the rows,
+        their rollups and the alerts stream_owner.alerts() returns for them
+        are committed in one transaction. The detectors run without awaiting
+        in between, so concurrent requests see each other's in-memory updates.
+        """
+        async with self.write_lock, self.sessions() as session:
+            patient = await self._patient(session, user_id) if may_have_patient_profile(claims) else None
+            if patient is None:
+                return 404, {'message': 'Patient not found'}, []
+            if model is IMUData and not stream_owner.enabled and not inactivity_tracker.is_tracked(user_id):
+                history = await session.execute(inactivity_tracker.history_query(patient, rows[0]['timestamp']))
+                inactivity_tracker.seed(patient, history.all())
+
+            if ingest_queue.enabled:
+                if not ingest_queue.put(model, rows):
+                    return 503, {'message': 'Ingest queue full, retry later'}, [(b'retry-after', b'1')]
+            else:
+                await session.execute(insert(model), rows)
+                upsert = rollup_upsert(model, rows, self.engine.dialect.name)
+                if upsert:
+                    await session.execute(*upsert)
+            record_samples(model, rows)
+
+            session.add_all(stream_owner.alerts(model, patient, rows))
+            await session.commit()
+        return 201, response, []
+
+    async def _patient(self, session, user_id: int):
+        """PatientThresholds from the patient cache, loaded with `session` on a miss."""
+        thresholds = patient_cache.cached(user_id)
+        if thresholds is None:
+            patient = await session.scalar(select(Patient).where(Patient.user_id == user_id))
+            if patient is not None:
+                thresholds = patient_cache.remember(patient)
+        return thresholds
+
+    async def _add_alert(self, alert) -> None:
+        async with self.write_lock, self.sessions() as session:
+            session.add(alert)
+            await session.commit()
@@ -0,0 +1,289 @@
+"""
+Bulk import of wristlet recordings uploaded after the device was offline
+(POST /api/wearable/backfill and `flask import-recording`).
+
+A recording is CSV with a header row or NDJSON, one sample per row/line:
+
+    timestamp,value,x_axis,y_axis,z_axis,gx,gy,gz
+    2024-05-01T10:00:00+00:00,,0.1,0.0,9.8,,,
+    2024-05-01T10:00:00.5+00:00,72,,,,,,
+
+A row with `value` is a heart rate sample, one with x/y/z_axis an IMU
+sample. `timestamp` is required, as ISO 8601 (naive means UTC) or epoch
+seconds. Rows are streamed into chunked executemany inserts, each chunk in
+its own transaction with its rollups, and through the alert rules (with
+their own state, apart from the live stream's) and the patient's heart rate
+baseline, which learns from it. When a stream owner runs the detectors (see
+stream_owner) it reads the imported rows like any others, and the rules and
+the baseline are left to it; duration and rate-of-change rules then only see
+the samples newer than the patient's last live one. Once the input ends, the
+inactivity and fall detectors run once over the whole imported range. The
+alerts the live endpoints would have raised are then created; like there,
+at most one of each type, since it stays open until a caregiver resolves it.
+"""
+import csv
+import json
+import logging
+import math
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+
+from models import db, Alert, HeartRate, IMUData
+from inactivity import inactivity_tracker, first_inactive
+from fall_detection import fall_detector, find_impacts, classify_impacts
+from alert_cache import alert_state_cache
+from patient_cache import patient_cache
+from rollups import update_rollups
+from metrics import metrics
+from app_logging import get_logger, log_event
+from alert_rules import ALERT_COOLDOWN, RuleStateStore, rule_engine
+from hr_baseline import hr_baseline
+from stream_owner import stream_owner
+
+log = get_logger('backfill')
+
+FORMATS = ('csv', 'ndjson')
+
+# Request Content-Type -> recording format
+MIMETYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+# Numeric columns of a recording row
+COLUMNS = ('value', 'x_axis', 'y_axis', 'z_axis', 'gx', 'gy', 'gz')
+
+
+class BackfillError(ValueError):
+    """A malformed recording row; `line` is 1-based."""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def _numbers(record: dict, names: tuple, line: int) -> list:
+    """Floats of `record`'s `names` columns, None where empty."""
+    numbers = []
+    for name in names:
+        value = record.get(name)
+        if value is None or value == '':
+            numbers.append(None)
+            continue
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise BackfillError(line, f'{name} must be a number')
+        if not math.isfinite(number):
+            raise BackfillError(line, f'{name} must be finite')
+        numbers.append(number)
+    return numbers
+
+
+def _timestamp(value, line: int) -> datetime:
+    if value is None or value == '':
+        raise BackfillError(line, 'timestamp required')
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value, timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise BackfillError(line, 'timestamp must be ISO 8601 or epoch seconds')
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        try:
+            return datetime.fromtimestamp(float(value), timezone.utc)
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise BackfillError(line, 'timestamp must be ISO 8601 or epoch seconds')
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def read_records(lines, fmt: str):
+    """Yield (line number, dict of column -> raw value) from CSV or NDJSON `lines`."""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise BackfillError(line_no, 'invalid JSON')
+            if not isinstance(record, dict):
+                raise BackfillError(line_no, 'JSON object required')
+            yield line_no, record
+    else:
+        raise ValueError(f'Unknown recording format: {fmt}')
+
+
+class Backfill:
+    """
+    One import for one patient: buffers rows per model, writes them
+    `chunk_size` at a time and runs the alert rules on each chunk, and keeps
+    the accelerometer columns as compact arrays for the final pass.
+    """
+
+    def __init__(self, patient, chunk_size: int):
+        self.patient = patient
+        self.chunk_size = chunk_size
+        self.pending = {HeartRate: [], IMUData: []}
+        self.counts = {HeartRate: 0, IMUData: 0}
+        self.rule_state = RuleStateStore()
+        self.rule_alerts = {}
+        self.imu_t, self.imu_acc = array('d'), array('d')
+
+    def add(self, line: int, record: dict) -> None:
+        timestamp = _timestamp(record.get('timestamp'), line)
+        value, x, y, z, gx, gy, gz = _numbers(record, COLUMNS, line)
+        if value is not None:
+            self._pending(HeartRate, {'user_id': self.patient.user_id, 'timestamp': timestamp, 'value': value})
+            return
+
+        if x is None or y is None or z is None:
+            raise BackfillError(line, 'value or x_axis/y_axis/z_axis required')
+        self.imu_t.append(timestamp.timestamp())
+        self.imu_acc.extend((x, y, z))
+        self._pending(IMUData, {'user_id': self.patient.user_id, 'timestamp': timestamp,
+                                'x_axis': x, 'y_axis': y, 'z_axis': z, 'gx': gx, 'gy': gy, 'gz': gz})
+
+    def _pending(self, model, row: dict) -> None:
+        rows = self.pending[model]
+        rows.append(row)
+        if len(rows) >= self.chunk_size:
+            self.flush(model)
+
+    def flush(self, model=None) -> None:
+        """Write the buffered rows of `model` (default: all) in one transaction."""
+        for model in ([model] if model else list(self.pending)):
+            rows = self.pending[model]
+            if not rows:
+                continue
+            db.session.execute(model.__table__.insert(), rows)
+            update_rollups(model, rows)
+            db.session.commit()
+            if not stream_owner.enabled:
+                # Otherwise the stream owner reads the rows back and runs them
+                # through the rules and the baseline, like live samples
+                alerts = rule_engine.evaluate(self.patient, model, rows, self.rule_state)
+                if model is HeartRate:
+                    alerts += hr_baseline.observe(self.patient, rows)
+                for alert in alerts:
+                    self.rule_alerts.setdefault(alert.type, alert)
+            self.counts[model] += len(rows)
+            metrics.count_samples(model.__tablename__, len(rows))
+            self.pending[model] = []
+
+    def alerts(self) -> list:
+        """
+        The alerts raised by the rules while importing, plus those of the
+        inactivity and fall detectors run once over everything imported
+        (new Alerts, not yet added).
+        """
+        alerts = list(self.rule_alerts.values())
+        if len(self.imu_t):
+            t = np.frombuffer(self.imu_t)
+            acc = np.frombuffer(self.imu_acc).reshape(-1, 3)
+            order = np.argsort(t, kind='stable')
+            t, acc = t[order], acc[order]
+
+            if 'INACTIVITY' not in self.rule_alerts and not alert_state_cache.has_open(self.patient.user_id, 'INACTIVITY'):
+                index = self._first_inactive(t, acc)
+                if index is not None:
+                    alerts.append(self._alert('INACTIVITY', 'Patient inactive', t[index]))
+
+            if fall_detector.enabled and 'FALL' not in self.rule_alerts:
+                falls = classify_impacts(t, acc, find_impacts(t, acc, -np.inf, np.inf))
+                fall_t = np.array([fall['timestamp'].timestamp() for fall in falls])
+                index = self._first_eligible('FALL', fall_t, np.arange(len(falls)))
+                if index is not None:
+                    fall = falls[index]
+                    message = f"Fall detected by server (impact={fall['peak_g']:.1f}g, tilt={fall['tilt_degrees']:.0f}deg)"
+                    alerts.append(self._alert('FALL', message, fall_t[index]))
+        return alerts
+
+    def _first_eligible(self, alert_type: str, t: np.ndarray, indices: np.ndarray):
+        """First of `indices` should_create_alert would accept, or None (vectorized cooldown check)."""
+        if not len(indices) or alert_state_cache.has_open(self.patient.user_id, alert_type):
+            return None
+        last = alert_state_cache.last_timestamp(self.patient.user_id, alert_type)
+        if last is not None:
+            indices = indices[t[indices] - last.timestamp() >= ALERT_COOLDOWN.total_seconds()]
+        return int(indices[0]) if len(indices) else None
+
+    def _first_inactive(self, t: np.ndarray, acc: np.ndarray):
+        """First imported sample at which the patient was inactive, continuing from the stored samples before it."""
+        before = datetime.fromtimestamp(t[0], timezone.utc)
+        history = db.session.execute(inactivity_tracker.history_query(self.patient, before)).all()
+        if history:
+            t = np.concatenate([[row[0].replace(tzinfo=timezone.utc).timestamp() for row in history], t])
+            acc = np.vstack([np.array([row[1:] for row in history], dtype=float), acc])
+        window = timedelta(minutes=self.patient.inactivity_limit_minutes).total_seconds()
+        index = first_inactive(t, acc, window, start=len(history))
+        return None if index is None else index - len(history)
+
+    def _alert(self, alert_type: str, message: str, epoch: float) -> Alert:
+        return Alert(user_id=self.patient.user_id, type=alert_type, message=message,
+                     timestamp=datetime.fromtimestamp(epoch, timezone.utc))
+
+
+def import_recording(lines, fmt: str, patient, chunk_size: int) -> dict:
+    """
+    Import a recording for `patient` (PatientThresholds) and raise the missed
+    alerts. A malformed row stops the import; the rows before it stay
+    imported and are still checked. Returns the counts, the alert types
+    raised and the error message, if any.
+    """
+    backfill = Backfill(patient, chunk_size)
+    error = None
+    try:
+        for line, record in read_records(lines, fmt):
+            backfill.add(line, record)
+    except BackfillError as e:
+        error = str(e)
+    backfill.flush()
+
+    # The stream owner, or another upload, may have raised one meanwhile
+    alerts = [alert for alert in backfill.alerts()
+              if not alert_state_cache.has_open(patient.user_id, alert.type)]
+    if alerts:
+        db.session.add_all(alerts)
+        db.session.commit()
+    result = {
+        'heart_rate': backfill.counts[HeartRate],
+        'imu_data': backfill.counts[IMUData],
+        'alerts': [alert.type for alert in alerts],
+        'error': error,
+    }
+    log_event(log, logging.INFO, 'recording_imported', user_id=patient.user_id, **result)
+    return result
+
+
+@click.command('import-recording')
+@click.argument('path', type=click.File('r', encoding='utf-8'))
+@click.option('--user-id', type=int, required=True, help='Patient user id the recording belongs to.')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help='Recording format (default: from the file extension, .csv or .ndjson/.jsonl).')
+@with_appcontext
+def import_recording_command(path, user_id, fmt):
+    """Import a wristlet recording (CSV or NDJSON, '-' for stdin) and raise missed alerts."""
+    if fmt is None:
+        fmt = 'csv' if path.name.endswith('.csv') else 'ndjson'
+    patient = patient_cache.get(user_id)
+    if patient is None:
+        raise click.ClickException(f'Patient {user_id} not found')
+    result = import_recording(path, fmt, patient, current_app.config['BACKFILL_CHUNK_SIZE'])
+    click.echo(f"Imported {result['heart_rate']} heart rate and {result['imu_data']} IMU rows, "
+               f"alerts: {', '.join(result['alerts']) or 'none'}")
+    if result['error']:
+        raise click.ClickException(result['error'])
@@ -0,0 +1,613 @@
+"""
+Load and latency benchmark for the wearable and alert endpoints.
+
+Seeds a dedicated SQLite database with synthetic patients and a large
+IMUData/HeartRate/Alert history, then drives the API over HTTP with
+concurrent simulated wristlets (IMU + heart rate posts) and caregiver
+pollers (GET /api/alerts) for a fixed duration. The result is written as
+JSON: requests/second and p50/p90/p99 latency per endpoint.
+
+    python benchmark.py --imu-rows 2000000 --hr-rows 500000 --duration 60 \\
+        --report bench_report.json
+
+By default an in-process threaded server is started against the benchmark
+database. Use --target to load an already running server instead (it must
+use the same database for the seeded users to exist). Use --baseline to
+compare against an earlier report and exit with status 1 on a regression.
+
+With --scale the same load is run against gunicorn (gunicorn.conf.py) once
+per worker count, and the report shows how throughput scales with cores:
+
+    python benchmark.py --scale 1,2,4 --duration 20
+
+--sqlite-profile picks the database profile (db_profile.SQLITE_PROFILES);
+comparing 'rollback' with 'wal' under the same mix of concurrent ingest and
+alert reads shows what the WAL profile buys:
+
+    python benchmark.py --sqlite-profile rollback --report rollback.json
+    python benchmark.py --sqlite-profile wal --baseline rollback.json
+
+--async-ingest sends the wristlet traffic to the asyncio ingest service
+(asgi.py under uvicorn) while logins and pollers stay on the Flask server;
+raise --wristlets to see how each copes with many open device connections:
+
+    python benchmark.py --wristlets 200 --report flask.json
+    python benchmark.py --wristlets 200 --async-ingest --baseline flask.json
+
+--login-storm adds clients that sign in back to back; the wearable p99
+should stay where it is without the storm as long as hashing runs in its
+pool (--password-hash-workers 0 shows what inline hashing costs). Run it
+against gunicorn (--gunicorn N workers): its fixed thread count is what a
+storm can exhaust, the in-process server starts a thread per connection:
+
+    python benchmark.py --gunicorn 1 --report calm.json
+    python benchmark.py --gunicorn 1 --login-storm 20 --baseline calm.json
+    python benchmark.py --gunicorn 1 --login-storm 20 --password-hash-workers 0 --baseline calm.json
+
+--hr-baseline N skips the HTTP load and measures the streaming heart rate
+baseline in-process instead: samples/s scored for N patients at once, the
+memory per patient and the time to snapshot and reload all of them:
+
+    python benchmark.py --hr-baseline 5000 --hr-baseline-rounds 300
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from sqlalchemy import func, insert, select
+from werkzeug.security import generate_password_hash
+
+BENCH_PASSWORD = 'bench-password'
+SEED_CHUNK = 50000
+ALERT_TYPES = ('HR_HIGH', 'HR_LOW', 'INACTIVITY', 'FALL', 'BUTTON')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def seed(app, args):
+    """
+    Create the benchmark users and bulk-load the sensor history. An already
+    seeded database is reused as is; returns the number of benchmark patients.
+    """
+    from models import db, User, Patient, IMUData, HeartRate, Alert
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        if args.reseed:
+            db.drop_all()
+            db.create_all()
+
+        if User.query.filter_by(username='bench_caregiver').first():
+            patients = User.query.filter(User.username.like('bench_patient_%')).count()
+            print(f'Reusing seeded database with {patients} patients (use --reseed to start over)')
+            return patients
+
+        password_hash = generate_password_hash(BENCH_PASSWORD)
+        db.session.execute(insert(User), [
+            {'username': 'bench_caregiver', 'password_hash': password_hash, 'user_type': 'caregiver'}
+        ] + [
+            {'username': f'bench_patient_{i}', 'password_hash': password_hash, 'user_type': 'patient'}
+            for i in range(args.patients)
+        ])
+        patient_ids = list(db.session.execute(
+            select(User.id).where(User.username.like('bench_patient_%')).order_by(User.id)
+        ).scalars())
+        db.session.execute(insert(Patient), [{'user_id': user_id} for user_id in patient_ids])
+        db.session.commit()
+
+        now = datetime.now(timezone.utc)
+        span = timedelta(days=args.history_days).total_seconds()
+
+        def spread(i, total):
+            return now - timedelta(seconds=span * (1 - i / total))
+
+        def bulk(model, total, make_row):
+            started = time.perf_counter()
+            for start in range(0, total, SEED_CHUNK):
+                rows = [make_row(i) for i in range(start, min(start + SEED_CHUNK, total))]
+                db.session.execute(insert(model), rows)
+                db.session.commit()
+            elapsed = time.perf_counter() - started
+            print(f'Seeded {total} {model.__tablename__} rows in {elapsed:.1f}s')
+
+        bulk(IMUData, args.imu_rows, lambda i: {
+            'user_id': patient_ids[i % len(patient_ids)], 'timestamp': spread(i, args.imu_rows),
+            'x_axis': rng.gauss(0, 0.3), 'y_axis': rng.gauss(0, 0.3), 'z_axis': rng.gauss(9.8, 0.3),
+            'gx': 0.0, 'gy': 0.0, 'gz': 0.0,
+        })
+        bulk(HeartRate, args.hr_rows, lambda i: {
+            'user_id': patient_ids[i % len(patient_ids)], 'timestamp': spread(i, args.hr_rows),
+            'value': rng.gauss(75, 10),
+        })
+        bulk(Alert, args.alerts, lambda i: {
+            'user_id': patient_ids[i % len(patient_ids)], 'timestamp': spread(i, args.alerts),
+            'type': ALERT_TYPES[i % len(ALERT_TYPES)], 'message': 'Seeded alert',
+            'is_resolved': i < args.alerts - len(patient_ids), 'updated_at': spread(i, args.alerts),
+        })
+    return args.patients
+
+
+def dataset_size(app):
+    from models import db, User, IMUData, HeartRate, Alert
+
+    with app.app_context():
+        return {
+            'patients': db.session.scalar(select(func.count(User.id)).where(User.user_type == 'patient')),
+            'imu_rows': db.session.scalar(select(func.count(IMUData.id))),
+            'hr_rows': db.session.scalar(select(func.count(HeartRate.id))),
+            'alerts': db.session.scalar(select(func.count(Alert.id))),
+        }
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency and status collection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+            if status is None or status >= 400 and status != 304:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, duration):
+        result = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            result[endpoint] = {
+                'requests': len(values),
+                'errors': self.errors.get(endpoint, 0),
+                'statuses': self.statuses[endpoint],
+                'rps': round(len(values) / duration, 2),
+                'mean_ms': round(sum(values) / len(values) * 1000, 3),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+                'p90_ms': round(percentile(values, 0.90) * 1000, 3),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+                'max_ms': round(values[-1] * 1000, 3),
+            }
+        return result
+
+
+class Client:
+    """Keep-alive HTTP/1.1 client, one per simulated device."""
+
+    def __init__(self, base_url, recorder, token=None):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.recorder = recorder
+        self.token = token
+        self.conn = None
+
+    def request(self, method, path, body=None, endpoint=None, headers=None):
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+
+        started = time.perf_counter()
+        status, data, response_headers = None, None, {}
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+            response_headers = dict(response.getheaders())
+            if response.getheader('Connection', '').lower() == 'close':
+                self.conn.close()
+                self.conn = None
+        except (OSError, http.client.HTTPException):
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = None
+        elapsed = time.perf_counter() - started
+        if endpoint:
+            self.recorder.record(endpoint, status, elapsed)
+        return status, data, response_headers
+
+
+def login(base_url, username):
+    client = Client(base_url, Recorder())
+    status, data, _ = client.request('POST', '/auth/login', {'username': username, 'password': BENCH_PASSWORD})
+    if status != 200:
+        raise SystemExit(f'Login failed for {username}: {status} {data!r}')
+    return json.loads(data)['access_token']
+
+
+def wristlet(base_url, token, recorder, args, stop, rng):
+    client = Client(base_url, recorder, token)
+    interval = 1.0 / args.imu_hz if args.imu_hz else 0.0
+    iteration = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        if args.imu_batch > 1:
+            step = interval or 0.01
+            client.request('POST', '/api/wearable/imu/batch', {'samples': [
+                {'x_axis': rng.gauss(0, 0.3), 'y_axis': rng.gauss(0, 0.3), 'z_axis': rng.gauss(9.8, 0.3),
+                 'timestamp': (now - timedelta(seconds=step * (args.imu_batch - 1 - k))).isoformat()}
+                for k in range(args.imu_batch)
+            ]}, endpoint='POST /api/wearable/imu/batch')
+        else:
+            client.request('POST', '/api/wearable/imu', {
+                'x_axis': rng.gauss(0, 0.3), 'y_axis': rng.gauss(0, 0.3), 'z_axis': rng.gauss(9.8, 0.3),
+                'gx': 0.0, 'gy': 0.0, 'gz': 0.0, 'timestamp': now.isoformat(),
+            }, endpoint='POST /api/wearable/imu')
+        if iteration % args.hr_every == 0:
+            client.request('POST', '/api/wearable/heart_rate', {
+                'value': rng.gauss(75, 25), 'timestamp': now.isoformat(),
+            }, endpoint='POST /api/wearable/heart_rate')
+        iteration += 1
+
+        pause = interval * max(args.imu_batch, 1) - (time.perf_counter() - started)
+        if pause > 0:
+            stop.wait(pause)
+
+
+def login_storm(base_url, username, recorder, stop):
+    """A phone signing in again and again, as after a ward's tokens expire at once."""
+    client = Client(base_url, recorder)
+    while not stop.is_set():
+        status, _, _ = client.request('POST', '/auth/login', {'username': username, 'password': BENCH_PASSWORD},
+                                      endpoint='POST /auth/login')
+        if status == 503:
+            stop.wait(1.0)  # Retry-After
+
+
+def poller(base_url, token, recorder, args, stop):
+    client = Client(base_url, recorder, token)
+    etag = None
+    while not stop.is_set():
+        headers = {'If-None-Match': etag} if etag and args.poll_etag else None
+        status, _, response_headers = client.request('GET', '/api/alerts', endpoint='GET /api/alerts', headers=headers)
+        if status == 200:
+            etag = response_headers.get('ETag')
+        stop.wait(args.poll_interval)
+
+
+def start_server(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.port}'
+
+
+def compare(report, baseline, tolerance):
+    """Return human readable regressions of `report` against `baseline`."""
+    regressions = []
+    for endpoint, base in baseline.get('endpoints', {}).items():
+        current = report['endpoints'].get(endpoint)
+        if current is None:
+            continue
+        if current['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p99 {base['p99_ms']}ms -> {current['p99_ms']}ms")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{endpoint}: rps {base['rps']} -> {current['rps']}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'bench.db'),
+                        help='SQLite file used for the benchmark data')
+    parser.add_argument('--reseed', action='store_true', help='Drop and re-seed the benchmark database')
+    parser.add_argument('--patients', type=int, default=50)
+    parser.add_argument('--imu-rows', type=int, default=1000000)
+    parser.add_argument('--hr-rows', type=int, default=250000)
+    parser.add_argument('--alerts', type=int, default=5000)
+    parser.add_argument('--history-days', type=float, default=7)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--target', help='Base URL of a running server; default starts one in-process')
+    parser.add_argument('--gunicorn', type=int, default=0,
+                        help='Start gunicorn (gunicorn.conf.py) with this many workers instead of the in-process server')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load')
+    parser.add_argument('--wristlets', type=int, default=20, help='Concurrent simulated wristlets')
+    parser.add_argument('--imu-hz', type=float, default=0, help='IMU rate per wristlet, 0 = as fast as possible')
+    parser.add_argument('--imu-batch', type=int, default=1, help='Samples per request, >1 uses /api/wearable/imu/batch')
+    parser.add_argument('--hr-every', type=int, default=10, help='Send one heart rate per N IMU requests')
+    parser.add_argument('--pollers', type=int, default=5, help='Concurrent caregiver dashboards')
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    parser.add_argument('--poll-etag', action='store_true', help='Pollers send If-None-Match')
+    parser.add_argument('--report', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='Earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative p99/rps regression')
+    parser.add_argument('--sqlite-profile', default='wal', help='SQLITE_PROFILE of the server (wal or rollback)')
+    parser.add_argument('--login-storm', type=int, default=0, help='Concurrent clients logging in back to back')
+    parser.add_argument('--password-hash-workers', type=int, default=1,
+                        help='PASSWORD_HASH_WORKERS of the server, 0 hashes on the request thread')
+    parser.add_argument('--async-ingest', action='store_true',
+                        help='Send the wristlet traffic to the asyncio ingest service (uvicorn asgi:app)')
+    parser.add_argument('--hr-baseline', type=int, default=0,
+                        help='Benchmark the heart rate baseline in-process with this many patients')
+    parser.add_argument('--hr-baseline-rounds', type=int, default=300, help='Samples per patient for --hr-baseline')
+    parser.add_argument('--hr-baseline-batch', type=int, default=1, help='Samples per observed batch for --hr-baseline')
+    parser.add_argument('--scale', type=lambda value: [int(n) for n in value.split(',')],
+                        help='Comma separated gunicorn worker counts to compare, e.g. 1,2,4')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from app import create_app
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.abspath(args.db)}',
+        'SQLITE_PROFILE': args.sqlite_profile,
+        'PASSWORD_HASH_WORKERS': args.password_hash_workers,
+    })
+    if args.hr_baseline:
+        report = {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'hr_baseline': hr_baseline_throughput(app, args),
+        }
+        return write_report(report, args)
+
+    patients = seed(app, args)
+    dataset = dataset_size(app)
+
+    if args.scale:
+        report = {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'sqlite_profile': args.sqlite_profile,
+            'dataset': dataset,
+            'scaling': scaling(args, patients),
+        }
+        return write_report(report, args)
+
+    server = process = None
+    base_url = args.target
+    if args.gunicorn:
+        process, base_url = start_gunicorn(args, args.gunicorn)
+    elif not base_url:
+        server, base_url = start_server(app)
+    ingest, ingest_url = start_ingest_service(args) if args.async_ingest else (None, None)
+
+    try:
+        elapsed, endpoints = run_load(base_url, patients, args, ingest_url)
+    finally:
+        for child in (ingest, process):
+            if child is not None:
+                child.terminate()
+                child.wait()
+    if server is not None:
+        server.shutdown()
+
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'target': args.target or (f'gunicorn x{args.gunicorn}' if args.gunicorn else 'in-process'),
+        'ingest': 'asyncio' if args.async_ingest else 'flask',
+        'duration_s': round(elapsed, 3),
+        'load': {
+            'wristlets': args.wristlets, 'imu_hz': args.imu_hz, 'imu_batch': args.imu_batch,
+            'hr_every': args.hr_every, 'pollers': args.pollers, 'poll_interval': args.poll_interval,
+            'poll_etag': args.poll_etag, 'login_storm': args.login_storm,
+            'password_hash_workers': args.password_hash_workers,
+        },
+        'sqlite_profile': args.sqlite_profile,
+        'dataset': dataset,
+        'endpoints': endpoints,
+    }
+    return write_report(report, args)
+
+
+def run_load(base_url, patients, args, ingest_url=None):
+    """
+    Drive `base_url` for args.duration seconds; returns (elapsed, per-endpoint
+    summary). Wristlets post to `ingest_url` instead when given.
+    """
+    caregiver_token = login(base_url, 'bench_caregiver')
+    patient_tokens = [login(base_url, f'bench_patient_{i % patients}') for i in range(args.wristlets)]
+
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=wristlet, args=(ingest_url or base_url, token, recorder, args, stop,
+                                                random.Random(args.seed + i)))
+        for i, token in enumerate(patient_tokens)
+    ] + [
+        threading.Thread(target=poller, args=(base_url, caregiver_token, recorder, args, stop))
+        for _ in range(args.pollers)
+    ] + [
+        threading.Thread(target=login_storm, args=(base_url, f'bench_patient_{i % patients}', recorder, stop))
+        for i in range(args.login_storm)
+    ]
+    print(f'Driving {base_url} with {args.wristlets} wristlets and {args.pollers} pollers for {args.duration}s')
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return elapsed, recorder.summary(elapsed)
+
+
+def _start_process(command, env, port, name):
+    """Start a server process listening on `port`; returns (process, base_url) once it accepts connections."""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(command, cwd=backend_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'{name} exited with status {process.returncode}')
+        try:
+            http.client.HTTPConnection('127.0.0.1', port, timeout=1).request('GET', '/')
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f'{name} did not start within 60s')
+
+
+def _server_env(args):
+    """Environment and free port for a server process on the benchmark database."""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{os.path.abspath(args.db)}',
+        SHARED_STATE_URL=f'sqlite:///{os.path.join(backend_dir, "instance", "bench_shared_state.db")}',
+        LOG_LEVEL='WARNING',
+        SQLITE_PROFILE=args.sqlite_profile,
+        PASSWORD_HASH_WORKERS=str(args.password_hash_workers),
+    )
+    return env, port
+
+
+def start_gunicorn(args, workers):
+    """Start gunicorn with `workers` workers on the benchmark database; returns (process, base_url)."""
+    env, port = _server_env(args)
+    env.update(BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers))
+    return _start_process(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'], env, port, 'gunicorn',
+    )
+
+
+def start_ingest_service(args):
+    """Start the asyncio ingest service (asgi.py) under uvicorn; returns (process, base_url)."""
+    env, port = _server_env(args)
+    return _start_process(
+        [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port), '--no-access-log'],
+        env, port, 'uvicorn',
+    )
+
+
+def scaling(args, patients):
+    """Run the load once per worker count in args.scale and summarize the throughput."""
+    results = []
+    for workers in args.scale:
+        process, base_url = start_gunicorn(args, workers)
+        try:
+            elapsed, endpoints = run_load(base_url, patients, args)
+        finally:
+            process.terminate()
+            process.wait()
+        total_rps = round(sum(summary['rps'] for summary in endpoints.values()), 1)
+        print(f'{workers} worker(s): {total_rps} requests/s')
+        results.append({'workers': workers, 'duration_s': round(elapsed, 3), 'rps': total_rps, 'endpoints': endpoints})
+    base = results[0]['rps'] / results[0]['workers'] if results and results[0]['rps'] else None
+    for result in results:
+        # Speed-up relative to perfect linear scaling of the first run
+        result['efficiency'] = round(result['rps'] / (base * result['workers']), 3) if base else None
+    return results
+
+
+def hr_baseline_throughput(app, args):
+    """
+    Stream synthetic heart rate (a daily rhythm plus noise, one sample per
+    second) for args.hr_baseline patients, interleaved round by round as
+    concurrent wristlets would send it, through the baseline and time it.
+    """
+    from models import db, HeartRateBaseline
+    from hr_baseline import hr_baseline
+    from patient_cache import PatientThresholds
+
+    rng = random.Random(args.seed)
+    batch = args.hr_baseline_batch
+    patients = [PatientThresholds(user_id, user_id, 40, 120, 30, None) for user_id in range(1, args.hr_baseline + 1)]
+    resting = {patient.user_id: rng.uniform(55, 85) for patient in patients}
+    start = datetime.now(timezone.utc) - timedelta(seconds=args.hr_baseline_rounds)
+    with app.app_context():
+        db.session.execute(HeartRateBaseline.__table__.delete())
+        db.session.commit()
+        hr_baseline.load()
+
+    samples = alerts = 0
+    elapsed = 0.0
+    for first in range(0, args.hr_baseline_rounds, batch):
+        timestamps = [start + timedelta(seconds=second) for second in range(first, min(first + batch, args.hr_baseline_rounds))]
+        batches = [
+            (patient, [{'user_id': patient.user_id, 'timestamp': timestamp,
+                        'value': round(resting[patient.user_id] + 8 * math.sin(timestamp.hour / 24 * 2 * math.pi)
+                                       + rng.gauss(0, 3))}
+                       for timestamp in timestamps])
+            for patient in patients
+        ]
+        began = time.perf_counter()
+        for patient, rows in batches:
+            alerts += len(hr_baseline.observe(patient, rows))
+        elapsed += time.perf_counter() - began
+        samples += len(patients) * len(timestamps)
+
+    with app.app_context():
+        began = time.perf_counter()
+        written = hr_baseline.snapshot()
+        snapshot_s = time.perf_counter() - began
+        began = time.perf_counter()
+        hr_baseline.load()
+        load_s = time.perf_counter() - began
+
+    result = {
+        'patients': len(patients),
+        'samples': samples,
+        'batch': batch,
+        'samples_per_s': round(samples / elapsed),
+        'us_per_sample': round(elapsed / samples * 1e6, 2),
+        'alerts': alerts,
+        'state_bytes_per_patient': hr_baseline.memory_bytes() // max(len(hr_baseline), 1),
+        'snapshot_patients': written,
+        'snapshot_s': round(snapshot_s, 3),
+        'load_s': round(load_s, 3),
+    }
+    print(f"{result['samples_per_s']} samples/s for {len(patients)} patients, "
+          f"snapshot {result['snapshot_s']}s, reload {result['load_s']}s")
+    return result
+
+
+def write_report(report, args):
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(output + '\n')
+        print(f'Report written to {args.report}')
+    else:
+        print(output)
+
+    if args.baseline and 'endpoints' in report:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
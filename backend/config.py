@@ -9,3 +9,135 @@ class Config:
     
     # JWT Token süresi - sağlık izleme uygulaması için 7 gün
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=7)
+
+    # /api/wearable/imu/batch isteği başına kabul edilen en fazla örnek sayısı
+    IMU_BATCH_MAX_SAMPLES = int(os.environ.get('IMU_BATCH_MAX_SAMPLES', 1000))
+
+    # GET /api/alerts sayfa boyutu (limit parametresi verilmezse) ve üst sınırı
+    ALERTS_PAGE_SIZE = int(os.environ.get('ALERTS_PAGE_SIZE', 100))
+    ALERTS_MAX_PAGE_SIZE = int(os.environ.get('ALERTS_MAX_PAGE_SIZE', 500))
+
+    # /api/alerts/stream: keep-alive aralığı (saniye) ve abone başına kuyruk boyutu
+    ALERT_STREAM_KEEPALIVE_SECONDS = int(os.environ.get('ALERT_STREAM_KEEPALIVE_SECONDS', 15))
+    ALERT_STREAM_QUEUE_SIZE = int(os.environ.get('ALERT_STREAM_QUEUE_SIZE', 100))
+    # Açık akış başına bir sunucu iş parçacığı tutulur: süreç başına en fazla
+    # bu kadar akış (gunicorn'da GUNICORN_THREADS'ten küçük olmalı)
+    ALERT_STREAM_MAX_CLIENTS = int(os.environ.get('ALERT_STREAM_MAX_CLIENTS', 4))
+
+    # Hasta eşik değerleri önbelleği: en fazla kayıt sayısı ve yaşam süresi (saniye)
+    PATIENT_CACHE_SIZE = int(os.environ.get('PATIENT_CACHE_SIZE', 10000))
+    PATIENT_CACHE_TTL_SECONDS = int(os.environ.get('PATIENT_CACHE_TTL_SECONDS', 300))
+
+    # GET /api/patients sayfa boyutu ve üst sınırı
+    PATIENTS_PAGE_SIZE = int(os.environ.get('PATIENTS_PAGE_SIZE', 100))
+    PATIENTS_MAX_PAGE_SIZE = int(os.environ.get('PATIENTS_MAX_PAGE_SIZE', 500))
+
+    # Yazma arkası (write-behind) kuyruk: HeartRate/IMUData satırları arka plan
+    # iş parçacığında toplu commit edilir. Varsayılan olarak kapalı.
+    INGEST_QUEUE_ENABLED = os.environ.get('INGEST_QUEUE_ENABLED', '0') == '1'
+    # Kuyruk sınırı istek değil satır sayısıdır; dolunca 503 döner.
+    INGEST_QUEUE_MAX_ROWS = int(os.environ.get('INGEST_QUEUE_MAX_ROWS', 100000))
+    INGEST_QUEUE_BATCH_SIZE = int(os.environ.get('INGEST_QUEUE_BATCH_SIZE', 500))
+    INGEST_QUEUE_FLUSH_INTERVAL = float(os.environ.get('INGEST_QUEUE_FLUSH_INTERVAL', 0.5))
+    # Başarısız toplu commit bu kadar kez, üstel artan beklemeyle yeniden denenir
+    INGEST_QUEUE_RETRIES = int(os.environ.get('INGEST_QUEUE_RETRIES', 5))
+    INGEST_QUEUE_RETRY_BACKOFF = float(os.environ.get('INGEST_QUEUE_RETRY_BACKOFF', 0.1))
+
+    # Geçmiş (history) uç noktasının döndüreceği en fazla nokta sayısı
+    HISTORY_MAX_POINTS = int(os.environ.get('HISTORY_MAX_POINTS', 500))
+
+    # Ham sensör verisi saklama süresi. Eski satırlar önce özet (rollup)
+    # tablolarına katlanır, sonra parça parça silinir. Zamanlanmış görev
+    # RETENTION_INTERVAL_SECONDS > 0 ise create_app içinde başlatılır.
+    RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 30))
+    RETENTION_CHUNK_SIZE = int(os.environ.get('RETENTION_CHUNK_SIZE', 5000))
+    RETENTION_CHUNK_PAUSE = float(os.environ.get('RETENTION_CHUNK_PAUSE', 0.05))
+    RETENTION_VACUUM_PAGES = int(os.environ.get('RETENTION_VACUUM_PAGES', 1000))
+    RETENTION_INTERVAL_SECONDS = int(os.environ.get('RETENTION_INTERVAL_SECONDS', 0))
+
+    # İstek/SQL gecikme ölçümleri ve Prometheus formatında /metrics uç noktası.
+    # Kapalıyken hiçbir Flask/SQLAlchemy kancası eklenmez.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+    # /metrics yalnızca 'Authorization: Bearer <METRICS_TOKEN>' ile okunur;
+    # boşsa uç nokta hiç sunulmaz (ölçümler hasta bilgisi içermez)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+    # Yapılandırılmış (JSON) loglama: seviye, kuyruk boyutu ve yoğun veri
+    # alımı olaylarının örnekleme oranı (her N olaydan biri yazılır)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_INGEST_SAMPLE_EVERY = int(os.environ.get('LOG_INGEST_SAMPLE_EVERY', 100))
+
+    # Sunucu tarafı düşme algılama (IMU verisinden, cihazın olasılığından bağımsız)
+    SERVER_FALL_DETECTION = os.environ.get('SERVER_FALL_DETECTION', '1') == '1'
+
+    # Hasta başına son sensör örnekleri için halka tamponlar (bellek içi).
+    # Bellek üst sınırı: hasta sayısı x tampon boyutu
+    SENSOR_BUFFER_IMU_SAMPLES = int(os.environ.get('SENSOR_BUFFER_IMU_SAMPLES', 1024))
+    SENSOR_BUFFER_HR_SAMPLES = int(os.environ.get('SENSOR_BUFFER_HR_SAMPLES', 256))
+    SENSOR_BUFFER_MAX_PATIENTS = int(os.environ.get('SENSOR_BUFFER_MAX_PATIENTS', 5000))
+
+    # Birden fazla worker süreci için paylaşılan durum (önbellek geçersiz
+    # kılma, alarm olayları, kiralar). Boş: tek süreç. Örnek:
+    # sqlite:////var/lib/healthcare/shared_state.db
+    SHARED_STATE_URL = os.environ.get('SHARED_STATE_URL', '')
+    SHARED_STATE_POLL_INTERVAL = float(os.environ.get('SHARED_STATE_POLL_INTERVAL', 0.2))
+    # Akış dedektörleri (hareketsizlik, düşme, süreli kurallar, nabız temel
+    # çizgisi) hasta başına durum tutar; birden fazla süreçte bunları kirayı
+    # tutan tek süreç veritabanından okuyarak çalıştırır (stream_owner.py).
+    # '1'/'0'; boşsa SHARED_STATE_URL verildiğinde açık.
+    STREAM_OWNER_ENABLED = os.environ.get('STREAM_OWNER_ENABLED', '')
+    STREAM_OWNER_POLL_INTERVAL = float(os.environ.get('STREAM_OWNER_POLL_INTERVAL', 0.2))
+    STREAM_OWNER_BATCH_SIZE = int(os.environ.get('STREAM_OWNER_BATCH_SIZE', 5000))
+    STREAM_OWNER_LEASE_SECONDS = float(os.environ.get('STREAM_OWNER_LEASE_SECONDS', 10))
+
+    # Veritabanı performans profili. SQLITE_PROFILE: 'wal' (varsayılan) ya da
+    # 'rollback' (SQLite varsayılanları, karşılaştırma için); tek tek PRAGMA
+    # değerleri SQLITE_PRAGMAS ile ezilebilir (db_profile.py).
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'wal')
+    SQLITE_PRAGMAS = {}
+    # İş parçacıklı sunucu için bağlantı havuzu
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+
+    # Asyncio veri alım servisi (asgi.py, /api/wearable/*). Boşsa veritabanı
+    # adresi async sürücüyle (aiosqlite/asyncpg) SQLALCHEMY_DATABASE_URI'den
+    # türetilir. İstek gövdesi üst sınırı (bayt).
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL', '')
+    INGEST_MAX_BODY_BYTES = int(os.environ.get('INGEST_MAX_BODY_BYTES', 1048576))
+
+    # Parola özetleme (login/register): ayrı süreç havuzu. WORKERS=0 ise istek
+    # iş parçacığında çalışır. MAX_PENDING aşılırsa 503 döner; bekleyen her
+    # özet bir iş parçacığını tutar, bu yüzden varsayılanı GUNICORN_THREADS'in
+    # dörtte biridir (bkz. gunicorn.conf.py). METHOD Werkzeug biçiminde
+    # maliyeti belirler (ör. 'scrypt:32768:8:1', 'pbkdf2:sha256:600000');
+    # yalnızca yeni parolaları etkiler.
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get(
+        'PASSWORD_HASH_MAX_PENDING', max(1, int(os.environ.get('GUNICORN_THREADS', 8)) // 4)))
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_NICE = int(os.environ.get('PASSWORD_HASH_NICE', 10))
+
+    # Genel uyarı kuralları: JSON liste dosyası (biçim için bkz. alert_rules).
+    # Boşsa varsayılan kurallar (hastanın min_hr/max_hr eşikleri) kullanılır.
+    ALERT_RULES_FILE = os.environ.get('ALERT_RULES_FILE', '')
+
+    # Hastaya özel nabız temel çizgisi (EWMA ortalama/varyans; son dönem ve
+    # günün her saati için ayrı) ve HR_ANOMALY uyarısı: |z| >= HR_ANOMALY_Z
+    # durumu HR_ANOMALY_SECONDS boyunca sürerse. Durum her
+    # HR_BASELINE_SNAPSHOT_SECONDS saniyede ve çıkışta veritabanına yazılır
+    # (0 = yazılmaz); yeniden başlatmada oradan yüklenir.
+    HR_BASELINE_ENABLED = os.environ.get('HR_BASELINE_ENABLED', '1') == '1'
+    HR_BASELINE_HALF_LIFE_MINUTES = float(os.environ.get('HR_BASELINE_HALF_LIFE_MINUTES', 30))
+    HR_BASELINE_HOURLY_HALF_LIFE_HOURS = float(os.environ.get('HR_BASELINE_HOURLY_HALF_LIFE_HOURS', 3))
+    HR_BASELINE_MIN_SAMPLES = int(os.environ.get('HR_BASELINE_MIN_SAMPLES', 60))
+    HR_BASELINE_MIN_STD = float(os.environ.get('HR_BASELINE_MIN_STD', 3.0))
+    HR_BASELINE_SNAPSHOT_SECONDS = int(os.environ.get('HR_BASELINE_SNAPSHOT_SECONDS', 60))
+    HR_ANOMALY_Z = float(os.environ.get('HR_ANOMALY_Z', 3.0))
+    HR_ANOMALY_SECONDS = int(os.environ.get('HR_ANOMALY_SECONDS', 300))
+
+    # Toplu geçmiş içe aktarımı (POST /api/wearable/backfill, flask
+    # import-recording): her parça bu kadar satırla tek executemany ve tek
+    # commit olarak yazılır.
+    BACKFILL_CHUNK_SIZE = int(os.environ.get('BACKFILL_CHUNK_SIZE', 20000))
@@ -0,0 +1,84 @@
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from models import db
+
+# Per-connection PRAGMAs, applied in this order. auto_vacuum has to come
+# before journal_mode: it only takes effect on a new database file before
+# the switch to WAL. The retention job relies on INCREMENTAL; an existing
+# health.db keeps its mode until `flask prune-sensor-data --vacuum` rewrites
+# it once.
+SQLITE_PROFILES = {
+    # Readers never block the ingest writer and vice versa; NORMAL is
+    # durable across application crashes, only a power loss may drop the
+    # last commits.
+    'wal': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -65536,  # KiB
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+    # SQLite defaults (rollback journal), kept as a baseline for benchmarks
+    'rollback': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT',
+    },
+}
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config) -> dict:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for the configured database: a connection pool
+    sized for a threaded server (DB_POOL_SIZE threads hold a connection at
+    the same time, DB_MAX_OVERFLOW more may wait DB_POOL_TIMEOUT seconds).
+    Options already set in SQLALCHEMY_ENGINE_OPTIONS win.
+    """
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+    if not _is_memory_sqlite(url):
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT'],
+        )
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def sqlite_pragmas(config) -> dict:
+    pragmas = dict(SQLITE_PROFILES[config['SQLITE_PROFILE']])
+    pragmas.update(config['SQLITE_PRAGMAS'])
+    return pragmas
+
+
+def apply_sqlite_profile(app, engine=None) -> None:
+    """
+    Run the SQLITE_PROFILE PRAGMAs on every new SQLite connection of `engine`
+    (default: db.engine, which needs an app context). For an async engine
+    pass its sync_engine.
+    """
+    engine = engine if engine is not None else db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
@@ -0,0 +1,149 @@
+from datetime import datetime, timezone
+from threading import Lock
+
+import numpy as np
+
+from sensor_buffers import sensor_buffers
+
+GRAVITY = 9.80665
+
+# Düşme: darbe (ivme büyüklüğü > 2.5 g), ardından bilek yönünün en az 45°
+# değişmesi ve darbeden 1 sn sonra başlayan 2 sn boyunca hareketsiz kalma
+IMPACT_THRESHOLD = 2.5 * GRAVITY
+TILT_DEGREES = 45.0
+PRE_IMPACT_SECONDS = 1.0
+SETTLE_SECONDS = 1.0
+STILL_SECONDS = 2.0
+STILL_STD = 0.5  # m/s², standard deviation of the acceleration magnitude
+
+
+def _window_sums(cumulative: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Sum of rows [lo, hi) for every (lo, hi) pair, from a zero-prefixed cumsum."""
+    return cumulative[hi] - cumulative[lo]
+
+
+def extract_features(t: np.ndarray, acc: np.ndarray, impacts: np.ndarray) -> dict:
+    """
+    Features of the impacts at indices `impacts` of a time-ordered window:
+    peak acceleration (g), peak jerk (m/s³), orientation change of the
+    gravity vector between the second before the impact and the settled
+    period after it (degrees) and the spread of the acceleration magnitude
+    in that settled period (m/s²). All impacts are evaluated at once.
+    """
+    smv = np.sqrt(np.einsum('ij,ij->i', acc, acc))
+    dt = np.diff(t)
+    jerk = np.zeros_like(smv)
+    if len(t) > 1:
+        jerk[1:] = np.linalg.norm(np.diff(acc, axis=0), axis=1) / np.maximum(dt, 1e-3)
+
+    cum_acc = np.vstack([np.zeros((1, 3)), np.cumsum(acc, axis=0)])
+    cum_smv = np.concatenate([[0.0], np.cumsum(smv)])
+    cum_smv2 = np.concatenate([[0.0], np.cumsum(smv * smv)])
+
+    t_impact = t[impacts]
+    pre_lo = np.searchsorted(t, t_impact - PRE_IMPACT_SECONDS, 'left')
+    pre_hi = impacts
+    post_lo = np.searchsorted(t, t_impact + SETTLE_SECONDS, 'left')
+    post_hi = np.searchsorted(t, t_impact + SETTLE_SECONDS + STILL_SECONDS, 'right')
+
+    pre_n = pre_hi - pre_lo
+    post_n = post_hi - post_lo
+    pre_mean = _window_sums(cum_acc, pre_lo, pre_hi) / np.maximum(pre_n, 1)[:, None]
+    post_mean = _window_sums(cum_acc, post_lo, post_hi) / np.maximum(post_n, 1)[:, None]
+
+    norms = np.linalg.norm(pre_mean, axis=1) * np.linalg.norm(post_mean, axis=1)
+    cosine = np.einsum('ij,ij->i', pre_mean, post_mean) / np.maximum(norms, 1e-9)
+    tilt = np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+    post_smv = _window_sums(cum_smv, post_lo, post_hi) / np.maximum(post_n, 1)
+    post_smv2 = _window_sums(cum_smv2, post_lo, post_hi) / np.maximum(post_n, 1)
+    still_std = np.sqrt(np.maximum(post_smv2 - post_smv * post_smv, 0.0))
+
+    return {
+        'peak_g': smv[impacts] / GRAVITY,
+        'jerk': jerk[impacts],
+        'tilt_degrees': np.where((pre_n > 0) & (post_n > 0), tilt, 0.0),
+        'still_std': np.where(post_n > 1, still_std, np.inf),
+    }
+
+
+def find_impacts(t: np.ndarray, acc: np.ndarray, since: float, until: float) -> np.ndarray:
+    """
+    Indices of the impacts in (since, until] of a time-ordered window, one per
+    event: later peaks inside an impact's still period belong to it.
+    """
+    smv_sq = np.einsum('ij,ij->i', acc, acc)
+    impacts = np.flatnonzero((smv_sq > IMPACT_THRESHOLD ** 2) & (t > since) & (t <= until))
+    if len(impacts):
+        first = np.concatenate([[True], np.diff(t[impacts]) > SETTLE_SECONDS + STILL_SECONDS])
+        impacts = impacts[first]
+    return impacts
+
+
+def classify_impacts(t: np.ndarray, acc: np.ndarray, impacts: np.ndarray) -> list:
+    """The impacts that are falls, as dicts of timestamp and features."""
+    if not len(impacts):
+        return []
+    features = extract_features(t, acc, impacts)
+    is_fall = (features['tilt_degrees'] >= TILT_DEGREES) & (features['still_std'] <= STILL_STD)
+    return [
+        {
+            'timestamp': datetime.fromtimestamp(t[index], timezone.utc),
+            'peak_g': float(features['peak_g'][i]),
+            'jerk': float(features['jerk'][i]),
+            'tilt_degrees': float(features['tilt_degrees'][i]),
+        }
+        for i, index in enumerate(impacts) if is_fall[i]
+    ]
+
+
+class FallDetector:
+    """
+    Server-side fall detection over each patient's recent accelerometer
+    samples in sensor_buffers. A fall is an impact followed by a change in
+    wrist orientation and a still period; an impact is classified once the
+    samples covering its still period have arrived, so uploads may split it
+    at any point. Only the time up to which impacts were classified is kept
+    per patient.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._classified_until = {}
+        self._lock = Lock()
+
+    def init_app(self, app) -> None:
+        with self._lock:
+            self._classified_until = {}
+        self.enabled = app.config['SERVER_FALL_DETECTION']
+
+    def clear(self) -> None:
+        with self._lock:
+            self._classified_until = {}
+
+    def detect(self, user_id: int) -> list:
+        """
+        Classify the impacts of `user_id` that have become decidable since the
+        last call and return the falls, as dicts of timestamp and features.
+        """
+        if not self.enabled:
+            return []
+
+        with self._lock:
+            since = self._classified_until.get(user_id, -np.inf)
+            t, values = sensor_buffers.window('imu_data', user_id, since - PRE_IMPACT_SECONDS)
+            if not len(t):
+                return []
+            acc = values[:, :3].astype(float)
+
+            decidable_until = t[-1] - SETTLE_SECONDS - STILL_SECONDS
+            impacts = find_impacts(t, acc, since, decidable_until)
+            if not len(impacts):
+                self._classified_until[user_id] = max(since, decidable_until)
+                return []
+            self._classified_until[user_id] = t[impacts[-1]] + SETTLE_SECONDS + STILL_SECONDS
+
+        return classify_impacts(t, acc, impacts)
+
+
+fall_detector = FallDetector()
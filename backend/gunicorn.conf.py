@@ -0,0 +1,43 @@
+"""
+Production server settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden from the environment. Workers are separate
+processes, so more of them scale CPU-bound request handling across cores;
+threads per worker cover time spent waiting on SQLite and on open
+/api/alerts/stream connections. Each stream holds one thread for as long
+as it is open, so a worker serves at most ALERT_STREAM_MAX_CLIENTS (default
+4) streams and keeps the rest of its GUNICORN_THREADS for requests; raise
+both together for more dashboards.
+
+A login or registration likewise holds its thread while the password is
+hashed in the hashing pool, so at most PASSWORD_HASH_MAX_PENDING (default a
+quarter of GUNICORN_THREADS) wait per worker and the next get 503. Keep
+ALERT_STREAM_MAX_CLIENTS + PASSWORD_HASH_MAX_PENDING below GUNICORN_THREADS,
+or a login storm and open dashboards can take every thread and starve
+/api/wearable/*.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# The app starts background threads (log writer, ingest writer, shared state
+# poller, retention), which do not survive fork: build it in each worker.
+preload_app = False
+
+# Several workers, and the asyncio ingest service (asgi.py) running next to
+# them, need a shared state backend so that threshold changes and alerts
+# committed in one process reach the caches and alert streams of the others.
+# It also turns on the stream owner (stream_owner.py): the detectors keeping
+# per-patient state run in one process, over the samples stored by all.
+if not os.environ.get('SHARED_STATE_URL'):
+    instance = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+    os.environ['SHARED_STATE_URL'] = f'sqlite:///{os.path.join(instance, "shared_state.db")}'
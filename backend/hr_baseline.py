@@ -0,0 +1,284 @@
+"""
+Streaming per-patient heart rate baseline and the HR_ANOMALY alert.
+
+For every patient a fixed-size array of doubles (O(1) memory, under 1 KB)
+holds two EWMA mean/variance baselines:
+  - recent: half-life HR_BASELINE_HALF_LIFE_MINUTES;
+  - time of day: one per hour of the UTC day, with a half-life of
+    HR_BASELINE_HOURLY_HALF_LIFE_HOURS counted only while in that hour, so
+    it spans several days of the same hour.
+Each sample is scored against its hour's baseline once that has folded in
+HR_BASELINE_MIN_SAMPLES samples (the recent baseline until then), then
+folded into both; a sample more than HR_ANOMALY_Z deviations away only
+moves the means, by at most that bound, so a deviation is not absorbed
+while it lasts but a lasting change is still learned, slowly. A z-score
+whose magnitude stays at or above HR_ANOMALY_Z for HR_ANOMALY_SECONDS
+raises an HR_ANOMALY alert, deduplicated like the other alerts. Samples
+older than a patient's last one are ignored.
+
+The states of patients with new samples are written to the hr_baseline
+table every HR_BASELINE_SNAPSHOT_SECONDS and at exit, and all of them are
+loaded at start-up, so a restart resumes without rescanning heart_rate; at
+most the samples of one interval are forgotten. With several processes
+only the stream owner (see stream_owner) keeps and writes baselines: it
+loads them when it takes over and the others never do, so no process
+overwrites another's snapshot with an older state.
+"""
+import atexit
+import logging
+import math
+import threading
+from array import array
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Alert, HeartRateBaseline
+from alert_rules import should_create_alert
+from app_logging import get_logger, log_event
+
+log = get_logger('hr_baseline')
+
+# Gaps longer than this count as this long: a sample after a night without
+# the wristlet, or the first one of an hour after a day, is not overweighted
+MAX_GAP_SECONDS = 60.0
+
+# State layout: baselines of [weight, mean, variance, last sample time],
+# the recent one first, then one per hour of the day; last the start of the
+# current deviation run (NaN when none)
+_FIELDS = 4
+_RECENT = 0
+_HOURS = _FIELDS
+_RUN = _HOURS + 24 * _FIELDS
+_SIZE = _RUN + 1
+
+
+def _epoch(timestamp: datetime) -> float:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def _new_state() -> array:
+    state = array('d', bytes(8 * _SIZE))
+    state[_RUN] = math.nan
+    return state
+
+
+def _fold(state: array, offset: int, t: float, value: float, tau: float,
+          outlier: bool = False) -> None:
+    """
+    Fold a sample into the EWMA baseline at `offset` (time-weighted, a plain
+    average while warming up). An outlier moves the mean only.
+    """
+    weight = state[offset]
+    if weight:
+        dt = min(t - state[offset + 3], MAX_GAP_SECONDS)
+        alpha = max(1.0 - math.exp(-dt / tau), 1.0 / (weight + 1))
+    else:
+        alpha = 1.0
+    diff = value - state[offset + 1]
+    increment = alpha * diff
+    state[offset + 1] += increment
+    if not outlier:
+        state[offset + 2] = (1.0 - alpha) * (state[offset + 2] + diff * increment)
+    state[offset] = weight + 1
+    state[offset + 3] = t
+
+
+class HeartRateBaselines:
+    """The baselines of all patients seen, with the periodic snapshot thread."""
+
+    def __init__(self):
+        self.enabled = True
+        self.min_samples = 60
+        self.min_variance = 9.0
+        self.anomaly_z = 3.0
+        self.anomaly_seconds = 300
+        self._recent_tau = 30 * 60 / math.log(2)
+        self._hourly_tau = 3 * 3600 / math.log(2)
+        self._states = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._app = None
+
+    def init_app(self, app) -> None:
+        self.stop()
+        config = app.config
+        self.enabled = config['HR_BASELINE_ENABLED']
+        self.min_samples = config['HR_BASELINE_MIN_SAMPLES']
+        self.min_variance = config['HR_BASELINE_MIN_STD'] ** 2
+        self.anomaly_z = config['HR_ANOMALY_Z']
+        self.anomaly_seconds = config['HR_ANOMALY_SECONDS']
+        self._recent_tau = config['HR_BASELINE_HALF_LIFE_MINUTES'] * 60 / math.log(2)
+        self._hourly_tau = config['HR_BASELINE_HOURLY_HALF_LIFE_HOURS'] * 3600 / math.log(2)
+        if config['STREAM_OWNER_ENABLED']:
+            # Loaded by the stream owner when it takes over
+            self.clear()
+        else:
+            with app.app_context():
+                self.load()
+
+        interval = config['HR_BASELINE_SNAPSHOT_SECONDS']
+        if not self.enabled or interval <= 0:
+            return
+        self._app = app
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name='hr-baseline', daemon=True
+        )
+        self._thread.start()
+        atexit.register(self._final_snapshot)
+
+    def stop(self) -> None:
+        """Stop the snapshot thread (without a last snapshot; that is left to exit)."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            atexit.unregister(self._final_snapshot)
+
+    def observe(self, patient, rows: list) -> list:
+        """
+        Score and fold in freshly stored HeartRate rows of `patient`; returns
+        the HR_ANOMALY alert they raise, if any, as a list (not yet added).
+        """
+        if not self.enabled:
+            return []
+        samples = sorted(
+            (_epoch(row['timestamp']), float(row['value']), row['timestamp']) for row in rows
+        )
+        anomaly = None
+        with self._lock:
+            state = self._states.get(patient.user_id)
+            if state is None:
+                state = self._states[patient.user_id] = _new_state()
+            self._dirty.add(patient.user_id)
+            for t, value, timestamp in samples:
+                if t < state[_RECENT + 3]:
+                    continue
+                z, mean, std = self._score(state, t, value)
+                deviates = z is not None and abs(z) >= self.anomaly_z
+                folded = mean + math.copysign(self.anomaly_z * std, z) if deviates else value
+                _fold(state, _RECENT, t, folded, self._recent_tau, deviates)
+                hour = _HOURS + _FIELDS * int(t // 3600 % 24)
+                _fold(state, hour, t, folded, self._hourly_tau, deviates)
+
+                if not deviates:
+                    state[_RUN] = math.nan
+                    continue
+                if math.isnan(state[_RUN]):
+                    state[_RUN] = t
+                if anomaly is None and t - state[_RUN] >= self.anomaly_seconds:
+                    anomaly = (timestamp, value, mean, z)
+
+        if anomaly is None:
+            return []
+        timestamp, value, mean, z = anomaly
+        if not should_create_alert(patient.user_id, 'HR_ANOMALY', timestamp):
+            return []
+        message = f'Heart rate {value:g} deviates from baseline {mean:.0f} (z={z:+.1f})'
+        return [Alert(user_id=patient.user_id, type='HR_ANOMALY', message=message,
+                      timestamp=timestamp)]
+
+    def _score(self, state: array, t: float, value: float):
+        """
+        (z-score, baseline mean, standard deviation) of a sample, or Nones
+        before any baseline is warm.
+        """
+        offset = _HOURS + _FIELDS * int(t // 3600 % 24)
+        if state[offset] < self.min_samples:
+            offset = _RECENT
+            if state[offset] < self.min_samples:
+                return None, None, None
+        mean = state[offset + 1]
+        std = math.sqrt(max(state[offset + 2], self.min_variance))
+        return (value - mean) / std, mean, std
+
+    def baseline(self, user_id: int, hour: int = None):
+        """(samples, mean, standard deviation) of the recent or an hour's baseline, or None."""
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is None:
+                return None
+            offset = _RECENT if hour is None else _HOURS + _FIELDS * hour
+            return int(state[offset]), state[offset + 1], math.sqrt(state[offset + 2])
+
+    def load(self) -> None:
+        """Replace the in-memory states with the stored snapshots."""
+        rows = db.session.execute(select(HeartRateBaseline.user_id, HeartRateBaseline.state)).all()
+        states = {}
+        for user_id, packed in rows:
+            state = array('d')
+            state.frombytes(packed)
+            if len(state) == _SIZE:
+                states[user_id] = state
+        with self._lock:
+            self._states = states
+            self._dirty = set()
+
+    def clear(self) -> None:
+        """Drop every state unwritten: another process owns the baselines."""
+        with self._lock:
+            self._states = {}
+            self._dirty = set()
+
+    def snapshot(self) -> int:
+        """Write the states changed since the last snapshot; returns how many."""
+        with self._lock:
+            changed = [(user_id, self._states[user_id].tobytes()) for user_id in self._dirty]
+            self._dirty = set()
+        if not changed:
+            return 0
+        now = datetime.now(timezone.utc)
+        try:
+            db.session.execute(
+                _upsert_statement(db.session.get_bind().dialect.name),
+                [{'user_id': user_id, 'state': packed, 'updated_at': now}
+                 for user_id, packed in changed],
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self._dirty.update(user_id for user_id, _ in changed)
+            raise
+        return len(changed)
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(state.buffer_info()[1] * state.itemsize for state in self._states.values())
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _run(self, interval: int) -> None:
+        while not self._stop.wait(interval):
+            self._snapshot_logged()
+
+    def _final_snapshot(self) -> None:
+        self._stop.set()
+        self._snapshot_logged()
+
+    def _snapshot_logged(self) -> None:
+        try:
+            with self._app.app_context():
+                written = self.snapshot()
+            log_event(log, logging.DEBUG, 'hr_baseline_snapshot', patients=written)
+        except Exception:
+            log.error('hr_baseline_snapshot_failed', exc_info=True)
+
+
+def _upsert_statement(dialect: str):
+    table = HeartRateBaseline.__table__
+    stmt = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table)
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={'state': stmt.excluded.state, 'updated_at': stmt.excluded.updated_at},
+    )
+
+
+hr_baseline = HeartRateBaselines()
@@ -0,0 +1,37 @@
+from collections import namedtuple
+
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import select
+
+from models import db, User, Patient
+
+# Who is calling: user id, user_type ('caregiver' or 'patient') and the
+# Patient row id (None for caregivers)
+Identity = namedtuple('Identity', ['user_id', 'role', 'patient_id'])
+
+
+def identity_claims(user) -> dict:
+    """
+    Extra access token claims describing `user`, so that authorization needs
+    no User/Patient lookup per request. user_type never changes after
+    registration, so the claims stay true for the token's lifetime.
+    """
+    patient_id = None
+    if user.user_type == 'patient':
+        patient_id = db.session.scalar(select(Patient.id).where(Patient.user_id == user.id))
+    return {'role': user.user_type, 'patient_id': patient_id}
+
+
+def current_identity() -> Identity:
+    """Identity of the authenticated caller, read from the access token."""
+    user_id = int(get_jwt_identity())
+    claims = get_jwt()
+    if 'role' not in claims:
+        # Token issued before the identity claims existed
+        claims = identity_claims(db.session.get(User, user_id))
+    return Identity(user_id, claims['role'], claims['patient_id'])
+
+
+def may_have_patient_profile(claims: dict) -> bool:
+    """False only when the token states that the user has no Patient row; older tokens do not say."""
+    return 'role' not in claims or claims['patient_id'] is not None
@@ -0,0 +1,198 @@
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Patient, IMUData
+
+# Hareket eşiği: değişim > 1.0 ise hareket var sayılır
+# (sensör verisi gürültülü olduğu için düşük değerler filtrelenir)
+MOTION_THRESHOLD = 1.0
+
+
+def _as_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+class _MotionState:
+    """Min/max accelerometer envelope of the current still period."""
+
+    __slots__ = ('low', 'high', 'still_since', 'last_seen')
+
+    def __init__(self, x: float, y: float, z: float, timestamp: datetime):
+        self.restart(x, y, z, timestamp)
+
+    def restart(self, x: float, y: float, z: float, timestamp: datetime) -> None:
+        self.low = [x, y, z]
+        self.high = [x, y, z]
+        self.still_since = timestamp
+        self.last_seen = timestamp
+
+
+def _still_period_end(acc: np.ndarray, lo: int, end: int) -> int:
+    """End (exclusive) of the still period starting at sample `lo`, at most `end`."""
+    size = 64
+    while True:
+        hi = min(end, lo + size)
+        period = acc[lo:hi]
+        high = np.maximum.accumulate(period)
+        low = np.minimum.accumulate(period)
+        moved = np.flatnonzero(((high - period > MOTION_THRESHOLD) | (period - low > MOTION_THRESHOLD)).any(axis=1))
+        if len(moved):
+            return lo + int(moved[0])
+        if hi == end:
+            return end
+        size *= 2
+
+
+def first_inactive(t: np.ndarray, acc: np.ndarray, window: float, start: int = 0):
+    """
+    Index of the first sample at or after `start` at which the patient has
+    been still for `window` seconds, under the same still-period rules as
+    InactivityTracker, or None. `t` (epoch seconds) must be sorted.
+
+    A jump of more than MOTION_THRESHOLD from the previous sample, or a gap
+    of a whole window, always restarts the still period, so those split the
+    samples into runs in one pass; only runs at least a window long are
+    walked, one still period at a time.
+    """
+    n = len(t)
+    if n <= start:
+        return None
+    restart = np.ones(n, dtype=bool)
+    restart[1:] = (np.abs(np.diff(acc, axis=0)) > MOTION_THRESHOLD).any(axis=1) | (np.diff(t) >= window)
+    run_starts = np.flatnonzero(restart)
+    run_ends = np.append(run_starts[1:], n)
+
+    long_runs = (run_ends > start) & (t[run_ends - 1] - t[run_starts] >= window)
+    for lo, end in zip(run_starts[long_runs], run_ends[long_runs]):
+        while lo < end and t[end - 1] - t[lo] >= window:
+            still_end = _still_period_end(acc, lo, end)
+            inactive = max(int(np.searchsorted(t, t[lo] + window, 'left')), start)
+            if inactive < still_end:
+                return inactive
+            lo = still_end
+    return None
+
+
+class InactivityTracker:
+    """
+    Per-patient streaming motion tracker. Every sample updates a running
+    min/max envelope per axis in O(1); as soon as a sample lies further than
+    MOTION_THRESHOLD from any value seen since the patient last moved, the
+    still period restarts at that sample. A patient is inactive once the
+    still period covers the whole inactivity window.
+
+    State is rebuilt from recent IMUData rows when the app starts and, for
+    patients seen for the first time, on their first sample.
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = Lock()
+
+    def init_app(self, app) -> None:
+        with self._lock:
+            self._states = {}
+        if app.config['STREAM_OWNER_ENABLED']:
+            # Only the stream owner tracks, loading patients as it sees them
+            return
+        with app.app_context():
+            now = datetime.now(timezone.utc)
+            for patient in Patient.query.all():
+                self._states[patient.user_id] = self._load(patient, now)
+
+    def _load(self, patient, before: datetime):
+        """Replay the patient's IMU rows inside the inactivity window ending at `before`."""
+        rows = db.session.execute(self.history_query(patient, before)).all()
+        return self._replay(patient, rows)
+
+    @staticmethod
+    def history_query(patient, before: datetime):
+        """(timestamp, x, y, z) of the patient's IMU rows inside the inactivity window ending at `before`."""
+        window = timedelta(minutes=patient.inactivity_limit_minutes)
+        return (
+            select(IMUData.timestamp, IMUData.x_axis, IMUData.y_axis, IMUData.z_axis)
+            .where(
+                IMUData.user_id == patient.user_id,
+                IMUData.timestamp >= before - window,
+                IMUData.timestamp < before,
+            )
+            .order_by(IMUData.timestamp)
+        )
+
+    def _replay(self, patient, rows):
+        window = timedelta(minutes=patient.inactivity_limit_minutes)
+        state = None
+        for timestamp, x, y, z in rows:
+            state = self._advance(state, x, y, z, _as_utc(timestamp), window)
+        return state
+
+    @staticmethod
+    def _advance(state, x: float, y: float, z: float, timestamp: datetime, window: timedelta):
+        if state is None:
+            return _MotionState(x, y, z, timestamp)
+        if timestamp < state.last_seen:
+            # Late sample: it cannot change the still period any more
+            return state
+        if timestamp - state.last_seen >= window:
+            # No data for a whole window, nothing is known about the gap
+            state.restart(x, y, z, timestamp)
+            return state
+
+        low, high = state.low, state.high
+        for axis, value in enumerate((x, y, z)):
+            if high[axis] - value > MOTION_THRESHOLD or value - low[axis] > MOTION_THRESHOLD:
+                state.restart(x, y, z, timestamp)
+                return state
+        for axis, value in enumerate((x, y, z)):
+            if value < low[axis]:
+                low[axis] = value
+            elif value > high[axis]:
+                high[axis] = value
+        state.last_seen = timestamp
+        return state
+
+    def observe(self, patient, x: float, y: float, z: float, timestamp: datetime) -> None:
+        """Feed one accelerometer sample for `patient` into the tracker."""
+        timestamp = _as_utc(timestamp)
+        user_id = patient.user_id
+        if user_id not in self._states:
+            state = self._load(patient, timestamp)
+            with self._lock:
+                self._states.setdefault(user_id, state)
+
+        window = timedelta(minutes=patient.inactivity_limit_minutes)
+        with self._lock:
+            self._states[user_id] = self._advance(self._states[user_id], x, y, z, timestamp, window)
+
+    def clear(self) -> None:
+        """Forget every patient; each is reloaded from the database on its next sample."""
+        with self._lock:
+            self._states = {}
+
+    def is_tracked(self, user_id: int) -> bool:
+        return user_id in self._states
+
+    def seed(self, patient, rows) -> None:
+        """
+        Start tracking `patient` from rows of history_query() the caller ran
+        itself (the asyncio ingest service), so observe() does not query.
+        """
+        state = self._replay(patient, rows)
+        with self._lock:
+            self._states.setdefault(patient.user_id, state)
+
+    def is_inactive(self, patient, timestamp: datetime) -> bool:
+        """True when `patient` has not moved for their whole inactivity window."""
+        state = self._states.get(patient.user_id)
+        if state is None:
+            return False
+        window = timedelta(minutes=patient.inactivity_limit_minutes)
+        return _as_utc(timestamp) - state.still_since >= window
+
+
+inactivity_tracker = InactivityTracker()
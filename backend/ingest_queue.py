@@ -0,0 +1,170 @@
+import atexit
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+from app_logging import get_logger
+from models import db
+from rollups import update_rollups
+
+_STOP = object()
+
+log = get_logger('ingest')
+
+
+class IngestQueue:
+    """
+    Optional write-behind path for raw sensor samples. When INGEST_QUEUE_ENABLED
+    is set, the wearable endpoints hand HeartRate/IMUData rows to a bounded
+    in-process queue instead of committing them on the request thread. One
+    writer thread group-commits them with a bulk insert per model once
+    INGEST_QUEUE_BATCH_SIZE rows are pending or INGEST_QUEUE_FLUSH_INTERVAL
+    seconds have passed. Alerts are not queued, they are still committed by
+    the request.
+
+    The queue holds at most INGEST_QUEUE_MAX_ROWS rows (not requests, whose
+    size varies) that are waiting or being written. A failed group commit is
+    retried INGEST_QUEUE_RETRIES times with exponential backoff from
+    INGEST_QUEUE_RETRY_BACKOFF seconds, while new uploads keep filling the
+    queue up to its bound. After that each request's rows are committed on
+    their own, so a bad batch does not take the others with it, and the rows
+    that still fail are counted in `failed_rows`.
+
+    Queued samples are only visible to SQL readers after the next flush; the
+    in-memory trackers see them immediately.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._rows_lock = threading.Lock()
+        self._rows = 0
+        self.batch_size = 500
+        self.flush_interval = 0.5
+        self.max_rows = 10000
+        self.retries = 5
+        self.retry_backoff = 0.1
+        self.failed_rows = 0
+
+    def init_app(self, app) -> None:
+        self.stop()
+        self.enabled = app.config['INGEST_QUEUE_ENABLED']
+        if not self.enabled:
+            return
+
+        self._app = app
+        self.batch_size = app.config['INGEST_QUEUE_BATCH_SIZE']
+        self.flush_interval = app.config['INGEST_QUEUE_FLUSH_INTERVAL']
+        self.max_rows = app.config['INGEST_QUEUE_MAX_ROWS']
+        self.retries = app.config['INGEST_QUEUE_RETRIES']
+        self.retry_backoff = app.config['INGEST_QUEUE_RETRY_BACKOFF']
+        self._rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def put(self, model, rows: list) -> bool:
+        """
+        Queue `rows` (column dicts) for a bulk insert into `model`. Returns
+        False when the queue is full and the caller should push back.
+        """
+        with self._rows_lock:
+            if self._rows + len(rows) > self.max_rows:
+                return False
+            self._rows += len(rows)
+        self._queue.put_nowait((model, rows))
+        return True
+
+    def depth(self) -> int:
+        """Number of queued, not yet committed rows."""
+        return self._rows
+
+    def drain(self) -> None:
+        """Block until everything queued so far has been committed."""
+        if self._queue is not None:
+            self._queue.join()
+
+    def stop(self) -> None:
+        """Flush the remaining samples and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self.enabled = False
+        atexit.unregister(self.stop)
+
+    def _run(self) -> None:
+        pending = []
+        pending_rows = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stopping = item is _STOP
+            if item is not None and not stopping:
+                pending.append(item)
+                pending_rows += len(item[1])
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if pending and (stopping or pending_rows >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(pending)
+                with self._rows_lock:
+                    self._rows -= pending_rows
+                for _ in pending:
+                    self._queue.task_done()
+                pending = []
+                pending_rows = 0
+                deadline = None
+
+            if stopping:
+                self._queue.task_done()
+                return
+
+    def _flush(self, pending: list) -> None:
+        """Commit the (model, rows) items of `pending`, retrying and then item by item."""
+        rows = sum(len(item[1]) for item in pending)
+        with self._app.app_context():
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                try:
+                    self._commit(pending)
+                    return
+                except Exception:
+                    db.session.rollback()
+                    log.warning('group_commit_retry', exc_info=True,
+                                extra={'fields': {'attempt': attempt + 1, 'rows': rows}})
+
+            for item in pending:
+                try:
+                    self._commit([item])
+                except Exception:
+                    db.session.rollback()
+                    self.failed_rows += len(item[1])
+                    log.error('group_commit_failed', exc_info=True,
+                              extra={'fields': {'kind': item[0].__tablename__, 'rows': len(item[1])}})
+
+    @staticmethod
+    def _commit(items: list) -> None:
+        """Bulk insert the rows of `items`, one executemany per model, in one transaction."""
+        by_model = {}
+        for model, rows in items:
+            by_model.setdefault(model, []).extend(rows)
+        for model, rows in by_model.items():
+            db.session.execute(insert(model), rows)
+            update_rollups(model, rows)
+        db.session.commit()
+
+
+ingest_queue = IngestQueue()
@@ -0,0 +1,188 @@
+import hmac
+import time
+from threading import Lock
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+from models import db
+from app_logging import get_logger
+
+log = get_logger('metrics')
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(**labels) -> str:
+    inner = ','.join(f'{key}="{str(value)}"' for key, value in labels.items())
+    return '{' + inner + '}'
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'count', 'sum')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def render(self, name: str, labels: dict) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {self.count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {self.sum}')
+        lines.append(f'{name}_count{_labels(**labels)} {self.count}')
+        return lines
+
+
+class Metrics:
+    """
+    Request, SQL and ingest instrumentation exposed in the Prometheus text
+    format on /metrics. Nothing is hooked into Flask or SQLAlchemy unless
+    METRICS_ENABLED is set, so a disabled instance costs one attribute check
+    per ingest call.
+
+    Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`;
+    without a METRICS_TOKEN the endpoint is not served. Labels are bounded:
+    methods, route rules, statuses and sample kinds, never user ids.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.token = ''
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.requests = {}        # (method, endpoint, status) -> count
+        self.latency = {}         # (method, endpoint) -> _Histogram
+        self.db_latency = {}      # (method, endpoint) -> _Histogram of DB time per request
+        self.db_statements = {}   # (method, endpoint) -> statements
+        self.samples = {}         # kind -> samples ingested
+        self.exported = {}        # name -> (type, help, callable)
+
+    def init_app(self, app) -> None:
+        with self._lock:
+            self._reset()
+        self.enabled = app.config['METRICS_ENABLED']
+        if not self.enabled:
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        self.token = app.config['METRICS_TOKEN']
+        if self.token:
+            app.add_url_rule('/metrics', 'metrics', self.render_response)
+        else:
+            log.warning('metrics_endpoint_disabled', extra={'fields': {'reason': 'METRICS_TOKEN not set'}})
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def export(self, name: str, metric_type: str, help_text: str, read) -> None:
+        """Export the value returned by `read()` at scrape time as a counter or gauge."""
+        self.exported[name] = (metric_type, help_text, read)
+
+    # --- Hooks ---
+
+    def _before_request(self) -> None:
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_time = 0.0
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        key = (request.method, endpoint)
+        with self._lock:
+            status_key = key + (response.status_code,)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+            self.latency.setdefault(key, _Histogram()).observe(elapsed)
+            self.db_latency.setdefault(key, _Histogram()).observe(g.metrics_sql_time)
+            self.db_statements[key] = self.db_statements.get(key, 0) + g.metrics_sql_count
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_query_started'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('metrics_query_started', None)
+        if started is None or not has_request_context() or 'metrics_sql_count' not in g:
+            return
+        g.metrics_sql_count += 1
+        g.metrics_sql_time += time.perf_counter() - started
+
+    def count_samples(self, kind: str, count: int) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples[kind] = self.samples.get(kind, 0) + count
+
+    # --- Exposition ---
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                '# HELP http_requests_total HTTP requests by endpoint and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{_labels(method=method, endpoint=endpoint, status=status)} {count}')
+
+            lines += [
+                '# HELP http_request_duration_seconds Request latency.',
+                '# TYPE http_request_duration_seconds histogram',
+            ]
+            for (method, endpoint), histogram in sorted(self.latency.items()):
+                lines += histogram.render('http_request_duration_seconds', {'method': method, 'endpoint': endpoint})
+
+            lines += [
+                '# HELP http_request_db_duration_seconds Time spent in SQL per request.',
+                '# TYPE http_request_db_duration_seconds histogram',
+            ]
+            for (method, endpoint), histogram in sorted(self.db_latency.items()):
+                lines += histogram.render('http_request_db_duration_seconds', {'method': method, 'endpoint': endpoint})
+
+            lines += [
+                '# HELP http_db_statements_total SQL statements executed while serving requests.',
+                '# TYPE http_db_statements_total counter',
+            ]
+            for (method, endpoint), count in sorted(self.db_statements.items()):
+                lines.append(f'http_db_statements_total{_labels(method=method, endpoint=endpoint)} {count}')
+
+            lines += [
+                '# HELP ingest_samples_total Sensor samples accepted.',
+                '# TYPE ingest_samples_total counter',
+            ]
+            for kind, count in sorted(self.samples.items()):
+                lines.append(f'ingest_samples_total{_labels(kind=kind)} {count}')
+
+            exported = list(self.exported.items())
+
+        for name, (metric_type, help_text, read) in exported:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {read()}']
+        return '\n'.join(lines) + '\n'
+
+    def render_response(self):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme != 'Bearer' or not hmac.compare_digest(token.encode(), self.token.encode()):
+            return Response('Unauthorized\n', 401, {'WWW-Authenticate': 'Bearer'}, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from datetime import datetime, timezone
+import json
 
 db = SQLAlchemy()
 
@@ -21,12 +23,14 @@ class User(db.Model):
 
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
     # Thresholds
     min_hr = db.Column(db.Integer, default=40)
     max_hr = db.Column(db.Integer, default=120)
     inactivity_limit_minutes = db.Column(db.Integer, default=30)
+    # Patient-specific alert rules, a JSON list (see alert_rules); NULL = none
+    alert_rules = db.Column(db.Text, nullable=True)
     
     def to_dict(self):
         return {
@@ -34,10 +38,16 @@ class Patient(db.Model):
             'user_id': self.user_id,
             'min_hr': self.min_hr,
             'max_hr': self.max_hr,
-            'inactivity_limit_minutes': self.inactivity_limit_minutes
+            'inactivity_limit_minutes': self.inactivity_limit_minutes,
+            'alert_rules': json.loads(self.alert_rules) if self.alert_rules else [],
         }
 
 class IMUData(db.Model):
+    __table_args__ = (
+        # Inactivity window: WHERE user_id = ? AND timestamp >= ? ORDER BY timestamp
+        db.Index('ix_imu_data_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
@@ -51,18 +61,69 @@ class IMUData(db.Model):
     gz = db.Column(db.Float, nullable=True)
 
 class HeartRate(db.Model):
+    __table_args__ = (
+        db.Index('ix_heart_rate_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     value = db.Column(db.Float, nullable=False)
 
+class SensorRollup(db.Model):
+    """
+    Pre-aggregated sensor values per user and time bucket, maintained at
+    ingest. `metric` is 'heart_rate' (bpm) or 'imu_magnitude' (length of the
+    accelerometer vector); `bucket_seconds` is 60 or 3600.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'metric', 'bucket_seconds', 'bucket_start', name='uq_sensor_rollup_bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    metric = db.Column(db.String(20), nullable=False)
+    bucket_seconds = db.Column(db.Integer, nullable=False)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    value_sum = db.Column(db.Float, nullable=False)
+    value_min = db.Column(db.Float, nullable=False)
+    value_max = db.Column(db.Float, nullable=False)
+
+class HeartRateBaseline(db.Model):
+    """
+    Snapshot of a patient's streaming heart rate baseline (see hr_baseline):
+    the packed state array, rewritten periodically while samples arrive.
+    """
+    __tablename__ = 'hr_baseline'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    state = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
 class Alert(db.Model):
+    __table_args__ = (
+        # should_create_alert: open alert of a type, and latest alert of a type
+        db.Index('ix_alert_user_id_type_is_resolved', 'user_id', 'type', 'is_resolved'),
+        db.Index('ix_alert_user_id_type_timestamp', 'user_id', 'type', 'timestamp'),
+        # get_alerts: a patient's own alerts, and the caregiver feed, newest first
+        db.Index('ix_alert_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_alert_timestamp', 'timestamp'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # The patient who generated the alert
     type = db.Column(db.String(20), nullable=False) # FALL, INACTIVITY, HR_HIGH, HR_LOW, BUTTON
     message = db.Column(db.String(200), nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     is_resolved = db.Column(db.Boolean, default=False)
+    # Server time of the last insert/resolve, drives the incremental alerts feed
+    updated_at = db.Column(
+        db.DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True,
+    )
 
     def to_dict(self):
         return {
@@ -71,5 +132,49 @@ class Alert(db.Model):
             'type': self.type,
             'message': self.message,
             'timestamp': self.timestamp.isoformat(),
-            'is_resolved': self.is_resolved
+            'is_resolved': self.is_resolved,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+
+
+class AlertEvent(db.Model):
+    """
+    Ordered log of alert changes, written in the transaction that makes
+    them: 'alert' for a new alert, 'alert_update' when is_resolved changes.
+    `seq` only grows, and is the event id of /api/alerts/stream, so a
+    reconnecting client replays every change it missed, in order.
+    """
+    __tablename__ = 'alert_event'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = db.Column(db.Integer, primary_key=True)
+    alert_id = db.Column(db.Integer, db.ForeignKey('alert.id'), nullable=False)
+    event = db.Column(db.String(20), nullable=False)
+
+
+def ensure_columns():
+    """
+    Add nullable columns declared on the models that are missing from existing
+    tables. Like ensure_indexes(), this upgrades older health.db files in place.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+
+
+def ensure_indexes():
+    """
+    Create any index declared on the models that is missing from the database.
+    db.create_all() only creates new tables, so this is the migration path for
+    health.db files created before the indexes were declared. Safe to run on
+    every start-up.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
@@ -0,0 +1,99 @@
+"""
+Fixed-layout binary encoding for wristlet uploads, selected by Content-Type.
+
+Every body is a plain concatenation of little-endian records, no header:
+
+  application/vnd.wristlet.imu       int64 epoch-ms, float32 x, y, z                (20 bytes)
+  application/vnd.wristlet.imu+gyro  int64 epoch-ms, float32 x, y, z, gx, gy, gz    (32 bytes)
+  application/vnd.wristlet.hr        int64 epoch-ms, float32 bpm                    (12 bytes)
+
+A body is read as one numpy structured array (np.frombuffer, no copy) and
+validated and converted column by column, so decoding does no JSON
+parsing, no ISO timestamp parsing and no per-record unpacking. Rows are
+returned in time order, whatever the order of the records.
+"""
+from datetime import datetime, timezone
+from itertools import repeat
+
+import numpy as np
+
+IMU_MIMETYPE = 'application/vnd.wristlet.imu'
+IMU_GYRO_MIMETYPE = 'application/vnd.wristlet.imu+gyro'
+HR_MIMETYPE = 'application/vnd.wristlet.hr'
+
+_LAYOUTS = {
+    IMU_MIMETYPE: np.dtype([('t', '<i8'), ('x_axis', '<f4'), ('y_axis', '<f4'), ('z_axis', '<f4')]),
+    IMU_GYRO_MIMETYPE: np.dtype([
+        ('t', '<i8'), ('x_axis', '<f4'), ('y_axis', '<f4'), ('z_axis', '<f4'),
+        ('gx', '<f4'), ('gy', '<f4'), ('gz', '<f4'),
+    ]),
+    HR_MIMETYPE: np.dtype([('t', '<i8'), ('value', '<f4')]),
+}
+
+# Epoch milliseconds a datetime can hold (years 1 to 9999)
+_MIN_MS = -62135596800000
+_MAX_MS = 253402300799999
+
+
+class PackedFormatError(ValueError):
+    pass
+
+
+def is_packed(mimetype: str) -> bool:
+    return mimetype in _LAYOUTS
+
+
+def _records(body: bytes, mimetype: str) -> np.ndarray:
+    """The body's records, validated and sorted by timestamp."""
+    layout = _LAYOUTS[mimetype]
+    if len(body) % layout.itemsize:
+        raise PackedFormatError(f'Body length must be a multiple of {layout.itemsize} bytes')
+    records = np.frombuffer(body, dtype=layout)
+
+    t = records['t']
+    invalid = np.flatnonzero((t < _MIN_MS) | (t > _MAX_MS))
+    if len(invalid):
+        raise PackedFormatError(f'Invalid timestamp: {t[invalid[0]]}')
+    finite = np.ones(len(records), dtype=bool)
+    for name in layout.names[1:]:
+        finite &= np.isfinite(records[name])
+    if not finite.all():
+        raise PackedFormatError(f'Non-finite value (sample {np.argmin(finite)})')
+
+    if len(t) > 1 and (np.diff(t) < 0).any():
+        records = records[np.argsort(t, kind='stable')]
+    return records
+
+
+def _timestamps(records: np.ndarray) -> list:
+    """UTC datetimes of the records' epoch-ms timestamps."""
+    return list(map(datetime.fromtimestamp, (records['t'] / 1000).tolist(), repeat(timezone.utc)))
+
+
+def decode_imu(body: bytes, mimetype: str, user_id: int) -> list:
+    """Decode a packed IMU body into IMUData column dicts."""
+    if mimetype not in (IMU_MIMETYPE, IMU_GYRO_MIMETYPE):
+        raise PackedFormatError(f'Unsupported IMU encoding: {mimetype}')
+    records = _records(body, mimetype)
+    timestamps = _timestamps(records)
+    x, y, z = (records[axis].tolist() for axis in ('x_axis', 'y_axis', 'z_axis'))
+    if mimetype == IMU_GYRO_MIMETYPE:
+        gx, gy, gz = (records[axis].tolist() for axis in ('gx', 'gy', 'gz'))
+    else:
+        gx = gy = gz = [None] * len(records)
+    return [
+        {'user_id': user_id, 'timestamp': timestamp, 'x_axis': x_axis, 'y_axis': y_axis, 'z_axis': z_axis,
+         'gx': gyro_x, 'gy': gyro_y, 'gz': gyro_z}
+        for timestamp, x_axis, y_axis, z_axis, gyro_x, gyro_y, gyro_z in zip(timestamps, x, y, z, gx, gy, gz)
+    ]
+
+
+def decode_heart_rate(body: bytes, mimetype: str, user_id: int) -> list:
+    """Decode a packed heart rate body into HeartRate column dicts."""
+    if mimetype != HR_MIMETYPE:
+        raise PackedFormatError(f'Unsupported heart rate encoding: {mimetype}')
+    records = _records(body, mimetype)
+    return [
+        {'user_id': user_id, 'timestamp': timestamp, 'value': value}
+        for timestamp, value in zip(_timestamps(records), records['value'].tolist())
+    ]
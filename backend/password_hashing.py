@@ -0,0 +1,88 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Too many password hashes in flight; the client should retry later."""
+
+
+def _lower_priority(niceness: int) -> None:
+    # Pool process initializer: hashing yields the CPU to request handling
+    if niceness:
+        os.nice(niceness)
+
+
+class PasswordHasher:
+    """
+    Runs the deliberately slow Werkzeug password hashing for /auth/login and
+    /auth/register in a small pool of worker processes, so a burst of
+    logins cannot take the CPU (and the GIL) from the threads serving
+    wearable ingest. At most PASSWORD_HASH_MAX_PENDING hashes are queued or
+    running per process; beyond that callers get HasherBusy right away
+    instead of piling up. A caller waits on its own thread, so the limit
+    must stay below the server's threads (see gunicorn.conf.py).
+    PASSWORD_HASH_WORKERS = 0 hashes inline.
+
+    Existing hashes are verified with the parameters stored in them, so
+    changing PASSWORD_HASH_METHOD only affects new passwords.
+    """
+
+    def __init__(self):
+        self.method = 'scrypt'
+        self.workers = 0
+        self.niceness = 0
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(1)
+
+    def init_app(self, app) -> None:
+        self.shutdown()
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.niceness = app.config['PASSWORD_HASH_NICE']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+                atexit.unregister(self.shutdown)
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            if not self.workers:
+                return function(*args)
+            return self._get_pool().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # Started on first use; forkserver children do not inherit the
+        # app's threads and open connections
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=_lower_priority,
+                    initargs=(self.niceness,),
+                )
+                atexit.register(self.shutdown)
+            return self._pool
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from models import Patient
+from shared_state import shared_state
+
+# Read-only snapshot of the Patient columns the ingest endpoints need
+PatientThresholds = namedtuple(
+    'PatientThresholds', ['id', 'user_id', 'min_hr', 'max_hr', 'inactivity_limit_minutes', 'alert_rules']
+)
+
+
+class PatientCache:
+    """
+    Bounded LRU cache of patient thresholds keyed by user id, with a TTL as a
+    safety net. Thresholds only change through update_thresholds, which calls
+    invalidate() after committing, so the wearable endpoints can skip the
+    Patient SELECT on every sample. Invalidations are passed on to the
+    other worker processes through shared_state.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.max_size = 10000
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app) -> None:
+        self.max_size = app.config['PATIENT_CACHE_SIZE']
+        self.ttl = app.config['PATIENT_CACHE_TTL_SECONDS']
+        self.clear()
+        shared_state.subscribe('patient_cache.invalidate', self._evict)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, user_id: int):
+        """Return PatientThresholds for `user_id`, or None if there is no such patient."""
+        thresholds = self.cached(user_id)
+        if thresholds is not None:
+            return thresholds
+
+        patient = Patient.query.filter_by(user_id=user_id).first()
+        if not patient:
+            # Not cached: registering the patient must be visible right away
+            return None
+        return self.remember(patient)
+
+    def cached(self, user_id: int):
+        """PatientThresholds for `user_id` if cached, without touching the database."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return None
+
+    def remember(self, patient) -> PatientThresholds:
+        """Cache the thresholds of a Patient loaded by the caller."""
+        thresholds = PatientThresholds(
+            patient.id, patient.user_id, patient.min_hr, patient.max_hr, patient.inactivity_limit_minutes,
+            patient.alert_rules,
+        )
+        with self._lock:
+            self._entries[patient.user_id] = (thresholds, time.monotonic() + self.ttl)
+            self._entries.move_to_end(patient.user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return thresholds
+
+    def invalidate(self, user_id: int) -> None:
+        self._evict(user_id)
+        shared_state.publish('patient_cache.invalidate', user_id)
+
+    def _evict(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+patient_cache = PatientCache()
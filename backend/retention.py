@@ -0,0 +1,129 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, select
+
+from app_logging import get_logger
+from models import db
+from rollups import RAW_COLUMNS, fold_unrolled
+from shared_state import shared_state
+
+log = get_logger('retention')
+
+
+def prune_sensor_data(retention_days: int, chunk_size: int, pause: float = 0.0, now=None) -> dict:
+    """
+    Delete HeartRate/IMUData rows older than `retention_days`, `chunk_size`
+    rows per transaction so ingest writers only ever wait for one short
+    chunk. Rows are folded into the rollups first if they are not there yet.
+    Returns the number of deleted rows per table.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=retention_days)).astimezone(timezone.utc).replace(tzinfo=None)
+
+    deleted = {}
+    for model, columns in RAW_COLUMNS.items():
+        deleted[model.__tablename__] = 0
+        folded = set()
+        while True:
+            rows = db.session.execute(
+                select(model.id, *columns).where(model.timestamp < cutoff).limit(chunk_size)
+            ).mappings().all()
+            if not rows:
+                break
+            fold_unrolled(model, rows, folded)
+            db.session.execute(delete(model).where(model.id.in_([row['id'] for row in rows])))
+            db.session.commit()
+            deleted[model.__tablename__] += len(rows)
+            if pause:
+                time.sleep(pause)
+    return deleted
+
+
+def incremental_vacuum(pages: int) -> None:
+    """Return up to `pages` free pages to the file system (SQLite only)."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.connect() as conn:
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() == 2:
+            conn.exec_driver_sql(f'PRAGMA incremental_vacuum({int(pages)})')
+
+
+def run_retention(app) -> dict:
+    with app.app_context():
+        deleted = prune_sensor_data(
+            app.config['RETENTION_DAYS'],
+            app.config['RETENTION_CHUNK_SIZE'],
+            app.config['RETENTION_CHUNK_PAUSE'],
+        )
+        incremental_vacuum(app.config['RETENTION_VACUUM_PAGES'])
+    return deleted
+
+
+class RetentionScheduler:
+    """
+    Background thread running the retention job every
+    RETENTION_INTERVAL_SECONDS. With several workers only the one holding
+    the shared 'retention' lease runs it.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+
+    def init_app(self, app) -> None:
+        self.stop()
+        app.cli.add_command(prune_command)
+        interval = app.config['RETENTION_INTERVAL_SECONDS']
+        if interval <= 0:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(app, interval), name='retention', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, app, interval: int) -> None:
+        while not self._stop.wait(interval):
+            if not shared_state.acquire_lease('retention', interval * 2):
+                continue
+            try:
+                deleted = run_retention(app)
+                log.info('retention_run', extra={'fields': {'deleted': deleted}})
+            except Exception:
+                log.error('retention_run_failed', exc_info=True)
+
+
+retention_scheduler = RetentionScheduler()
+
+
+@click.command('prune-sensor-data')
+@click.option('--days', type=int, default=None, help='Keep this many days of raw samples (default: RETENTION_DAYS).')
+@click.option('--vacuum', is_flag=True, help='Switch an existing database to incremental auto-vacuum (full VACUUM, run once).')
+@with_appcontext
+def prune_command(days, vacuum):
+    """Fold old raw sensor samples into the rollups and delete them."""
+    config = current_app.config
+    deleted = prune_sensor_data(
+        days if days is not None else config['RETENTION_DAYS'],
+        config['RETENTION_CHUNK_SIZE'],
+        config['RETENTION_CHUNK_PAUSE'],
+    )
+    click.echo(f"Deleted {deleted['heart_rate']} heart rate and {deleted['imu_data']} IMU rows")
+
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.exec_driver_sql('VACUUM')
+        click.echo('Database rewritten with auto_vacuum=INCREMENTAL')
+    incremental_vacuum(config['RETENTION_VACUUM_PAGES'])
@@ -0,0 +1,255 @@
+import functools
+import math
+from datetime import datetime, timezone
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, case, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, HeartRate, IMUData, SensorRollup
+
+# Bucket sizes kept for every metric: per minute and per hour
+ROLLUP_RESOLUTIONS = (60, 3600)
+
+METRICS = ('heart_rate', 'imu_magnitude')
+
+# Raw columns needed to fold a row into the rollups
+RAW_COLUMNS = {
+    HeartRate: (HeartRate.user_id, HeartRate.timestamp, HeartRate.value),
+    IMUData: (IMUData.user_id, IMUData.timestamp, IMUData.x_axis, IMUData.y_axis, IMUData.z_axis),
+}
+
+
+def _epoch(timestamp: datetime) -> int:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp())
+
+
+def _from_epoch(epoch: int) -> datetime:
+    # Stored naive, in UTC, like the other DateTime columns
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+def _metric_values(model, rows):
+    """Yield (user_id, metric, timestamp, value) for raw HeartRate/IMUData rows."""
+    if model is HeartRate:
+        for row in rows:
+            yield row['user_id'], 'heart_rate', row['timestamp'], float(row['value'])
+    elif model is IMUData:
+        for row in rows:
+            magnitude = math.sqrt(row['x_axis'] ** 2 + row['y_axis'] ** 2 + row['z_axis'] ** 2)
+            yield row['user_id'], 'imu_magnitude', row['timestamp'], magnitude
+
+
+def _buckets(model, rows: list) -> dict:
+    """Aggregate raw rows per (user_id, metric, bucket_seconds, bucket_start) into [count, sum, min, max]."""
+    buckets = {}
+    for user_id, metric, timestamp, value in _metric_values(model, rows):
+        epoch = _epoch(timestamp)
+        for bucket_seconds in ROLLUP_RESOLUTIONS:
+            key = (user_id, metric, bucket_seconds, epoch - epoch % bucket_seconds)
+            agg = buckets.get(key)
+            if agg is None:
+                buckets[key] = [1, value, value, value]
+            else:
+                agg[0] += 1
+                agg[1] += value
+                if value < agg[2]:
+                    agg[2] = value
+                if value > agg[3]:
+                    agg[3] = value
+    return buckets
+
+
+@functools.lru_cache(maxsize=None)
+def _upsert_statement(dialect: str):
+    table = SensorRollup.__table__
+    stmt = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table)
+    excluded = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id', 'metric', 'bucket_seconds', 'bucket_start'],
+        set_={
+            'count': table.c['count'] + excluded['count'],
+            'value_sum': table.c.value_sum + excluded.value_sum,
+            'value_min': case((excluded.value_min < table.c.value_min, excluded.value_min), else_=table.c.value_min),
+            'value_max': case((excluded.value_max > table.c.value_max, excluded.value_max), else_=table.c.value_max),
+        },
+    )
+
+
+def rollup_upsert(model, rows: list, dialect: str):
+    """
+    Return (statement, params) folding `rows` into their minute and hour
+    buckets on a `dialect` database, or None when there is nothing to fold.
+    Lets callers with their own (e.g. async) session run the upsert. The
+    statement is built once per dialect.
+    """
+    buckets = _buckets(model, rows)
+    if not buckets:
+        return None
+    params = [
+        {
+            'user_id': user_id, 'metric': metric, 'bucket_seconds': bucket_seconds,
+            'bucket_start': _from_epoch(start),
+            'count': agg[0], 'value_sum': agg[1], 'value_min': agg[2], 'value_max': agg[3],
+        }
+        for (user_id, metric, bucket_seconds, start), agg in buckets.items()
+    ]
+    return _upsert_statement(dialect), params
+
+
+def update_rollups(model, rows: list) -> None:
+    """
+    Fold freshly ingested HeartRate/IMUData rows into their minute and hour
+    buckets. Rows are aggregated in memory first, so a batch costs one upsert
+    per touched bucket. Runs in the caller's transaction.
+    """
+    upsert = rollup_upsert(model, rows, db.session.get_bind().dialect.name)
+    if upsert:
+        db.session.execute(*upsert)
+
+
+def fold_unrolled(model, rows: list, folded: set) -> int:
+    """
+    Fold raw rows into the rollups unless they are already represented.
+    Rows ingested since rollups are maintained always have a minute bucket;
+    rows stored before that have none, so only rows whose minute bucket is
+    missing are folded. `folded` collects the (user id, minute) buckets
+    created this way so later chunks of the same job keep folding into them.
+    Used by the retention job before deleting raw rows and by
+    backfill_rollups. Returns the number of rows folded.
+    """
+    if not rows:
+        return 0
+    metric = 'heart_rate' if model is HeartRate else 'imu_magnitude'
+
+    def minute_key(row):
+        epoch = _epoch(row['timestamp'])
+        return row['user_id'], _from_epoch(epoch - epoch % 60)
+
+    keys = {minute_key(row) for row in rows} - folded
+    existing = set()
+    if keys:
+        existing = set(db.session.execute(
+            select(SensorRollup.user_id, SensorRollup.bucket_start).where(
+                SensorRollup.metric == metric,
+                SensorRollup.bucket_seconds == 60,
+                SensorRollup.user_id.in_({user_id for user_id, _ in keys}),
+                SensorRollup.bucket_start.in_({start for _, start in keys}),
+            )
+        ).all())
+    folded.update(keys - existing)
+    unrolled = [row for row in rows if minute_key(row) in folded]
+    update_rollups(model, unrolled)
+    return len(unrolled)
+
+
+def backfill_rollups(chunk_size: int) -> dict:
+    """
+    Fold the raw rows that have no rollups (stored before rollups were
+    maintained) into them, so history covers them too. Walks each patient's
+    rows in time order, `chunk_size` per transaction, with fold_unrolled, so
+    it can run next to live ingest and again without counting a row twice.
+    Returns the number of rows folded per table.
+    """
+    folded_rows = {}
+    for model, columns in RAW_COLUMNS.items():
+        folded_rows[model.__tablename__] = 0
+        for user_id in db.session.scalars(select(model.user_id).distinct()).all():
+            folded = set()
+            after = None
+            while True:
+                query = select(model.id, *columns).where(model.user_id == user_id)
+                if after is not None:
+                    query = query.where(or_(
+                        model.timestamp > after[0], and_(model.timestamp == after[0], model.id > after[1]),
+                    ))
+                rows = db.session.execute(
+                    query.order_by(model.timestamp, model.id).limit(chunk_size)
+                ).mappings().all()
+                if not rows:
+                    break
+                folded_rows[model.__tablename__] += fold_unrolled(model, rows, folded)
+                db.session.commit()
+                after = rows[-1]['timestamp'], rows[-1]['id']
+                # Later rows cannot fall into earlier minutes: keep `folded` small
+                minute = _from_epoch(_epoch(after[0]) // 60 * 60)
+                folded = {key for key in folded if key[1] >= minute}
+    return folded_rows
+
+
+@click.command('backfill-rollups')
+@click.option('--chunk-size', type=int, default=5000, show_default=True, help='Raw rows folded per transaction.')
+@with_appcontext
+def backfill_rollups_command(chunk_size):
+    """Fold raw sensor rows stored before rollups existed into them (run once after upgrading)."""
+    folded = backfill_rollups(chunk_size)
+    click.echo(f"Folded {folded['heart_rate']} heart rate and {folded['imu_data']} IMU rows into the rollups")
+
+
+def _bucket_count(start_epoch: int, end_epoch: int, bucket_seconds: int) -> int:
+    """Number of epoch-aligned buckets of `bucket_seconds` that [start, end) touches."""
+    return -(-end_epoch // bucket_seconds) - start_epoch // bucket_seconds
+
+
+def history(user_id: int, metric: str, start: datetime, end: datetime, max_points: int):
+    """
+    Return (bucket_seconds, points) for `metric` between `start` and `end`.
+    Minute rollups are used while they fit in `max_points`, hour rollups
+    otherwise; hour buckets are merged further when even those would not fit,
+    so the number of points never exceeds `max_points`. Buckets are aligned
+    to the epoch, so an unaligned range is counted from the start of its
+    first bucket.
+    """
+    start_epoch, end_epoch = _epoch(start), max(_epoch(end), _epoch(start) + 1)
+    source = ROLLUP_RESOLUTIONS[-1]
+    for resolution in ROLLUP_RESOLUTIONS:
+        if _bucket_count(start_epoch, end_epoch, resolution) <= max_points:
+            source = resolution
+            break
+    factor = max(1, math.ceil((end_epoch - start_epoch) / source / max_points))
+    while _bucket_count(start_epoch, end_epoch, source * factor) > max_points:
+        factor += 1
+    bucket_seconds = source * factor
+
+    rows = db.session.execute(
+        select(
+            SensorRollup.bucket_start, SensorRollup.count, SensorRollup.value_sum,
+            SensorRollup.value_min, SensorRollup.value_max,
+        )
+        .where(
+            SensorRollup.user_id == user_id,
+            SensorRollup.metric == metric,
+            SensorRollup.bucket_seconds == source,
+            SensorRollup.bucket_start >= _from_epoch(start_epoch - start_epoch % source),
+            SensorRollup.bucket_start < _from_epoch(end_epoch),
+        )
+        .order_by(SensorRollup.bucket_start)
+    ).all()
+
+    points = []
+    current = None
+    for bucket_start, count, value_sum, value_min, value_max in rows:
+        epoch = _epoch(bucket_start)
+        epoch -= epoch % bucket_seconds
+        if current is None or current[0] != epoch:
+            current = [epoch, count, value_sum, value_min, value_max]
+            points.append(current)
+        else:
+            current[1] += count
+            current[2] += value_sum
+            current[3] = min(current[3], value_min)
+            current[4] = max(current[4], value_max)
+
+    return bucket_seconds, [
+        {
+            'timestamp': datetime.fromtimestamp(epoch, timezone.utc).isoformat(),
+            'count': count,
+            'min': value_min,
+            'max': value_max,
+            'mean': value_sum / count,
+        }
+        for epoch, count, value_sum, value_min, value_max in points
+    ]
@@ -1,154 +1,183 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
-from models import db, User, Patient, IMUData, HeartRate, Alert
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity
+from models import db, User, Patient, IMUData, HeartRate, Alert, AlertEvent
+from alert_stream import alert_hub, format_event
+from patient_cache import patient_cache
+from alert_rules import RuleError, compile_rules
+from identity import current_identity, identity_claims, may_have_patient_profile
+from password_hashing import password_hasher, HasherBusy
+from ingest_queue import ingest_queue
+from app_logging import get_logger, log_event
+from rollups import METRICS, history, update_rollups
+from wearable import (
+    IngestError, parse_timestamp, packed_rows, heart_rate_rows, imu_rows, imu_batch_rows,
+    button_alert, reported_inactivity_alert, device_fall_alert, record_samples,
+)
+from stream_owner import stream_owner
+import packed_ingest
+import backfill
+from sqlalchemy import and_, func, insert, or_, select
 from datetime import datetime, timedelta, timezone
+import base64
+import hashlib
+import io
+import json
+import logging
+import queue
 
 api = Blueprint('api', __name__)
 
-# Minimum spacing between two alerts of the same type for a user
-ALERT_COOLDOWN = timedelta(minutes=3)
+auth_log = get_logger('auth')
 
 
-def should_create_alert(user_id: int, alert_type: str, timestamp: datetime) -> bool:
+def parse_history_time(value):
+    if not value:
+        return None
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def store_samples(model, rows: list) -> bool:
     """
-    Avoid spamming identical alerts by skipping new ones when there is already
-    an unresolved alert of the same type or a very recent one within the
-    cooldown window.
+    Write raw sensor rows (HeartRate/IMUData column dicts) and fold them into
+    the history rollups. With the write-behind ingest queue enabled they are
+    queued for the next group commit, otherwise they are bulk inserted in the
+    current transaction. The caller runs stream_owner.alerts() on them next.
+    Returns False when the ingest queue is full.
     """
-    existing_unresolved = Alert.query.filter_by(
-        user_id=user_id, type=alert_type, is_resolved=False
-    ).first()
-    if existing_unresolved:
-        return False
-
-    recent_alert = (
-        Alert.query.filter(Alert.user_id == user_id, Alert.type == alert_type)
-        .order_by(Alert.timestamp.desc())
-        .first()
-    )
-    if recent_alert:
-        recent_ts = recent_alert.timestamp
-        if recent_ts.tzinfo is None:
-            recent_ts = recent_ts.replace(tzinfo=timezone.utc)
-        if (timestamp - recent_ts) < ALERT_COOLDOWN:
+    if ingest_queue.enabled:
+        if not ingest_queue.put(model, rows):
             return False
-
+    else:
+        db.session.execute(insert(model), rows)
+        update_rollups(model, rows)
+    record_samples(model, rows)
     return True
 
+
+def ingest_error_response(error: IngestError):
+    return jsonify({'message': error.message}), error.status
+
+
+def auth_busy_response():
+    response = jsonify({'message': 'Too many sign-ins in progress, retry later'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+
+def ingest_busy_response():
+    response = jsonify({'message': 'Ingest queue full, retry later'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @api.route('/')
 def index():
     return jsonify({'message': 'Welcome to the Health Monitoring API!'}), 200
 
 @api.route('/test', methods=['GET', 'POST'])
 def test():
-    print("=== TEST ENDPOINT HIT ===")
-    print(f"Method: {request.method}")
-    print(f"Headers: {dict(request.headers)}")
-    if request.method == 'POST':
-        print(f"Data: {request.get_json()}")
+    log_event(auth_log, logging.DEBUG, 'test_endpoint', method=request.method)
     return jsonify({'message': 'Test successful', 'method': request.method}), 200
 
 @api.route('/auth/register', methods=['POST'])
 def register():
-    print("=== REGISTER REQUEST RECEIVED ===")
     data = request.get_json()
-    print(f"Request data: {data}")
 
     username = data.get('username')
     password = data.get('password')
     user_type = data.get('user_type') # 'caregiver' or 'patient'
 
-    print(f"Username: {username}, UserType: {user_type}")
-
     if not username or not password or not user_type:
-        print("ERROR: Missing required fields")
+        log_event(auth_log, logging.WARNING, 'register_rejected', reason='missing_fields')
         return jsonify({'message': 'Username, password, and user_type required'}), 400
 
     if user_type not in ['caregiver', 'patient']:
-        print(f"ERROR: Invalid user_type: {user_type}")
+        log_event(auth_log, logging.WARNING, 'register_rejected', reason='invalid_user_type', user_type=user_type)
         return jsonify({'message': 'Invalid user_type'}), 400
 
     if User.query.filter_by(username=username).first():
-        print(f"ERROR: Username already exists: {username}")
+        log_event(auth_log, logging.WARNING, 'register_rejected', reason='username_taken', username=username)
         return jsonify({'message': 'Username already exists'}), 400
 
-    print("Creating new user...")
-    hashed_password = generate_password_hash(password)
+    try:
+        hashed_password = password_hasher.hash(password)
+    except HasherBusy:
+        log_event(auth_log, logging.WARNING, 'register_rejected', reason='hasher_busy')
+        return auth_busy_response()
     new_user = User(username=username, password_hash=hashed_password, user_type=user_type)
     db.session.add(new_user)
     db.session.commit()
-    print(f"User created with ID: {new_user.id}")
 
     if user_type == 'patient':
         # Create a Patient profile
-        print("Creating patient profile...")
         new_patient = Patient(user_id=new_user.id)
         db.session.add(new_patient)
         db.session.commit()
-        print("Patient profile created")
 
-    print("=== REGISTER SUCCESS ===")
+    log_event(auth_log, logging.INFO, 'user_registered', user_id=new_user.id, user_type=user_type)
     return jsonify({'message': 'User created successfully', 'user_id': new_user.id}), 201
 
 @api.route('/auth/login', methods=['POST'])
 def login():
-    print("=== LOGIN REQUEST RECEIVED ===")
     data = request.get_json()
-    print(f"Request data: {data}")
 
     username = data.get('username')
     password = data.get('password')
 
     user = User.query.filter_by(username=username).first()
 
-    if user and check_password_hash(user.password_hash, password):
-        print(f"LOGIN SUCCESS - User: {username}, ID: {user.id}, Type: {user.user_type}")
-        access_token = create_access_token(identity=str(user.id))
+    try:
+        valid = user is not None and password_hasher.verify(user.password_hash, password)
+    except HasherBusy:
+        log_event(auth_log, logging.WARNING, 'login_rejected', reason='hasher_busy')
+        return auth_busy_response()
+
+    if valid:
+        log_event(auth_log, logging.INFO, 'login_succeeded', user_id=user.id, user_type=user.user_type)
+        # Role and patient id as claims: authorization then needs no User load
+        access_token = create_access_token(identity=str(user.id), additional_claims=identity_claims(user))
         return jsonify({'access_token': access_token, 'user_type': user.user_type, 'user_id': user.id}), 200
 
-    print(f"LOGIN FAILED - Invalid credentials for username: {username}")
+    log_event(auth_log, logging.WARNING, 'login_failed', username=username)
     return jsonify({'message': 'Invalid credentials'}), 401
 
 # --- Wearable Data Endpoints ---
+# Parsing and alerting rules live in wearable.py, shared with the asyncio
+# ingest service (asgi_ingest.py).
 
 @api.route('/api/wearable/heart_rate', methods=['POST'])
 @jwt_required()
 def receive_heart_rate():
+    """
+    Receive one heart rate sample as JSON, or many as packed
+    application/vnd.wristlet.hr records (see packed_ingest). A packed upload
+    raises at most one HR_LOW and one HR_HIGH alert, for the first sample out
+    of range. With several processes the alerts are raised by the stream
+    owner shortly after (see stream_owner).
+    """
     current_user_id = get_jwt_identity()
     user_id = int(current_user_id)
-    
-    data = request.get_json()
-    value = data.get('value')
-    timestamp_str = data.get('timestamp')
 
-    if value is None:
-        return jsonify({'message': 'Value required'}), 400
+    try:
+        if packed_ingest.is_packed(request.mimetype):
+            rows = packed_rows(HeartRate, user_id, request.mimetype, request.get_data(),
+                               current_app.config['IMU_BATCH_MAX_SAMPLES'])
+        else:
+            rows = heart_rate_rows(user_id, request.get_json())
+    except IngestError as e:
+        return ingest_error_response(e)
 
-    patient = Patient.query.filter_by(user_id=user_id).first()
+    patient = patient_cache.get(user_id) if may_have_patient_profile(get_jwt()) else None
     if not patient:
          return jsonify({'message': 'Patient not found'}), 404
 
-    timestamp = datetime.now(timezone.utc)
-    if timestamp_str:
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str)
-        except ValueError:
-            pass
+    if not store_samples(HeartRate, rows):
+        return ingest_busy_response()
 
-    new_hr = HeartRate(user_id=user_id, value=value, timestamp=timestamp)
-    db.session.add(new_hr)
-    
     # Check HR Thresholds
-    if value < patient.min_hr:
-        if should_create_alert(user_id, 'HR_LOW', timestamp):
-            alert = Alert(user_id=user_id, type='HR_LOW', message=f'Heart rate low: {value}', timestamp=timestamp)
-            db.session.add(alert)
-    elif value > patient.max_hr:
-        if should_create_alert(user_id, 'HR_HIGH', timestamp):
-            alert = Alert(user_id=user_id, type='HR_HIGH', message=f'Heart rate high: {value}', timestamp=timestamp)
-            db.session.add(alert)
-
+    db.session.add_all(stream_owner.alerts(HeartRate, patient, rows))
     db.session.commit()
     return jsonify({'message': 'Heart rate data processed'}), 201
 
@@ -158,66 +187,84 @@ def receive_imu():
     current_user_id = get_jwt_identity()
     user_id = int(current_user_id)
 
-    data = request.get_json()
-    x = data.get('x_axis')
-    y = data.get('y_axis')
-    z = data.get('z_axis')
-    gx = data.get('gx')
-    gy = data.get('gy')
-    gz = data.get('gz')
-    timestamp_str = data.get('timestamp')
-
-    if x is None or y is None or z is None:
-        return jsonify({'message': 'Accelerometer data required'}), 400
-
-    patient = Patient.query.filter_by(user_id=user_id).first()
+    try:
+        rows = imu_rows(user_id, request.get_json())
+    except IngestError as e:
+        return ingest_error_response(e)
+
+    patient = patient_cache.get(user_id) if may_have_patient_profile(get_jwt()) else None
     if not patient:
          return jsonify({'message': 'Patient not found'}), 404
 
-    timestamp = datetime.now(timezone.utc)
-    if timestamp_str:
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str)
-        except ValueError:
-            pass
-
-    new_imu = IMUData(
-        user_id=user_id, 
-        x_axis=x, y_axis=y, z_axis=z, 
-        gx=gx, gy=gy, gz=gz,
-        timestamp=timestamp
-    )
-    db.session.add(new_imu)
-
-    # Check Inactivity
-    limit_time = timestamp - timedelta(minutes=patient.inactivity_limit_minutes)
-    recent_records = IMUData.query.filter(IMUData.user_id == user_id, IMUData.timestamp >= limit_time).all()
-    
-    if recent_records:
-        first_record_in_window = recent_records[0]
-        record_ts = first_record_in_window.timestamp
-        if record_ts.tzinfo is None:
-            record_ts = record_ts.replace(tzinfo=timezone.utc)
-            
-        if (timestamp - record_ts).total_seconds() / 60 >= patient.inactivity_limit_minutes:
-                has_movement = False
-                # Hareket eşiği: değişim > 1.0 ise hareket var sayılır
-                # (sensör verisi gürültülü olduğu için düşük değerler filtrelenir)
-                MOTION_THRESHOLD = 1.0
-                for record in recent_records:
-                    if abs(record.x_axis - x) > MOTION_THRESHOLD or abs(record.y_axis - y) > MOTION_THRESHOLD or abs(record.z_axis - z) > MOTION_THRESHOLD:
-                        has_movement = True
-                        break
-                
-                if not has_movement:
-                    existing_alert = Alert.query.filter_by(user_id=user_id, type='INACTIVITY', is_resolved=False).first()
-                    if not existing_alert:
-                        alert = Alert(user_id=user_id, type='INACTIVITY', message='Patient inactive', timestamp=timestamp)
-                        db.session.add(alert)
+    if not store_samples(IMUData, rows):
+        return ingest_busy_response()
 
+    # Check Inactivity and falls
+    db.session.add_all(stream_owner.alerts(IMUData, patient, rows))
     db.session.commit()
     return jsonify({'message': 'IMU data processed'}), 201
 
+
+@api.route('/api/wearable/imu/batch', methods=['POST'])
+@jwt_required()
+def receive_imu_batch():
+    """
+    Receive many IMU samples in one request, as JSON or as packed
+    application/vnd.wristlet.imu(+gyro) records (see packed_ingest). All
+    samples are written with a single bulk insert and the inactivity check
+    runs once, against the most recent sample of the batch.
+    """
+    current_user_id = get_jwt_identity()
+    user_id = int(current_user_id)
+    max_samples = current_app.config['IMU_BATCH_MAX_SAMPLES']
+
+    try:
+        if packed_ingest.is_packed(request.mimetype):
+            rows = packed_rows(IMUData, user_id, request.mimetype, request.get_data(), max_samples)
+        else:
+            rows = imu_batch_rows(user_id, request.get_json(), max_samples)
+    except IngestError as e:
+        return ingest_error_response(e)
+
+    patient = patient_cache.get(user_id) if may_have_patient_profile(get_jwt()) else None
+    if not patient:
+         return jsonify({'message': 'Patient not found'}), 404
+
+    rows.sort(key=lambda row: row['timestamp'])
+    if not store_samples(IMUData, rows):
+        return ingest_busy_response()
+
+    db.session.add_all(stream_owner.alerts(IMUData, patient, rows))
+    db.session.commit()
+    return jsonify({'message': 'IMU batch processed', 'count': len(rows)}), 201
+
+@api.route('/api/wearable/backfill', methods=['POST'])
+@jwt_required()
+def receive_backfill():
+    """
+    Import a recording the wristlet kept while offline, streamed as text/csv
+    or application/x-ndjson (see backfill). Alerts missed in that period are
+    raised once the import ends. A malformed row stops the import with 400;
+    the rows before it are kept and reported in the counts.
+    """
+    current_user_id = get_jwt_identity()
+    user_id = int(current_user_id)
+
+    fmt = backfill.MIMETYPES.get(request.mimetype)
+    if fmt is None:
+        return jsonify({'message': 'Content-Type must be text/csv or application/x-ndjson'}), 415
+
+    patient = patient_cache.get(user_id) if may_have_patient_profile(get_jwt()) else None
+    if not patient:
+         return jsonify({'message': 'Patient not found'}), 404
+
+    lines = io.TextIOWrapper(request.stream, encoding=request.mimetype_params.get('charset', 'utf-8'), newline='')
+    result = backfill.import_recording(lines, fmt, patient, current_app.config['BACKFILL_CHUNK_SIZE'])
+    error = result.pop('error')
+    if error:
+        return jsonify({'message': error, **result}), 400
+    return jsonify({'message': 'Recording imported', **result}), 201
+
 @api.route('/api/wearable/button', methods=['POST'])
 @jwt_required()
 def receive_button():
@@ -226,21 +273,12 @@ def receive_button():
 
     data = request.get_json()
     panic = data.get('panic_button_status')
-    timestamp_str = data.get('timestamp')
 
     if panic is None:
         return jsonify({'message': 'Status required'}), 400
 
     if panic:
-        timestamp = datetime.now(timezone.utc)
-        if timestamp_str:
-            try:
-                timestamp = datetime.fromisoformat(timestamp_str)
-            except ValueError:
-                pass
-        
-        alert = Alert(user_id=user_id, type='BUTTON', message='Panic button pressed', timestamp=timestamp)
-        db.session.add(alert)
+        db.session.add(button_alert(user_id, parse_timestamp(data.get('timestamp'))))
         db.session.commit()
 
     return jsonify({'message': 'Button status processed'}), 201
@@ -257,35 +295,18 @@ def receive_inactivity():
     user_id = int(current_user_id)
 
     data = request.get_json()
-    inactivity_detected = data.get('inactivity_detected')
-    timestamp_str = data.get('timestamp')
-
-    if not inactivity_detected:
+    if not data.get('inactivity_detected'):
         return jsonify({'message': 'No inactivity detected'}), 200
 
-    timestamp = datetime.now(timezone.utc)
-    if timestamp_str:
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str)
-        except ValueError:
-            pass
-
-    # Check if we should create the alert (avoid spam)
-    if should_create_alert(user_id, 'INACTIVITY', timestamp):
-        alert = Alert(
-            user_id=user_id, 
-            type='INACTIVITY', 
-            message='Patient inactivity detected by wristlet', 
-            timestamp=timestamp
-        )
-        db.session.add(alert)
-        db.session.commit()
-        print(f"[INACTIVITY] Alert created for user {user_id}")
-        return jsonify({'message': 'Inactivity alert created'}), 201
-    else:
-        print(f"[INACTIVITY] Alert skipped (cooldown) for user {user_id}")
+    # Skipped when already reported recently (avoid spam)
+    alert = reported_inactivity_alert(user_id, parse_timestamp(data.get('timestamp')))
+    if alert is None:
         return jsonify({'message': 'Inactivity already reported recently'}), 200
 
+    db.session.add(alert)
+    db.session.commit()
+    return jsonify({'message': 'Inactivity alert created'}), 201
+
 
 @api.route('/api/wearable/fall', methods=['POST'])
 @jwt_required()
@@ -303,35 +324,17 @@ def receive_fall():
 
     data = request.get_json()
     probability = data.get('probability')
-    bpm = data.get('bpm')
-    timestamp_str = data.get('timestamp')
 
     if probability is None:
         return jsonify({'message': 'Probability required'}), 400
 
-    timestamp = datetime.now(timezone.utc)
-    if timestamp_str:
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str)
-        except ValueError:
-            pass
-
-    if should_create_alert(user_id, 'FALL', timestamp):
-        message = f'Fall detected (p={probability:.2f}'
-        if bpm is not None:
-            message += f', bpm={bpm}'
-        message += ')'
-        alert = Alert(
-            user_id=user_id,
-            type='FALL',
-            message=message,
-            timestamp=timestamp
-        )
-        db.session.add(alert)
-        db.session.commit()
-        return jsonify({'message': 'Fall alert created'}), 201
+    alert = device_fall_alert(user_id, probability, data.get('bpm'), parse_timestamp(data.get('timestamp')))
+    if alert is None:
+        return jsonify({'message': 'Fall already reported recently'}), 200
 
-    return jsonify({'message': 'Fall already reported recently'}), 200
+    db.session.add(alert)
+    db.session.commit()
+    return jsonify({'message': 'Fall alert created'}), 201
 
 # --- Caregiver/Patient Endpoints ---
 
@@ -347,6 +350,13 @@ def update_thresholds(patient_id):
     if not patient:
         return jsonify({'message': 'Patient not found'}), 404
 
+    if 'alert_rules' in data:
+        # Patient-specific rules (see alert_rules); [] or null removes them
+        try:
+            compile_rules(data['alert_rules'] or [])
+        except RuleError as e:
+            return jsonify({'message': f'Invalid alert rules: {e}'}), 400
+        patient.alert_rules = json.dumps(data['alert_rules']) if data['alert_rules'] else None
     if 'min_hr' in data:
         patient.min_hr = data['min_hr']
     if 'max_hr' in data:
@@ -355,42 +365,285 @@ def update_thresholds(patient_id):
         patient.inactivity_limit_minutes = data['inactivity_limit_minutes']
     
     db.session.commit()
+    patient_cache.invalidate(patient_id)
     return jsonify({'message': 'Thresholds updated', 'patient': patient.to_dict()}), 200
 
+def _encode_cursor(alert: Alert) -> str:
+    raw = f'{alert.timestamp.isoformat()}|{alert.id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def _decode_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    timestamp_str, alert_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(timestamp_str), int(alert_id)
+
+
 @api.route('/api/alerts', methods=['GET'])
 @jwt_required()
 def get_alerts():
-    current_user_id = get_jwt_identity()
-    user = db.session.get(User, current_user_id)
-    
-    if user.user_type == 'caregiver':
+    """
+    List alerts newest first, one page at a time. Optional query parameters:
+      limit     page size (default ALERTS_PAGE_SIZE, at most ALERTS_MAX_PAGE_SIZE)
+      cursor    X-Next-Cursor header of the previous page
+      after_id  only alerts with a larger id, i.e. created since that alert
+      since     only alerts created or resolved after this ISO timestamp
+    The body stays a JSON list. The next page's cursor is sent in the
+    X-Next-Cursor header and the feed carries an ETag, so an unchanged feed
+    answers If-None-Match with 304 before any alert is loaded.
+    """
+    identity = current_identity()
+
+    query = Alert.query
+    if identity.role == 'caregiver':
         # Caregivers see ALL alerts
-        alerts = Alert.query.order_by(Alert.timestamp.desc()).all()
+        scope = 'all'
     else:
         # Patient sees their own alerts
-        alerts = Alert.query.filter_by(user_id=user.id).order_by(Alert.timestamp.desc()).all()
-        
-    return jsonify([alert.to_dict() for alert in alerts]), 200
+        query = query.filter_by(user_id=identity.user_id)
+        scope = f'user:{identity.user_id}'
+
+    # Alerts are never deleted, so a new alert moves max(id) and a resolved
+    # one moves max(updated_at); both are single index lookups.
+    max_id, last_change = query.with_entities(func.max(Alert.id), func.max(Alert.updated_at)).one()
+    etag = hashlib.sha1(
+        f'{scope}|{request.query_string.decode()}|{max_id}|{last_change}'.encode()
+    ).hexdigest()
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        limit = request.args.get('limit', current_app.config['ALERTS_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, current_app.config['ALERTS_MAX_PAGE_SIZE']))
+        after_id = request.args.get('after_id', type=int)
+        since = request.args.get('since')
+        cursor = request.args.get('cursor')
+        if after_id is not None:
+            query = query.filter(Alert.id > after_id)
+        if since:
+            since_ts = datetime.fromisoformat(since)
+            if since_ts.tzinfo is not None:
+                since_ts = since_ts.astimezone(timezone.utc).replace(tzinfo=None)
+            query = query.filter(Alert.updated_at > since_ts)
+        if cursor:
+            cursor_ts, cursor_id = _decode_cursor(cursor)
+            query = query.filter(or_(
+                Alert.timestamp < cursor_ts,
+                and_(Alert.timestamp == cursor_ts, Alert.id < cursor_id),
+            ))
+    except ValueError:
+        return jsonify({'message': 'Invalid since or cursor'}), 400
+
+    alerts = query.order_by(Alert.timestamp.desc(), Alert.id.desc()).limit(limit + 1).all()
+    has_more = len(alerts) > limit
+    alerts = alerts[:limit]
+
+    response = jsonify([alert.to_dict() for alert in alerts])
+    response.set_etag(etag)
+    if has_more:
+        response.headers['X-Next-Cursor'] = _encode_cursor(alerts[-1])
+    return response, 200
+
+@api.route('/api/alerts/stream', methods=['GET'])
+@jwt_required()
+def stream_alerts():
+    """
+    Server-Sent Events feed of alert changes, replacing /api/alerts polling.
+    New alerts arrive as `alert` events and resolved ones as `alert_update`,
+    pushed as soon as the creating request commits. Event ids are the
+    AlertEvent sequence, so a reconnecting client sends Last-Event-ID and
+    first receives every change it missed, resolutions included, in order,
+    read ALERTS_MAX_PAGE_SIZE at a time until caught up.
+
+    An open stream holds one server thread (gunicorn: GUNICORN_THREADS per
+    worker); past ALERT_STREAM_MAX_CLIENTS per process new streams get 503.
+    """
+    identity = current_identity()
+    scope_user_id = None if identity.role == 'caregiver' else identity.user_id
+
+    # Subscribe before the catch-up query so nothing falls in between
+    subscriber = alert_hub.subscribe(scope_user_id)
+    if subscriber is None:
+        response = jsonify({'message': 'Too many open alert streams, retry later'})
+        response.headers['Retry-After'] = str(current_app.config['ALERT_STREAM_KEEPALIVE_SECONDS'])
+        return response, 503
+
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    keepalive = current_app.config['ALERT_STREAM_KEEPALIVE_SECONDS']
+    page_size = current_app.config['ALERTS_MAX_PAGE_SIZE']
+
+    def missed_events(after: int):
+        """(event, alert dict, seq) of the changes after seq `after`, a page at a time."""
+        query = select(AlertEvent.seq, AlertEvent.event, Alert).join(Alert, Alert.id == AlertEvent.alert_id)
+        if scope_user_id is not None:
+            query = query.where(Alert.user_id == scope_user_id)
+        while True:
+            page = db.session.execute(
+                query.where(AlertEvent.seq > after).order_by(AlertEvent.seq).limit(page_size)
+            ).all()
+            for seq, event_name, alert in page:
+                yield event_name, alert.to_dict(), seq
+            if len(page) < page_size:
+                return
+            after = page[-1][0]
+
+    @stream_with_context
+    def generate():
+        # Live events up to here were replayed already
+        replayed = last_event_id or 0
+        try:
+            yield f'retry: {keepalive * 1000}\n\n'
+            if last_event_id is not None:
+                for event_name, alert, seq in missed_events(last_event_id):
+                    replayed = seq
+                    yield format_event(event_name, alert, seq)
+                # Do not hold a connection (and a read snapshot) while streaming
+                db.session.close()
+            while not subscriber.overflowed:
+                try:
+                    event_name, alert, seq = subscriber.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if seq is not None and seq <= replayed:
+                    continue
+                yield format_event(event_name, alert, seq)
+        finally:
+            alert_hub.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
 @api.route('/api/patients', methods=['GET'])
 @jwt_required()
 def get_patients():
-    current_user_id = get_jwt_identity()
-    user = db.session.get(User, current_user_id)
+    """
+    List patients with their username and a live summary (latest heart rate,
+    last IMU sample, open alert count), all from one query. Optional query
+    parameters:
+      limit   page size (default PATIENTS_PAGE_SIZE, at most PATIENTS_MAX_PAGE_SIZE)
+      cursor  X-Next-Cursor header of the previous page
+      search  case-insensitive substring of the username
+    """
+    identity = current_identity()
     
-    if user.user_type != 'caregiver':
+    if identity.role != 'caregiver':
         return jsonify({'message': 'Access denied'}), 403
-        
+
+    limit = request.args.get('limit', current_app.config['PATIENTS_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['PATIENTS_MAX_PAGE_SIZE']))
+    cursor = request.args.get('cursor', type=int)
+    search = request.args.get('search')
+
+    # Correlated subqueries, each answered by a (user_id, ...) index
+    latest_hr = (
+        select(HeartRate.value)
+        .where(HeartRate.user_id == Patient.user_id)
+        .order_by(HeartRate.timestamp.desc())
+        .limit(1)
+        .correlate(Patient)
+        .scalar_subquery()
+    )
+    latest_hr_at = (
+        select(func.max(HeartRate.timestamp))
+        .where(HeartRate.user_id == Patient.user_id)
+        .correlate(Patient)
+        .scalar_subquery()
+    )
+    last_imu_at = (
+        select(func.max(IMUData.timestamp))
+        .where(IMUData.user_id == Patient.user_id)
+        .correlate(Patient)
+        .scalar_subquery()
+    )
+    open_alert_count = (
+        select(func.count(Alert.id))
+        .where(Alert.user_id == Patient.user_id, Alert.is_resolved == False)  # noqa: E712
+        .correlate(Patient)
+        .scalar_subquery()
+    )
+
     # Caregivers see ALL patients
-    patients = Patient.query.all()
+    query = (
+        select(
+            Patient,
+            User.username,
+            latest_hr,
+            latest_hr_at,
+            last_imu_at,
+            open_alert_count,
+        )
+        .join(User, User.id == Patient.user_id)
+        .order_by(Patient.id)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        query = query.where(Patient.id > cursor)
+    if search:
+        query = query.where(User.username.ilike(f'%{search}%'))
+
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
     result = []
-    for p in patients:
-        p_user = db.session.get(User, p.user_id)
+    for p, username, hr_value, hr_at, imu_at, open_alerts in rows:
         p_dict = p.to_dict()
-        p_dict['username'] = p_user.username
+        p_dict['username'] = username
+        p_dict['latest_hr'] = hr_value
+        p_dict['latest_hr_at'] = hr_at.isoformat() if hr_at else None
+        p_dict['last_imu_at'] = imu_at.isoformat() if imu_at else None
+        p_dict['open_alert_count'] = open_alerts
         result.append(p_dict)
-        
-    return jsonify(result), 200
+
+    response = jsonify(result)
+    if has_more:
+        response.headers['X-Next-Cursor'] = str(rows[-1][0].id)
+    return response, 200
+
+@api.route('/api/patients/<int:patient_id>/history', methods=['GET'])
+@jwt_required()
+def get_history(patient_id):
+    """
+    Sensor history for charts, served from the minute/hour rollups. Query
+    parameters:
+      metric  'heart_rate' (default) or 'imu_magnitude'
+      start   ISO timestamp (default: 24 hours before end)
+      end     ISO timestamp (default: now)
+    The resolution is chosen from the range so that at most
+    HISTORY_MAX_POINTS points are returned.
+    """
+    identity = current_identity()
+
+    if identity.role != 'caregiver' and identity.user_id != patient_id:
+        return jsonify({'message': 'Access denied'}), 403
+
+    metric = request.args.get('metric', 'heart_rate')
+    if metric not in METRICS:
+        return jsonify({'message': f'metric must be one of {", ".join(METRICS)}'}), 400
+
+    try:
+        end = parse_history_time(request.args.get('end')) or datetime.now(timezone.utc)
+        start = parse_history_time(request.args.get('start')) or end - timedelta(hours=24)
+    except ValueError:
+        return jsonify({'message': 'Invalid start or end'}), 400
+    if start >= end:
+        return jsonify({'message': 'start must be before end'}), 400
+
+    bucket_seconds, points = history(
+        patient_id, metric, start, end, current_app.config['HISTORY_MAX_POINTS']
+    )
+    return jsonify({
+        'metric': metric,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'resolution_seconds': bucket_seconds,
+        'points': points,
+    }), 200
 
 @api.route('/api/alerts/<int:alert_id>/resolve', methods=['PUT'])
 @jwt_required()
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+
+import numpy as np
+
+# Columns kept per sensor table; missing values (e.g. no gyro) are NaN
+COLUMNS = {
+    'imu_data': ('x_axis', 'y_axis', 'z_axis', 'gx', 'gy', 'gz'),
+    'heart_rate': ('value',),
+}
+
+
+def _epoch(timestamp: datetime) -> float:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of time-ordered samples: float64 epoch seconds and
+    a float32 row of values per sample. The oldest samples are overwritten
+    once it is full.
+    """
+
+    __slots__ = ('t', 'values', 'written')
+
+    def __init__(self, capacity: int, columns: int):
+        self.t = np.empty(capacity)
+        self.values = np.empty((capacity, columns), dtype=np.float32)
+        self.written = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.t)
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def last_timestamp(self) -> float:
+        return self.t[(self.written - 1) % self.capacity] if self.written else -np.inf
+
+    def extend(self, t: np.ndarray, values: np.ndarray) -> None:
+        """
+        Append samples, sorted by time first so window() can bisect; samples
+        older than the newest one already held are dropped.
+        """
+        if len(t) > 1 and (np.diff(t) < 0).any():
+            order = np.argsort(t, kind='stable')
+            t, values = t[order], values[order]
+        if self.written:
+            keep = t > self.last_timestamp()
+            t, values = t[keep], values[keep]
+        if len(t) > self.capacity:
+            t, values = t[-self.capacity:], values[-self.capacity:]
+        index = (self.written + np.arange(len(t))) % self.capacity
+        self.t[index] = t
+        self.values[index] = values
+        self.written += len(t)
+
+    def window(self, start: float = -np.inf, end: float = np.inf):
+        """Copies of (t, values) with start <= t <= end, oldest first."""
+        head = self.written % self.capacity
+        if self.written <= self.capacity:
+            t, values = self.t[:self.written], self.values[:self.written]
+        else:
+            t = np.concatenate([self.t[head:], self.t[:head]])
+            values = np.concatenate([self.values[head:], self.values[:head]])
+        lo = np.searchsorted(t, start, 'left')
+        hi = np.searchsorted(t, end, 'right')
+        return t[lo:hi].copy(), values[lo:hi].copy()
+
+
+class SensorBuffers:
+    """
+    Recent IMU and heart rate samples per patient, in ring buffers of
+    SENSOR_BUFFER_IMU_SAMPLES / SENSOR_BUFFER_HR_SAMPLES samples. At most
+    SENSOR_BUFFER_MAX_PATIENTS patients are kept, least recently updated
+    first out, so memory use is bounded by memory_bytes() at capacity.
+    Filled by the wearable endpoints for real-time analytics; the database
+    stays the source of truth.
+    """
+
+    def __init__(self):
+        self._patients = OrderedDict()
+        self._lock = Lock()
+        self.capacity = {'imu_data': 1024, 'heart_rate': 256}
+        self.max_patients = 5000
+
+    def init_app(self, app) -> None:
+        with self._lock:
+            self._patients = OrderedDict()
+        self.capacity = {
+            'imu_data': app.config['SENSOR_BUFFER_IMU_SAMPLES'],
+            'heart_rate': app.config['SENSOR_BUFFER_HR_SAMPLES'],
+        }
+        self.max_patients = app.config['SENSOR_BUFFER_MAX_PATIENTS']
+
+    def clear(self) -> None:
+        with self._lock:
+            self._patients = OrderedDict()
+
+    def append(self, kind: str, user_id: int, rows: list) -> None:
+        """Add sensor column dicts of table `kind` for `user_id`, in any order."""
+        columns = COLUMNS[kind]
+        t = np.fromiter((_epoch(row['timestamp']) for row in rows), float, len(rows))
+        values = np.array([[row.get(column) for column in columns] for row in rows], dtype=np.float32)
+
+        with self._lock:
+            buffers = self._patients.get(user_id)
+            if buffers is None:
+                buffers = self._patients[user_id] = {}
+                while len(self._patients) > self.max_patients:
+                    self._patients.popitem(last=False)
+            else:
+                self._patients.move_to_end(user_id)
+            buffer = buffers.get(kind)
+            if buffer is None:
+                buffer = buffers[kind] = RingBuffer(self.capacity[kind], len(columns))
+            buffer.extend(t, values)
+
+    def window(self, kind: str, user_id: int, start: float = -np.inf, end: float = np.inf):
+        """
+        (t, values) of `user_id`'s `kind` samples between epoch seconds
+        `start` and `end`, oldest first; values has one column per COLUMNS[kind].
+        """
+        with self._lock:
+            buffer = self._patients.get(user_id, {}).get(kind)
+            if buffer is None:
+                return np.empty(0), np.empty((0, len(COLUMNS[kind])), dtype=np.float32)
+            return buffer.window(start, end)
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(
+                buffer.t.nbytes + buffer.values.nbytes
+                for buffers in self._patients.values() for buffer in buffers.values()
+            )
+
+
+sensor_buffers = SensorBuffers()
@@ -0,0 +1,221 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from threading import Lock
+
+from app_logging import get_logger
+
+log = get_logger('shared_state')
+
+
+class LocalBackend:
+    """Single process: every cache is already consistent, nothing is shared."""
+
+    def __init__(self):
+        self._values = {}
+
+    def publish(self, origin: str, channel: str, payload: str) -> None:
+        pass
+
+    def latest_seq(self) -> int:
+        return 0
+
+    def poll(self, after_seq: int) -> list:
+        return []
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        return True
+
+    def get_value(self, name: str):
+        return self._values.get(name)
+
+    def set_value(self, name: str, value: str) -> None:
+        self._values[name] = value
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteBackend:
+    """
+    Shared state in a local SQLite file, for several workers on one host:
+    an append-only event log that every worker polls, named leases and
+    named values.
+    Events older than `retention` seconds are trimmed.
+    """
+
+    def __init__(self, path: str, retention: float = 300):
+        self.path = path
+        self.retention = retention
+        self._lock = Lock()
+        self._trimmed_at = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS shared_event ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL,'
+            ' channel TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS shared_lease ('
+            ' name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE TABLE IF NOT EXISTS shared_value (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def publish(self, origin: str, channel: str, payload: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO shared_event (origin, channel, payload, created) VALUES (?, ?, ?, ?)',
+                (origin, channel, payload, time.time()),
+            )
+
+    def latest_seq(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM shared_event').fetchone()[0]
+
+    def poll(self, after_seq: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT seq, origin, channel, payload FROM shared_event WHERE seq > ? ORDER BY seq',
+                (after_seq,),
+            ).fetchall()
+            if time.monotonic() - self._trimmed_at > 60:
+                self._trimmed_at = time.monotonic()
+                self._conn.execute('DELETE FROM shared_event WHERE created < ?', (time.time() - self.retention,))
+        return rows
+
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO shared_lease (name, holder, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires '
+                'WHERE shared_lease.holder = excluded.holder OR shared_lease.expires < ?',
+                (name, holder, now + ttl, now),
+            )
+            row = self._conn.execute('SELECT holder FROM shared_lease WHERE name = ?', (name,)).fetchone()
+        return row is not None and row[0] == holder
+
+    def get_value(self, name: str):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM shared_value WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_value(self, name: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO shared_value (name, value) VALUES (?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET value = excluded.value',
+                (name, value),
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+# SHARED_STATE_URL scheme -> backend factory, given what follows "scheme://".
+# Like SQLAlchemy URLs, sqlite:///file.db is relative and sqlite:////abs/file.db
+# absolute. Other stores (e.g. Redis) plug in here.
+BACKENDS = {
+    'local': lambda location: LocalBackend(),
+    'sqlite': lambda location: SQLiteBackend(location[1:]),
+}
+
+
+def create_backend(url: str):
+    if not url:
+        return LocalBackend()
+    scheme, _, location = url.partition('://')
+    if scheme not in BACKENDS:
+        raise ValueError(f'Unknown SHARED_STATE_URL scheme: {scheme}')
+    return BACKENDS[scheme](location)
+
+
+class SharedState:
+    """
+    Keeps the in-process caches of several worker processes consistent.
+    A cache publishes its changes on a channel; every other worker receives
+    them from a poller thread and applies them locally. Messages are
+    delivered to other processes only, the publisher has applied them
+    already. Also hands out named leases for work that must run in a single
+    worker, such as the retention job, and keeps small named values (JSON)
+    such as the stream owner's position.
+
+    With the default local backend (one process) publishing is a no-op and
+    no thread is started.
+    """
+
+    def __init__(self):
+        self.backend = LocalBackend()
+        self.origin = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._handlers = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def init_app(self, app) -> None:
+        self.stop()
+        self.backend.close()
+        self._handlers = {}
+        self.origin = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.backend = create_backend(app.config['SHARED_STATE_URL'])
+        if isinstance(self.backend, LocalBackend):
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(self.backend.latest_seq(), app.config['SHARED_STATE_POLL_INTERVAL']),
+            name='shared-state', daemon=True,
+        )
+        self._thread.start()
+
+    def subscribe(self, channel: str, handler) -> None:
+        """Call `handler(message)` for every message other workers publish on `channel`."""
+        self._handlers[channel] = handler
+
+    def publish(self, channel: str, message) -> None:
+        try:
+            self.backend.publish(self.origin, channel, json.dumps(message))
+        except sqlite3.Error:
+            log.error('publish_failed', exc_info=True, extra={'fields': {'channel': channel}})
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """True if this worker holds (or just took) lease `name` for `ttl` more seconds."""
+        return self.backend.acquire_lease(name, self.origin, ttl)
+
+    def get_value(self, name: str, default=None):
+        """The value last stored under `name` by any worker, or `default`."""
+        payload = self.backend.get_value(name)
+        return default if payload is None else json.loads(payload)
+
+    def set_value(self, name: str, value) -> None:
+        self.backend.set_value(name, json.dumps(value))
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, seq: int, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                events = self.backend.poll(seq)
+            except sqlite3.Error:
+                log.error('poll_failed', exc_info=True)
+                continue
+            for seq, origin, channel, payload in events:
+                handler = self._handlers.get(channel)
+                if origin == self.origin or handler is None:
+                    continue
+                try:
+                    handler(json.loads(payload))
+                except Exception:
+                    log.error('handler_failed', exc_info=True, extra={'fields': {'channel': channel}})
+
+
+shared_state = SharedState()
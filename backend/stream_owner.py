@@ -0,0 +1,193 @@
+"""
+Single owner of the stream detectors when several processes take wearable
+uploads (gunicorn workers, the asyncio ingest service).
+
+The inactivity tracker, the sensor buffers the fall detector reads, the
+duration and rate-of-change rules and the heart rate baseline keep
+per-patient state built from every sample of the patient in order. A
+process that sees only the uploads routed to it builds that state from part
+of the stream: a patient moving only in uploads handled elsewhere looks
+still and gets a false INACTIVITY alert. So with STREAM_OWNER_ENABLED (the
+default when SHARED_STATE_URL is set) the endpoints only store the samples,
+and the process holding the shared 'stream-owner' lease reads them back
+from the database in insertion order, runs them through the detectors and
+commits the alerts, STREAM_OWNER_POLL_INTERVAL after the upload at most
+(plus the ingest queue's flush interval when it is on). Its position is
+kept in shared_state, so another process takes over where it stopped when
+it goes away. The new owner starts from empty state, apart from what the
+detectors reload themselves (inactivity from recent rows, the baseline from
+its last snapshot), so a fall straddling the takeover may be missed.
+
+Rows are read by id, which SQLite assigns in commit order. On a database
+where concurrent transactions may commit ids out of order (PostgreSQL) a row
+committed after a higher id was read is skipped.
+
+With it off, the detectors run in the request on the process's own uploads,
+which is right for a single process.
+"""
+import logging
+import threading
+from datetime import timezone
+
+from sqlalchemy import func, select
+
+from models import db, HeartRate, IMUData
+from inactivity import inactivity_tracker
+from fall_detection import fall_detector
+from sensor_buffers import sensor_buffers
+from alert_rules import rule_engine
+from hr_baseline import hr_baseline
+from patient_cache import patient_cache
+from shared_state import shared_state
+from wearable import sample_alerts
+from app_logging import get_logger, log_event
+
+log = get_logger('stream_owner')
+
+LEASE = 'stream-owner'
+# shared_state value: {table name: id of the last row processed}
+CURSOR = 'stream-owner.cursor'
+
+MODELS = (HeartRate, IMUData)
+
+
+def stream_owner_enabled(config) -> bool:
+    """STREAM_OWNER_ENABLED as set ('1'/'0'/True/False), else whether SHARED_STATE_URL is."""
+    setting = config['STREAM_OWNER_ENABLED']
+    if setting in ('', None):
+        return bool(config['SHARED_STATE_URL'])
+    return setting in (True, '1')
+
+
+class StreamOwner:
+    """
+    Decides where the stream detectors run and, when one process runs them
+    for all, is the thread that does so while this process holds the lease.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.owner = False
+        self.batch_size = 5000
+        self.lease_seconds = 10.0
+        self._cursor = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def init_app(self, app) -> None:
+        self.stop()
+        config = app.config
+        self.enabled = stream_owner_enabled(config)
+        self.owner = False
+        self.batch_size = config['STREAM_OWNER_BATCH_SIZE']
+        self.lease_seconds = config['STREAM_OWNER_LEASE_SECONDS']
+        if not self.enabled:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, args=(app, config['STREAM_OWNER_POLL_INTERVAL']), name='stream-owner', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def alerts(self, model, patient, rows: list) -> list:
+        """
+        Alerts raised by freshly stored, time-ordered rows of `patient`:
+        those of sample_alerts(), or none when the stream owner will run the
+        detectors on them.
+        """
+        if self.enabled:
+            return []
+        return sample_alerts(model, patient, rows)
+
+    def step(self) -> int:
+        """
+        One round (in an app context): renew or take the lease and process
+        the next page of rows of each table. Returns the rows processed.
+        """
+        if not shared_state.acquire_lease(LEASE, self.lease_seconds):
+            if self.owner:
+                self._release()
+            return 0
+        if not self.owner:
+            self._take_over()
+        return sum(self._process(model) for model in MODELS)
+
+    def _process(self, model) -> int:
+        table = model.__tablename__
+        rows = db.session.execute(
+            select(*model.__table__.columns).where(model.id > self._cursor[table]).order_by(model.id)
+            .limit(self.batch_size)
+        ).mappings().all()
+        if not rows:
+            self._cursor[table] = min(self._cursor[table], self._last_id(model))
+            return 0
+
+        by_patient = {}
+        for row in rows:
+            row = dict(row)
+            if row['timestamp'].tzinfo is None:
+                row['timestamp'] = row['timestamp'].replace(tzinfo=timezone.utc)
+            by_patient.setdefault(row['user_id'], []).append(row)
+        alerts = []
+        for user_id, patient_rows in by_patient.items():
+            patient = patient_cache.get(user_id)
+            if patient is None:
+                continue
+            patient_rows.sort(key=lambda row: row['timestamp'])
+            alerts += sample_alerts(model, patient, patient_rows)
+        db.session.add_all(alerts)
+        db.session.commit()
+
+        self._cursor[table] = rows[-1]['id']
+        shared_state.set_value(CURSOR, self._cursor)
+        return len(rows)
+
+    @staticmethod
+    def _last_id(model) -> int:
+        return db.session.scalar(select(func.max(model.id))) or 0
+
+    def _take_over(self) -> None:
+        # Where the previous owner stopped; the first one starts at the rows
+        # stored from now on. A cursor past the last row is from rows since
+        # deleted: ids restart below it
+        stored = shared_state.get_value(CURSOR, {})
+        self._cursor = {}
+        for model in MODELS:
+            last = self._last_id(model)
+            self._cursor[model.__tablename__] = min(stored.get(model.__tablename__, last), last)
+        self._reset()
+        hr_baseline.load()
+        self.owner = True
+        log_event(log, logging.INFO, 'stream_owner_acquired', cursor=self._cursor)
+
+    def _release(self) -> None:
+        self.owner = False
+        self._reset()
+        log_event(log, logging.WARNING, 'stream_owner_lost')
+
+    @staticmethod
+    def _reset() -> None:
+        inactivity_tracker.clear()
+        fall_detector.clear()
+        sensor_buffers.clear()
+        rule_engine.state.clear()
+        hr_baseline.clear()
+
+    def _run(self, app, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                with app.app_context():
+                    # Drain the backlog before sleeping again
+                    while self.step() and not self._stop.is_set():
+                        pass
+            except Exception:
+                log.error('stream_owner_failed', exc_info=True)
+
+
+stream_owner = StreamOwner()
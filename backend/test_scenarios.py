@@ -1,9 +1,45 @@
 import unittest
+from unittest import mock
 import json
 from app import create_app, db
-from models import User, Patient, Alert, IMUData
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from models import User, Patient, Alert, IMUData, HeartRate, SensorRollup, ensure_columns, ensure_indexes
+from inactivity import inactivity_tracker
+from alert_cache import alert_state_cache
+from patient_cache import patient_cache
+from ingest_queue import IngestQueue, ingest_queue
+from metrics import metrics
+from sensor_buffers import sensor_buffers
+from alert_stream import alert_hub
+from shared_state import shared_state, SQLiteBackend
+from asgi_ingest import IngestService
+from flask_jwt_extended import create_access_token, decode_token
+from password_hashing import password_hasher
+from hr_baseline import hr_baseline
+from alert_rules import ThresholdRule
+from stream_owner import CURSOR, stream_owner
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+from app_logging import async_logging, get_logger
+import logging
+import struct
+import benchmark
 from datetime import datetime, timedelta, timezone
 
+
+def _ingest_worker(conn, overrides, headers):
+    """A separate worker process: posts the IMU samples it receives until None."""
+    app = create_app(overrides)
+    client = app.test_client()
+    conn.send('ready')
+    for sample in iter(conn.recv, None):
+        conn.send(client.post('/api/wearable/imu', json=sample, headers=headers).status_code)
+
+
 class HealthMonitoringTestCase(unittest.TestCase):
     def setUp(self):
         self.app = create_app()
@@ -33,6 +69,11 @@ class HealthMonitoringTestCase(unittest.TestCase):
             'password': password
         })
 
+    def setup_patient(self, username='patient1'):
+        self.register_user(username, 'pass', 'patient')
+        res = self.login_user(username, 'pass')
+        return {'Authorization': f'Bearer {res.json["access_token"]}'}, res.json['user_id']
+
     def test_full_flow(self):
         # 1. Register Caregiver
         res = self.register_user('caregiver1', 'pass', 'caregiver')
@@ -141,5 +182,1237 @@ class HealthMonitoringTestCase(unittest.TestCase):
         types = [a['type'] for a in res.json]
         self.assertIn('INACTIVITY', types)
 
+    def test_imu_batch(self):
+        headers, patient_user_id = self.setup_patient()
+        now = datetime.now(timezone.utc)
+
+        # Row-wise payload
+        samples = [
+            {'x_axis': 0.1 * i, 'y_axis': 0.0, 'z_axis': 9.8,
+             'timestamp': (now - timedelta(seconds=10 - i)).isoformat()}
+            for i in range(10)
+        ]
+        res = self.client.post('/api/wearable/imu/batch', json={'samples': samples}, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json['count'], 10)
+
+        # Columnar payload
+        res = self.client.post('/api/wearable/imu/batch', json={
+            'timestamp': [now.isoformat(), now.isoformat()],
+            'x_axis': [0.0, 0.1], 'y_axis': [0.0, 0.0], 'z_axis': [9.8, 9.8],
+        }, headers=headers)
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            self.assertEqual(IMUData.query.filter_by(user_id=patient_user_id).count(), 12)
+
+        # Missing axis or mismatched column lengths are rejected as a whole
+        res = self.client.post('/api/wearable/imu/batch', json={'samples': [{'x_axis': 1.0}]}, headers=headers)
+        self.assertEqual(res.status_code, 400)
+        res = self.client.post('/api/wearable/imu/batch', json={
+            'x_axis': [0.0, 0.1], 'y_axis': [0.0], 'z_axis': [9.8, 9.8],
+        }, headers=headers)
+        self.assertEqual(res.status_code, 400)
+
+    def test_packed_ingest(self):
+        headers, patient_user_id = self.setup_patient()
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+
+        body = b''.join(struct.pack('<q3f', now_ms - 1000 * (5 - i), 0.1 * i, 0.0, 9.8) for i in range(5))
+        res = self.client.post('/api/wearable/imu/batch', data=body, headers={
+            **headers, 'Content-Type': 'application/vnd.wristlet.imu',
+        })
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json['count'], 5)
+
+        body = struct.pack('<q6f', now_ms, 0.0, 0.0, 9.8, 1.0, 2.0, 3.0)
+        res = self.client.post('/api/wearable/imu/batch', data=body, headers={
+            **headers, 'Content-Type': 'application/vnd.wristlet.imu+gyro',
+        })
+        self.assertEqual(res.status_code, 201)
+
+        # Truncated record
+        res = self.client.post('/api/wearable/imu/batch', data=body[:-1], headers={
+            **headers, 'Content-Type': 'application/vnd.wristlet.imu+gyro',
+        })
+        self.assertEqual(res.status_code, 400)
+
+        body = b''.join(struct.pack('<qf', now_ms + i, value) for i, value in enumerate((70, 150, 160, 30)))
+        res = self.client.post('/api/wearable/heart_rate', data=body, headers={
+            **headers, 'Content-Type': 'application/vnd.wristlet.hr',
+        })
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            imu = IMUData.query.filter_by(user_id=patient_user_id).order_by(IMUData.timestamp).all()
+            self.assertEqual(len(imu), 6)
+            self.assertEqual(imu[-1].gz, 3.0)
+            self.assertIsNone(imu[0].gx)
+            self.assertEqual(HeartRate.query.filter_by(user_id=patient_user_id).count(), 4)
+            # One alert per direction, from the first sample out of range
+            high = Alert.query.filter_by(user_id=patient_user_id, type='HR_HIGH').all()
+            self.assertEqual([alert.message for alert in high], ['Heart rate high: 150.0'])
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id, type='HR_LOW').count(), 1)
+
+    def test_server_side_fall_detection(self):
+        headers, patient_user_id = self.setup_patient()
+        start = datetime.now(timezone.utc) - timedelta(minutes=1)
+
+        def samples(first, count, at):
+            # 50 Hz: upright, a 3 g impact at `at` seconds, then lying on the side
+            rows = []
+            for i in range(first, first + count):
+                offset = i / 50
+                if offset < at:
+                    axes = (0.0, 0.2, 9.8)
+                elif offset < at + 0.06:
+                    axes = (0.0, 30.0, 10.0)
+                else:
+                    axes = (9.8, 0.0, 0.5)
+                rows.append({'x_axis': axes[0], 'y_axis': axes[1], 'z_axis': axes[2],
+                             'timestamp': (start + timedelta(seconds=offset)).isoformat()})
+            return rows
+
+        # The impact is classified once its still period has arrived, across uploads
+        res = self.client.post('/api/wearable/imu/batch', json={'samples': samples(0, 200, 3.0)}, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(Alert.query.filter_by(type='FALL').count(), 0)
+
+        res = self.client.post('/api/wearable/imu/batch', json={'samples': samples(200, 200, 3.0)}, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            alert = Alert.query.filter_by(user_id=patient_user_id, type='FALL').one()
+            self.assertIn('Fall detected by server', alert.message)
+
+        # An impact without stillness afterwards (e.g. clapping) is not a fall
+        moving = [
+            {'x_axis': 0.0, 'y_axis': 30.0 if i % 25 == 0 else 0.2 + (i % 7), 'z_axis': 9.8,
+             'timestamp': (start + timedelta(seconds=30 + i / 50)).isoformat()}
+            for i in range(400)
+        ]
+        with mock.patch('wearable.should_create_alert', return_value=True) as should_create:
+            res = self.client.post('/api/wearable/imu/batch', json={'samples': moving}, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        self.assertNotIn('FALL', [call.args[1] for call in should_create.call_args_list])
+
+    def test_sensor_ring_buffers(self):
+        app = create_app({'SENSOR_BUFFER_IMU_SAMPLES': 8, 'SENSOR_BUFFER_MAX_PATIENTS': 2})
+        client = app.test_client()
+        headers, patient_user_id = self.setup_patient()
+        start = datetime.now(timezone.utc) - timedelta(minutes=1)
+
+        res = client.post('/api/wearable/imu/batch', headers=headers, json={
+            'timestamp': [(start + timedelta(seconds=i)).isoformat() for i in range(10)],
+            'x_axis': [float(i) for i in range(10)], 'y_axis': [0.0] * 10, 'z_axis': [9.8] * 10,
+        })
+        self.assertEqual(res.status_code, 201)
+        client.post('/api/wearable/heart_rate', json={'value': 72, 'timestamp': start.isoformat()}, headers=headers)
+        # Packed records in any order are buffered in time order
+        start_ms = int(start.timestamp() * 1000)
+        body = b''.join(struct.pack('<qf', start_ms + 1000 * i, 70 + i) for i in (3, 1, 2))
+        res = client.post('/api/wearable/heart_rate', data=body, headers={
+            **headers, 'Content-Type': 'application/vnd.wristlet.hr',
+        })
+        self.assertEqual(res.status_code, 201)
+
+        # Only the newest 8 IMU samples are kept, oldest first, missing gyro as NaN
+        t, values = sensor_buffers.window('imu_data', patient_user_id)
+        self.assertEqual(values[:, 0].tolist(), [float(i) for i in range(2, 10)])
+        self.assertTrue(all(value != value for value in values[:, 3]))
+        t, values = sensor_buffers.window('imu_data', patient_user_id, start.timestamp() + 7, start.timestamp() + 8)
+        self.assertEqual(values[:, 0].tolist(), [7.0, 8.0])
+        t, values = sensor_buffers.window('heart_rate', patient_user_id)
+        self.assertEqual(values[:, 0].tolist(), [72.0, 71.0, 72.0, 73.0])
+        self.assertEqual(sensor_buffers.window('heart_rate', patient_user_id, t[1], t[2])[1][:, 0].tolist(), [71.0, 72.0])
+
+        # Late samples are ignored, memory stays bounded by the patient limit
+        sensor_buffers.append('imu_data', patient_user_id, [
+            {'timestamp': start, 'x_axis': 99.0, 'y_axis': 0.0, 'z_axis': 0.0},
+        ])
+        self.assertNotIn(99.0, sensor_buffers.window('imu_data', patient_user_id)[1][:, 0].tolist())
+        sensor_buffers.append('imu_data', patient_user_id, [
+            {'timestamp': start + timedelta(seconds=12), 'x_axis': 12.0, 'y_axis': 0.0, 'z_axis': 0.0},
+            {'timestamp': start + timedelta(seconds=11), 'x_axis': 11.0, 'y_axis': 0.0, 'z_axis': 0.0},
+        ])
+        self.assertEqual(sensor_buffers.window('imu_data', patient_user_id)[1][-3:, 0].tolist(), [9.0, 11.0, 12.0])
+        for other in (1001, 1002):
+            sensor_buffers.append('heart_rate', other, [{'timestamp': start, 'value': 60}])
+        self.assertEqual(len(sensor_buffers.window('imu_data', patient_user_id)[0]), 0)
+
+    def test_shared_state_between_workers(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'shared.db')
+        app = create_app({'SHARED_STATE_URL': f'sqlite:///{path}', 'SHARED_STATE_POLL_INTERVAL': 0.01})
+        client = app.test_client()
+        # A second worker process, talking to the same file
+        other = SQLiteBackend(path)
+        subscriber = alert_hub.subscribe()
+        try:
+            headers, patient_user_id = self.setup_patient()
+            with app.app_context():
+                patient_cache.get(patient_user_id)
+            self.assertEqual(patient_cache.stats()['size'], 1)
+
+            other.publish('other-worker', 'patient_cache.invalidate', json.dumps(patient_user_id))
+            other.publish('other-worker', 'alerts', json.dumps(['alert', {
+                'id': 999, 'user_id': patient_user_id, 'type': 'BUTTON', 'message': 'Panic button pressed',
+                'timestamp': datetime.now(timezone.utc).isoformat(), 'is_resolved': False,
+            }]))
+            self.assertEqual(subscriber.queue.get(timeout=2)[1]['id'], 999)
+            self.assertEqual(patient_cache.stats()['size'], 0)
+            self.assertTrue(alert_state_cache.has_open(patient_user_id, 'BUTTON'))
+
+            # Alerts committed here are published for the other workers
+            client.post('/api/wearable/button', json={'panic_button_status': True}, headers=headers)
+            channels = [row[2] for row in other.poll(0) if row[1] != 'other-worker']
+            self.assertIn('alerts', channels)
+
+            # Only one worker holds a lease until it expires
+            self.assertTrue(shared_state.acquire_lease('retention', 60))
+            self.assertFalse(other.acquire_lease('retention', 'other-worker', 60))
+            self.assertTrue(shared_state.acquire_lease('retention', 60))
+        finally:
+            alert_hub.unsubscribe(subscriber)
+            other.close()
+            shared_state.stop()
+
+    def test_stream_owner_across_workers(self):
+        headers, patient_user_id = self.setup_patient()
+        with self.app.app_context():
+            Patient.query.filter_by(user_id=patient_user_id).update({'inactivity_limit_minutes': 1})
+            db.session.commit()
+        path = os.path.join(tempfile.mkdtemp(), 'shared.db')
+        backend = SQLiteBackend(path)
+        backend.set_value(CURSOR, json.dumps({'heart_rate': 0, 'imu_data': 0}))
+        backend.close()
+        overrides = {'SHARED_STATE_URL': f'sqlite:///{path}', 'STREAM_OWNER_ENABLED': True,
+                     'STREAM_OWNER_POLL_INTERVAL': 0.05, 'PASSWORD_HASH_WORKERS': 0}
+
+        # Two workers taking alternate uploads of one patient
+        context = multiprocessing.get_context('spawn')
+        workers = []
+        for _ in range(2):
+            conn, child = context.Pipe()
+            process = context.Process(target=_ingest_worker, args=(child, overrides, headers))
+            process.start()
+            workers.append((process, conn))
+        try:
+            for _, conn in workers:
+                self.assertEqual(conn.recv(), 'ready')
+            start = datetime.now(timezone.utc) - timedelta(minutes=10)
+            for i in range(48):
+                # Moving for the first two minutes, as only the two workers'
+                # samples together show: each one's own samples are constant
+                z = 12.0 if i < 24 and i % 2 else 9.8
+                sample = {'x_axis': 0.0, 'y_axis': 0.0, 'z_axis': z,
+                          'timestamp': (start + timedelta(seconds=5 * i)).isoformat()}
+                conn = workers[i % 2][1]
+                conn.send(sample)
+                self.assertEqual(conn.recv(), 201)
+
+            still_since = start + timedelta(seconds=5 * 24)
+            for _ in range(100):
+                with self.app.app_context():
+                    alerts = Alert.query.filter_by(user_id=patient_user_id, type='INACTIVITY').all()
+                if alerts:
+                    break
+                threading.Event().wait(0.05)
+        finally:
+            for process, conn in workers:
+                conn.send(None)
+                process.join(10)
+
+        # Only the real inactivity, checked at the newest sample the stream owner had read
+        self.assertEqual(len(alerts), 1)
+        self.assertGreaterEqual(alerts[0].timestamp.replace(tzinfo=timezone.utc), still_since + timedelta(minutes=1))
+
+    def test_sqlite_profile(self):
+        with self.app.app_context():
+            with db.engine.connect() as conn:
+                self.assertEqual(conn.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+                self.assertEqual(conn.exec_driver_sql('PRAGMA synchronous').scalar(), 1)  # NORMAL
+                self.assertEqual(conn.exec_driver_sql('PRAGMA busy_timeout').scalar(), 5000)
+            self.assertEqual(db.engine.pool.size(), self.app.config['DB_POOL_SIZE'])
+
+        # A fresh file: leaving WAL needs the only connection to the database
+        path = os.path.join(tempfile.mkdtemp(), 'rollback.db')
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+            'SQLITE_PROFILE': 'rollback',
+            'SQLITE_PRAGMAS': {'busy_timeout': 250},
+        })
+        with app.app_context():
+            with db.engine.connect() as conn:
+                self.assertEqual(conn.exec_driver_sql('PRAGMA journal_mode').scalar(), 'delete')
+                self.assertEqual(conn.exec_driver_sql('PRAGMA busy_timeout').scalar(), 250)
+            db.engine.dispose()
+
+    def test_identity_claims(self):
+        self.register_user('caregiver1', 'pass', 'caregiver')
+        caregiver = self.login_user('caregiver1', 'pass').json
+        caregiver_headers = {'Authorization': f'Bearer {caregiver["access_token"]}'}
+        headers, patient_user_id = self.setup_patient()
+        with self.app.app_context():
+            patient = Patient.query.filter_by(user_id=patient_user_id).first()
+            claims = decode_token(headers['Authorization'].split()[1])
+            self.assertEqual((claims['role'], claims['patient_id']), ('patient', patient.id))
+            claims = decode_token(caregiver['access_token'])
+            self.assertEqual((claims['role'], claims['patient_id']), ('caregiver', None))
+
+        statements = []
+        with self.app.app_context():
+            def record(*args):
+                statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                self.assertEqual(self.client.get('/api/alerts', headers=headers).status_code, 200)
+                res = self.client.get(f'/api/patients/{patient_user_id}/history', headers=headers)
+                self.assertEqual(res.status_code, 200)
+                # A caregiver has no patient profile: no Patient lookup either
+                res = self.client.post('/api/wearable/imu', json={'x_axis': 0, 'y_axis': 0, 'z_axis': 9.8},
+                                       headers=caregiver_headers)
+                self.assertEqual(res.status_code, 404)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertFalse([s for s in statements if 'FROM user' in s or 'FROM patient' in s])
+
+        # Tokens issued before the claims existed still work
+        with self.app.app_context():
+            old_token = create_access_token(identity=str(caregiver['user_id']))
+        res = self.client.get('/api/patients', headers={'Authorization': f'Bearer {old_token}'})
+        self.assertEqual(res.status_code, 200)
+
+    def test_password_hashing_pool(self):
+        app = create_app({'PASSWORD_HASH_WORKERS': 1, 'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000'})
+        client = app.test_client()
+        res = client.post('/auth/register', json={'username': 'nurse', 'password': 'pass', 'user_type': 'caregiver'})
+        self.assertEqual(res.status_code, 201)
+        with app.app_context():
+            user = User.query.filter_by(username='nurse').first()
+            self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+
+        res = client.post('/auth/login', json={'username': 'nurse', 'password': 'pass'})
+        self.assertEqual(res.status_code, 200)
+        res = client.post('/auth/login', json={'username': 'nurse', 'password': 'wrong'})
+        self.assertEqual(res.status_code, 401)
+
+        # No free hashing slot: shed the request instead of queueing it
+        with mock.patch.object(password_hasher._slots, 'acquire', return_value=False):
+            res = client.post('/auth/login', json={'username': 'nurse', 'password': 'pass'})
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        password_hasher.shutdown()
+
+    def asgi_post(self, service, path, body, headers):
+        """Run one POST through an ASGI app, return (status, JSON body)."""
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': path,
+            'headers': [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        }
+        asyncio.run(service(scope, receive, send))
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    def test_async_ingest_service(self):
+        headers, patient_user_id = self.setup_patient()
+        service = IngestService(self.app)
+        json_headers = dict(headers, **{'Content-Type': 'application/json'})
+        try:
+            status, body = self.asgi_post(service, '/api/wearable/heart_rate', b'{"value": 150}', json_headers)
+            self.assertEqual((status, body), (201, {'message': 'Heart rate data processed'}))
+
+            now = datetime.now(timezone.utc).timestamp()
+            packed = b''.join(struct.pack('<q3f', int((now + i * 0.02) * 1000), 0.0, 0.0, 9.8) for i in range(50))
+            status, body = self.asgi_post(service, '/api/wearable/imu/batch', packed,
+                                          dict(headers, **{'Content-Type': 'application/vnd.wristlet.imu'}))
+            self.assertEqual((status, body['count']), (201, 50))
+
+            # Same validation and auth errors as the Flask endpoints
+            status, body = self.asgi_post(service, '/api/wearable/fall', b'{}', json_headers)
+            self.assertEqual((status, body), (400, {'message': 'Probability required'}))
+            status, body = self.asgi_post(service, '/api/wearable/imu', b'{}', {'Content-Type': 'application/json'})
+            self.assertEqual((status, body), (401, {'msg': 'Missing Authorization Header'}))
+            service.max_body = 10
+            status, _ = self.asgi_post(service, '/api/wearable/heart_rate', b'{"value": 150.0000}', json_headers)
+            self.assertEqual(status, 413)
+        finally:
+            asyncio.run(service.close())
+
+        with self.app.app_context():
+            self.assertEqual(HeartRate.query.filter_by(user_id=patient_user_id).count(), 1)
+            self.assertEqual(IMUData.query.filter_by(user_id=patient_user_id).count(), 50)
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id, type='HR_HIGH').count(), 1)
+            self.assertTrue(SensorRollup.query.filter_by(user_id=patient_user_id, metric='imu_magnitude').count())
+        # The alert committed by the async session reached the dedup cache
+        self.assertTrue(alert_state_cache.has_open(patient_user_id, 'HR_HIGH'))
+
+    def test_imu_batch_inactivity(self):
+        headers, patient_user_id = self.setup_patient()
+        with self.app.app_context():
+            Patient.query.filter_by(user_id=patient_user_id).update({'inactivity_limit_minutes': 1})
+            db.session.commit()
+
+        now = datetime.now(timezone.utc)
+        samples = [
+            {'x_axis': 0.0, 'y_axis': 0.0, 'z_axis': 9.8,
+             'timestamp': (now - timedelta(seconds=90 - 10 * i)).isoformat()}
+            for i in range(10)
+        ]
+        res = self.client.post('/api/wearable/imu/batch', json={'samples': samples}, headers=headers)
+        self.assertEqual(res.status_code, 201)
+
+        with self.app.app_context():
+            alerts = Alert.query.filter_by(user_id=patient_user_id, type='INACTIVITY').all()
+            self.assertEqual(len(alerts), 1)
+
+    def test_inactivity_tracker(self):
+        headers, patient_user_id = self.setup_patient()
+        with self.app.app_context():
+            Patient.query.filter_by(user_id=patient_user_id).update({'inactivity_limit_minutes': 1})
+            db.session.commit()
+
+        # A movement half way through the window restarts the still period
+        now = datetime.now(timezone.utc)
+        samples = [
+            {'x_axis': 5.0 if i == 5 else 0.0, 'y_axis': 0.0, 'z_axis': 9.8,
+             'timestamp': (now - timedelta(seconds=90 - 10 * i)).isoformat()}
+            for i in range(10)
+        ]
+        res = self.client.post('/api/wearable/imu/batch', json={'samples': samples}, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(Alert.query.filter_by(type='INACTIVITY').count(), 0)
+
+        # The still period is rebuilt from stored rows on startup
+        _, other_user_id = self.setup_patient('patient2')
+        with self.app.app_context():
+            Patient.query.filter_by(user_id=other_user_id).update({'inactivity_limit_minutes': 1})
+            for i in range(9):
+                db.session.add(IMUData(user_id=other_user_id, x_axis=0.0, y_axis=0.0, z_axis=9.8,
+                                       timestamp=now - timedelta(seconds=80 - 10 * i)))
+            db.session.commit()
+        create_app()
+        with self.app.app_context():
+            patient = Patient.query.filter_by(user_id=other_user_id).first()
+            self.assertTrue(inactivity_tracker.is_inactive(patient, now + timedelta(seconds=15)))
+
+    def query_plan(self, query):
+        compiled = query.statement.compile(db.engine)
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).all()
+        return ' | '.join(row[-1] for row in rows)
+
+    def test_hot_queries_use_indexes(self):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self.app.app_context():
+            # should_create_alert
+            plan = self.query_plan(Alert.query.filter_by(user_id=1, type='HR_HIGH', is_resolved=False).limit(1))
+            self.assertIn('ix_alert_user_id_type_is_resolved', plan)
+            plan = self.query_plan(
+                Alert.query.filter(Alert.user_id == 1, Alert.type == 'HR_HIGH').order_by(Alert.timestamp.desc()).limit(1)
+            )
+            self.assertIn('ix_alert_user_id_type_timestamp', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+            # Inactivity window replay
+            plan = self.query_plan(
+                IMUData.query.filter(IMUData.user_id == 1, IMUData.timestamp >= now).order_by(IMUData.timestamp)
+            )
+            self.assertIn('ix_imu_data_user_id_timestamp', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+            # get_alerts, patient and caregiver views
+            plan = self.query_plan(
+                Alert.query.filter_by(user_id=1).order_by(Alert.timestamp.desc(), Alert.id.desc()).limit(100)
+            )
+            self.assertIn('ix_alert_user_id_timestamp', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            plan = self.query_plan(Alert.query.order_by(Alert.timestamp.desc(), Alert.id.desc()).limit(100))
+            self.assertIn('ix_alert_timestamp', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+            # Wearable endpoints look the patient up by user id
+            plan = self.query_plan(Patient.query.filter_by(user_id=1))
+            self.assertIn('ix_patient_user_id', plan)
+
+    def test_schema_upgrade_migrates_existing_database(self):
+        with self.app.app_context():
+            db.session.execute(text('DROP INDEX ix_alert_user_id_type_is_resolved'))
+            db.session.execute(text('DROP INDEX ix_imu_data_user_id_timestamp'))
+            db.session.execute(text('DROP INDEX ix_alert_updated_at'))
+            db.session.execute(text('ALTER TABLE alert DROP COLUMN updated_at'))
+            db.session.commit()
+
+            ensure_columns()
+            ensure_indexes()
+
+            columns = [row[1] for row in db.session.execute(text('PRAGMA table_info(alert)'))]
+            self.assertIn('updated_at', columns)
+
+            names = set(db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'index'")
+            ).scalars())
+            self.assertIn('ix_alert_user_id_type_is_resolved', names)
+            self.assertIn('ix_imu_data_user_id_timestamp', names)
+
+    def test_alerts_feed_pagination(self):
+        self.register_user('caregiver1', 'pass', 'caregiver')
+        res = self.login_user('caregiver1', 'pass')
+        caregiver_headers = {'Authorization': f'Bearer {res.json["access_token"]}'}
+        _, patient_user_id = self.setup_patient()
+
+        now = datetime.now(timezone.utc)
+        with self.app.app_context():
+            for i in range(5):
+                db.session.add(Alert(user_id=patient_user_id, type='BUTTON', message=f'Alert {i}',
+                                     timestamp=now - timedelta(minutes=5 - i)))
+            db.session.commit()
+
+        # Keyset pages, newest first
+        res = self.client.get('/api/alerts?limit=2', headers=caregiver_headers)
+        self.assertEqual([a['message'] for a in res.json], ['Alert 4', 'Alert 3'])
+        cursor = res.headers['X-Next-Cursor']
+        res = self.client.get(f'/api/alerts?limit=2&cursor={cursor}', headers=caregiver_headers)
+        self.assertEqual([a['message'] for a in res.json], ['Alert 2', 'Alert 1'])
+        cursor = res.headers['X-Next-Cursor']
+        res = self.client.get(f'/api/alerts?limit=2&cursor={cursor}', headers=caregiver_headers)
+        self.assertEqual([a['message'] for a in res.json], ['Alert 0'])
+        self.assertNotIn('X-Next-Cursor', res.headers)
+
+        res = self.client.get('/api/alerts?cursor=garbage', headers=caregiver_headers)
+        self.assertEqual(res.status_code, 400)
+
+        # Unchanged feed answers 304
+        res = self.client.get('/api/alerts', headers=caregiver_headers)
+        etag = res.headers['ETag']
+        last_id = res.json[0]['id']
+        since = max(a['updated_at'] for a in res.json)
+        res = self.client.get('/api/alerts', headers={**caregiver_headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        # Resolving an alert changes the feed; since/after_id only return the delta
+        res = self.client.put(f'/api/alerts/{last_id}/resolve', headers=caregiver_headers)
+        res = self.client.get('/api/alerts', headers={**caregiver_headers, 'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        res = self.client.get(f'/api/alerts?since={since}', headers=caregiver_headers)
+        self.assertEqual([a['id'] for a in res.json], [last_id])
+        self.assertTrue(res.json[0]['is_resolved'])
+        res = self.client.get(f'/api/alerts?after_id={last_id}', headers=caregiver_headers)
+        self.assertEqual(res.json, [])
+
+    def test_alert_stream(self):
+        self.register_user('caregiver1', 'pass', 'caregiver')
+        res = self.login_user('caregiver1', 'pass')
+        caregiver_headers = {'Authorization': f'Bearer {res.json["access_token"]}'}
+        patient_headers, patient_user_id = self.setup_patient()
+
+        res = self.client.get('/api/alerts/stream', headers=caregiver_headers, buffered=False)
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        stream = (chunk.decode() for chunk in res.response)
+        self.assertTrue(next(stream).startswith('retry:'))
+
+        # Alerts are pushed once the creating request commits
+        self.client.post('/api/wearable/button', json={'panic_button_status': True}, headers=patient_headers)
+        message = next(stream)
+        self.assertIn('event: alert\n', message)
+        data = json.loads(message.split('data: ', 1)[1])
+        self.assertEqual(data['type'], 'BUTTON')
+        self.assertEqual(data['user_id'], patient_user_id)
+
+        self.client.put(f'/api/alerts/{data["id"]}/resolve', headers=caregiver_headers)
+        update = next(stream)
+        self.assertIn('event: alert_update\n', update)
+        self.assertTrue(json.loads(update.split('data: ', 1)[1])['is_resolved'])
+
+        # Event ids are a sequence of changes, not alert ids: they never go back
+        def event_id(message):
+            return int(message.split('id: ', 1)[1].split('\n', 1)[0])
+        self.assertGreater(event_id(update), event_id(message))
+
+        # Streams hold a server thread each, so they are capped per process
+        alert_hub.max_subscribers = 1
+        busy = self.client.get('/api/alerts/stream', headers=caregiver_headers)
+        self.assertEqual(busy.status_code, 503)
+        self.assertIn('Retry-After', busy.headers)
+        res.close()
+
+        # Reconnecting with Last-Event-ID replays what was missed, resolutions
+        # included, over as many pages as it takes
+        self.app.config['ALERTS_MAX_PAGE_SIZE'] = 1
+        self.client.post('/api/wearable/fall', json={'probability': 0.9}, headers=patient_headers)
+        with self.app.app_context():
+            fall_id = Alert.query.filter_by(type='FALL').one().id
+        self.client.put(f'/api/alerts/{fall_id}/resolve', headers=caregiver_headers)
+        res = self.client.get('/api/alerts/stream', buffered=False,
+                              headers={**caregiver_headers, 'Last-Event-ID': str(event_id(update))})
+        stream = (chunk.decode() for chunk in res.response)
+        next(stream)
+        created, resolved = next(stream), next(stream)
+        self.assertIn('event: alert\n', created)
+        self.assertIn('"type": "FALL"', created)
+        self.assertIn('event: alert_update\n', resolved)
+        self.assertEqual(json.loads(resolved.split('data: ', 1)[1])['id'], fall_id)
+        self.assertEqual(event_id(resolved), event_id(created) + 1)
+        res.close()
+
+    def test_alert_dedup_cache(self):
+        headers, patient_user_id = self.setup_patient()
+        now = datetime.now(timezone.utc)
+
+        def send_hr(value, offset):
+            return self.client.post('/api/wearable/heart_rate', headers=headers, json={
+                'value': value, 'timestamp': (now + offset).isoformat()
+            })
+
+        send_hr(150, timedelta(0))
+        send_hr(150, timedelta(seconds=10))
+        with self.app.app_context():
+            alerts = Alert.query.filter_by(user_id=patient_user_id, type='HR_HIGH').all()
+            self.assertEqual(len(alerts), 1)
+            alert_id = alerts[0].id
+            self.assertTrue(alert_state_cache.has_open(patient_user_id, 'HR_HIGH'))
+
+        # Resolving clears the open flag but the cooldown still applies
+        self.client.put(f'/api/alerts/{alert_id}/resolve', headers=headers)
+        self.assertFalse(alert_state_cache.has_open(patient_user_id, 'HR_HIGH'))
+        send_hr(150, timedelta(minutes=1))
+        send_hr(150, timedelta(minutes=4))
+        with self.app.app_context():
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id, type='HR_HIGH').count(), 2)
+
+        # The state is warm-loaded from the alert table on start-up
+        create_app()
+        self.assertTrue(alert_state_cache.has_open(patient_user_id, 'HR_HIGH'))
+        self.assertEqual(alert_state_cache.last_timestamp(patient_user_id, 'HR_HIGH'), now + timedelta(minutes=4))
+
+    def test_patient_threshold_cache(self):
+        self.register_user('caregiver1', 'pass', 'caregiver')
+        res = self.login_user('caregiver1', 'pass')
+        caregiver_headers = {'Authorization': f'Bearer {res.json["access_token"]}'}
+        headers, patient_user_id = self.setup_patient()
+
+        for _ in range(3):
+            self.client.post('/api/wearable/heart_rate', json={'value': 130}, headers=headers)
+        stats = patient_cache.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (1, 2))
+
+        # Updating thresholds invalidates the cached entry
+        self.client.put(f'/api/patients/{patient_user_id}/thresholds', json={'max_hr': 140},
+                        headers=caregiver_headers)
+        with self.app.app_context():
+            self.assertEqual(patient_cache.get(patient_user_id).max_hr, 140)
+        self.assertEqual(patient_cache.stats()['misses'], 2)
+
+    def test_patients_summary_single_query(self):
+        self.register_user('caregiver1', 'pass', 'caregiver')
+        res = self.login_user('caregiver1', 'pass')
+        caregiver_headers = {'Authorization': f'Bearer {res.json["access_token"]}'}
+        headers, patient_user_id = self.setup_patient('alice')
+        self.setup_patient('bob')
+        self.setup_patient('alfred')
+
+        now = datetime.now(timezone.utc)
+        self.client.post('/api/wearable/heart_rate', headers=headers,
+                         json={'value': 150, 'timestamp': (now - timedelta(seconds=5)).isoformat()})
+        self.client.post('/api/wearable/heart_rate', headers=headers,
+                         json={'value': 72, 'timestamp': now.isoformat()})
+        self.client.post('/api/wearable/imu', headers=headers,
+                         json={'x_axis': 0.0, 'y_axis': 0.0, 'z_axis': 9.8, 'timestamp': now.isoformat()})
+
+        statements = []
+        with self.app.app_context():
+            def count(*args):
+                statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', count)
+            try:
+                res = self.client.get('/api/patients', headers=caregiver_headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', count)
+        # Only the patient list: the caller's role comes from the access token
+        self.assertEqual(len(statements), 1)
+
+        alice = next(p for p in res.json if p['username'] == 'alice')
+        self.assertEqual(alice['latest_hr'], 72)
+        self.assertEqual(alice['open_alert_count'], 1)
+        self.assertIsNotNone(alice['last_imu_at'])
+
+        res = self.client.get('/api/patients?search=AL&limit=1', headers=caregiver_headers)
+        self.assertEqual([p['username'] for p in res.json], ['alice'])
+        res = self.client.get(f'/api/patients?search=AL&limit=1&cursor={res.headers["X-Next-Cursor"]}',
+                              headers=caregiver_headers)
+        self.assertEqual([p['username'] for p in res.json], ['alfred'])
+        self.assertNotIn('X-Next-Cursor', res.headers)
+
+    def test_ingest_queue_group_commit(self):
+        app = create_app({
+            'INGEST_QUEUE_ENABLED': True,
+            'INGEST_QUEUE_BATCH_SIZE': 1000,
+            'INGEST_QUEUE_FLUSH_INTERVAL': 60,
+        })
+        client = app.test_client()
+        try:
+            headers, patient_user_id = self.setup_patient()
+            for value in (70, 71, 150):
+                res = client.post('/api/wearable/heart_rate', json={'value': value}, headers=headers)
+                self.assertEqual(res.status_code, 201)
+            res = client.post('/api/wearable/imu/batch', headers=headers, json={
+                'x_axis': [0.0, 0.1], 'y_axis': [0.0, 0.0], 'z_axis': [9.8, 9.8],
+            })
+            self.assertEqual(res.status_code, 201)
+
+            with app.app_context():
+                # Samples wait for the group commit, alerts do not
+                self.assertEqual(HeartRate.query.count(), 0)
+                self.assertEqual(Alert.query.filter_by(type='HR_HIGH').count(), 1)
+
+            # A full queue pushes back instead of dropping samples
+            with mock.patch.object(ingest_queue, 'put', return_value=False):
+                res = client.post('/api/wearable/heart_rate', json={'value': 70}, headers=headers)
+            self.assertEqual(res.status_code, 503)
+            self.assertIn('Retry-After', res.headers)
+        finally:
+            ingest_queue.stop()
+
+        # Stopping drains everything that was accepted
+        with app.app_context():
+            self.assertEqual(HeartRate.query.filter_by(user_id=patient_user_id).count(), 3)
+            self.assertEqual(IMUData.query.filter_by(user_id=patient_user_id).count(), 2)
+
+    def test_ingest_queue_retries_and_row_bound(self):
+        app = create_app({
+            'INGEST_QUEUE_ENABLED': True,
+            'INGEST_QUEUE_MAX_ROWS': 4,
+            'INGEST_QUEUE_BATCH_SIZE': 3,
+            'INGEST_QUEUE_FLUSH_INTERVAL': 60,
+            'INGEST_QUEUE_RETRIES': 2,
+            'INGEST_QUEUE_RETRY_BACKOFF': 0.01,
+        })
+        headers, patient_user_id = self.setup_patient()
+        now = datetime.now(timezone.utc)
+
+        def rows(*values):
+            return [{'user_id': patient_user_id, 'timestamp': now, 'value': value} for value in values]
+
+        commit = IngestQueue._commit
+        unblock = threading.Event()
+        failures = iter([True])
+
+        def flaky_commit(items):
+            # The first group commit waits for the test, then fails once
+            if next(failures, False):
+                unblock.wait(5)
+                raise OperationalError('INSERT', {}, Exception('database is locked'))
+            commit(items)
+
+        try:
+            with mock.patch.object(IngestQueue, '_commit', side_effect=flaky_commit):
+                self.assertTrue(ingest_queue.put(HeartRate, rows(70, 71, 72)))
+                # Bounded by rows being written, whatever the number of requests
+                self.assertFalse(ingest_queue.put(HeartRate, rows(73, 74)))
+                self.assertEqual(ingest_queue.depth(), 3)
+                unblock.set()
+                ingest_queue.drain()
+            self.assertEqual(ingest_queue.depth(), 0)
+            self.assertEqual(ingest_queue.failed_rows, 0)
+
+            # A batch the database rejects (value is NOT NULL) does not take the other one down
+            self.assertTrue(ingest_queue.put(HeartRate, rows(None)))
+            self.assertTrue(ingest_queue.put(HeartRate, rows(75)))
+        finally:
+            ingest_queue.stop()
+
+        self.assertEqual(ingest_queue.failed_rows, 1)
+        with app.app_context():
+            values = [row.value for row in HeartRate.query.filter_by(user_id=patient_user_id)]
+            self.assertEqual(sorted(values), [70, 71, 72, 75])
+
+    def test_history_rollups(self):
+        self.register_user('caregiver1', 'pass', 'caregiver')
+        res = self.login_user('caregiver1', 'pass')
+        caregiver_headers = {'Authorization': f'Bearer {res.json["access_token"]}'}
+        headers, patient_user_id = self.setup_patient()
+
+        base = datetime(2026, 1, 1, 8, 0, tzinfo=timezone.utc)
+        for minute, values in ((0, (60, 80)), (1, (100,)), (90, (70,))):
+            for second, value in enumerate(values):
+                ts = base + timedelta(minutes=minute, seconds=second)
+                self.client.post('/api/wearable/heart_rate', headers=headers,
+                                 json={'value': value, 'timestamp': ts.isoformat()})
+        self.client.post('/api/wearable/imu/batch', headers=headers, json={
+            'timestamp': [base.isoformat(), (base + timedelta(seconds=1)).isoformat()],
+            'x_axis': [3.0, 0.0], 'y_axis': [4.0, 0.0], 'z_axis': [0.0, 10.0],
+        })
+
+        url = f'/api/patients/{patient_user_id}/history'
+        # Short range: minute buckets
+        res = self.client.get(url, headers=caregiver_headers, query_string={
+            'start': base.isoformat(), 'end': (base + timedelta(hours=2)).isoformat(),
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json['resolution_seconds'], 60)
+        points = res.json['points']
+        self.assertEqual([p['count'] for p in points], [2, 1, 1])
+        self.assertEqual((points[0]['min'], points[0]['max'], points[0]['mean']), (60, 80, 70))
+
+        # Long range: hour buckets
+        res = self.client.get(url, headers=caregiver_headers, query_string={
+            'start': (base - timedelta(days=2)).isoformat(), 'end': (base + timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(res.json['resolution_seconds'], 3600)
+        self.assertEqual([p['count'] for p in res.json['points']], [3, 1])
+
+        # Very long range: hour buckets merged to stay under HISTORY_MAX_POINTS
+        res = self.client.get(url, headers=caregiver_headers, query_string={
+            'start': (base - timedelta(days=365)).isoformat(), 'end': (base + timedelta(days=1)).isoformat(),
+        })
+        self.assertGreater(res.json['resolution_seconds'], 3600)
+        self.assertEqual(sum(p['count'] for p in res.json['points']), 4)
+
+        res = self.client.get(url, headers=caregiver_headers, query_string={
+            'metric': 'imu_magnitude', 'start': base.isoformat(), 'end': (base + timedelta(hours=1)).isoformat(),
+        })
+        self.assertEqual(res.json['points'][0]['mean'], 7.5)
+
+        # Patients only see their own history
+        _, other_user_id = self.setup_patient('patient2')
+        res = self.client.get(f'/api/patients/{other_user_id}/history', headers=headers)
+        self.assertEqual(res.status_code, 403)
+
+    def test_history_unaligned_range(self):
+        headers, patient_user_id = self.setup_patient()
+        base = datetime(2026, 1, 1, 8, 0, tzinfo=timezone.utc)
+        for minute in range(5):
+            self.client.post('/api/wearable/heart_rate', headers=headers, json={
+                'value': 70 + minute, 'timestamp': (base + timedelta(minutes=minute, seconds=40)).isoformat(),
+            })
+
+        # 4 minutes long, but starting mid-minute it touches 5 minute buckets
+        self.app.config['HISTORY_MAX_POINTS'] = 4
+        res = self.client.get(f'/api/patients/{patient_user_id}/history', headers=headers, query_string={
+            'start': (base + timedelta(seconds=30)).isoformat(),
+            'end': (base + timedelta(minutes=4, seconds=30)).isoformat(),
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(res.json['points']), 4)
+        self.assertEqual(res.json['resolution_seconds'], 3600)
+        self.assertEqual(sum(p['count'] for p in res.json['points']), 5)
+
+        # Merged buckets are aligned too: 9 hours from 08:30 touch 10 hours
+        self.app.config['HISTORY_MAX_POINTS'] = 9
+        res = self.client.get(f'/api/patients/{patient_user_id}/history', headers=headers, query_string={
+            'start': (base + timedelta(minutes=30)).isoformat(),
+            'end': (base + timedelta(hours=9, minutes=30)).isoformat(),
+        })
+        self.assertEqual(res.json['resolution_seconds'], 7200)
+
+    def test_backfill_rollups_command(self):
+        headers, patient_user_id = self.setup_patient()
+        base = datetime(2026, 1, 1, 8, 0, tzinfo=timezone.utc)
+
+        # Rows stored before rollups existed, then one ingested normally into the same minute
+        with self.app.app_context():
+            for i in range(5):
+                db.session.add(HeartRate(user_id=patient_user_id, value=60 + i,
+                                         timestamp=base + timedelta(minutes=i // 2, seconds=i)))
+            db.session.add(IMUData(user_id=patient_user_id, x_axis=0.0, y_axis=6.0, z_axis=8.0, timestamp=base))
+            db.session.commit()
+        self.client.post('/api/wearable/heart_rate', headers=headers, json={
+            'value': 90, 'timestamp': (base + timedelta(minutes=2, seconds=30)).isoformat(),
+        })
+        url = f'/api/patients/{patient_user_id}/history'
+        query = {'start': base.isoformat(), 'end': (base + timedelta(hours=1)).isoformat()}
+        self.assertEqual([p['count'] for p in self.client.get(url, headers=headers, query_string=query).json['points']], [1])
+
+        runner = self.app.test_cli_runner()
+        for _ in range(2):
+            # Chunks smaller than a minute's rows; a second run folds nothing more
+            result = runner.invoke(args=['backfill-rollups', '--chunk-size', '1'])
+            self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Folded 0 heart rate and 0 IMU rows', result.output)
+
+        points = self.client.get(url, headers=headers, query_string=query).json['points']
+        # Minute 2 had a rollup already (the ingested row): its legacy row is left out
+        self.assertEqual([p['count'] for p in points], [2, 2, 1])
+        res = self.client.get(url, headers=headers, query_string={**query, 'metric': 'imu_magnitude'})
+        self.assertEqual(res.json['points'][0]['mean'], 10.0)
+
+    def test_retention_prunes_and_folds(self):
+        headers, patient_user_id = self.setup_patient()
+        now = datetime.now(timezone.utc)
+        old = now - timedelta(days=40)
+
+        # Rows stored before rollups existed, and rows ingested normally
+        with self.app.app_context():
+            for i in range(3):
+                db.session.add(HeartRate(user_id=patient_user_id, value=60 + i,
+                                         timestamp=old + timedelta(minutes=10, seconds=i)))
+            db.session.commit()
+        for ts, value in ((old, 90), (now, 80)):
+            self.client.post('/api/wearable/heart_rate', headers=headers,
+                             json={'value': value, 'timestamp': ts.isoformat()})
+        self.client.post('/api/wearable/imu', headers=headers,
+                         json={'x_axis': 0.0, 'y_axis': 0.0, 'z_axis': 9.8, 'timestamp': old.isoformat()})
+
+        self.app.config['RETENTION_CHUNK_SIZE'] = 2
+        self.app.config['RETENTION_CHUNK_PAUSE'] = 0
+        result = self.app.test_cli_runner().invoke(args=['prune-sensor-data', '--days', '30'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Deleted 4 heart rate and 1 IMU rows', result.output)
+
+        with self.app.app_context():
+            self.assertEqual(HeartRate.query.count(), 1)
+            self.assertEqual(IMUData.query.count(), 0)
+            hour_buckets = SensorRollup.query.filter_by(
+                user_id=patient_user_id, metric='heart_rate', bucket_seconds=3600
+            ).all()
+            # Legacy rows were folded in once, ingested rows were not counted twice
+            self.assertEqual(sum(b.count for b in hour_buckets), 5)
+            self.assertEqual(sum(b.value_sum for b in hour_buckets), 60 + 61 + 62 + 90 + 80)
+
+    def test_benchmark_report_comparison(self):
+        baseline = {'endpoints': {'POST /api/wearable/imu': {'p99_ms': 10.0, 'rps': 100.0}}}
+        report = {'endpoints': {'POST /api/wearable/imu': {'p99_ms': 12.0, 'rps': 90.0}}}
+        self.assertEqual(benchmark.compare(report, baseline, 0.25), [])
+        report['endpoints']['POST /api/wearable/imu'] = {'p99_ms': 20.0, 'rps': 50.0}
+        self.assertEqual(len(benchmark.compare(report, baseline, 0.25)), 2)
+        self.assertEqual(benchmark.percentile([1, 2, 3, 4], 0.5), 2)
+
+    def test_metrics_endpoint(self):
+        # Disabled by default: no route and no hooks
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertFalse(metrics.enabled)
+
+        # No token configured: hooks run, but the endpoint is not served
+        app = create_app({'METRICS_ENABLED': True})
+        self.assertTrue(metrics.enabled)
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+
+        app = create_app({'METRICS_ENABLED': True, 'METRICS_TOKEN': 'scrape-secret'})
+        client = app.test_client()
+        headers, patient_user_id = self.setup_patient()
+        for value in (70, 71):
+            client.post('/api/wearable/heart_rate', json={'value': value}, headers=headers)
+        client.post('/api/wearable/imu/batch', headers=headers, json={
+            'x_axis': [0.0, 0.1, 0.2], 'y_axis': [0.0, 0.0, 0.0], 'z_axis': [9.8, 9.8, 9.8],
+        })
+
+        self.assertEqual(client.get('/metrics').status_code, 401)
+        self.assertEqual(client.get('/metrics', headers=headers).status_code, 401)
+        res = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(res.status_code, 200)
+        body = res.get_data(as_text=True)
+        self.assertIn(
+            'http_requests_total{method="POST",endpoint="/api/wearable/heart_rate",status="201"} 2', body
+        )
+        self.assertIn(
+            'http_request_duration_seconds_count{method="POST",endpoint="/api/wearable/heart_rate"} 2', body
+        )
+        # Aggregated over patients: no user ids, bounded cardinality
+        self.assertIn('ingest_samples_total{kind="heart_rate"} 2', body)
+        self.assertIn('ingest_samples_total{kind="imu_data"} 3', body)
+        self.assertNotIn('user_id', body)
+        self.assertIn('patient_cache_hits_total', body)
+
+        statements = [
+            line for line in body.splitlines()
+            if line.startswith('http_db_statements_total{method="POST",endpoint="/api/wearable/heart_rate"}')
+        ]
+        self.assertEqual(len(statements), 1)
+        self.assertGreater(int(statements[0].rsplit(' ', 1)[1]), 0)
+
+    def test_structured_async_logging(self):
+        class Capture(logging.Handler):
+            def __init__(self):
+                super().__init__()
+                self.lines = []
+
+            def emit(self, record):
+                self.lines.append(json.loads(self.format(record)))
+
+        app = create_app({'LOG_INGEST_SAMPLE_EVERY': 2})
+        capture = Capture()
+        async_logging.init_app(app, handler=capture)
+        client = app.test_client()
+        try:
+            with mock.patch('builtins.print') as fake_print:
+                client.post('/auth/register', json={'username': 'p1', 'password': 'secret', 'user_type': 'patient'})
+                res = client.post('/auth/login', json={'username': 'p1', 'password': 'secret'})
+                headers = {'Authorization': f"Bearer {res.get_json()['access_token']}"}
+                client.post('/auth/login', json={'username': 'p1', 'password': 'wrong'})
+                for value in (70, 71, 72, 73, 74):
+                    client.post('/api/wearable/heart_rate', json={'value': value}, headers=headers)
+            fake_print.assert_not_called()
+        finally:
+            async_logging.stop()
+
+        events = [line['event'] for line in capture.lines]
+        self.assertIn('user_registered', events)
+        self.assertIn('login_succeeded', events)
+        failed = next(line for line in capture.lines if line['event'] == 'login_failed')
+        self.assertEqual(failed['level'], 'WARNING')
+        self.assertEqual(failed['username'], 'p1')
+        # Payloads (and so passwords) are never logged
+        self.assertNotIn('secret', json.dumps(capture.lines))
+        # One in two ingest events is kept
+        self.assertEqual(events.count('samples_stored'), 3)
+
+    def test_logged_exception_keeps_traceback(self):
+        class Capture(logging.Handler):
+            def __init__(self):
+                super().__init__()
+                self.lines = []
+
+            def emit(self, record):
+                self.lines.append(json.loads(self.format(record)))
+
+        capture = Capture()
+        async_logging.init_app(self.app, handler=capture)
+        try:
+            try:
+                raise RuntimeError('disk full')
+            except RuntimeError:
+                get_logger('ingest').error('group_commit_failed', exc_info=True, extra={'fields': {'rows': 3}})
+        finally:
+            async_logging.stop()
+
+        line = capture.lines[-1]
+        self.assertEqual(line['event'], 'group_commit_failed')
+        self.assertEqual(line['rows'], 3)
+        self.assertIn('RuntimeError: disk full', line['exc'])
+
+    def test_backfill_import(self):
+        headers, patient_user_id = self.setup_patient()
+        self.app.config['BACKFILL_CHUNK_SIZE'] = 50
+        start = datetime(2024, 5, 1, 8, 0, tzinfo=timezone.utc)
+
+        # 40 still minutes of IMU every 10 s, heart rate every minute with one spike
+        lines = ['timestamp,value,x_axis,y_axis,z_axis,gx,gy,gz']
+        for i in range(240):
+            ts = start + timedelta(seconds=10 * i)
+            lines.append(f'{ts.replace(tzinfo=None).isoformat()},,0.0,0.1,9.8,,,')
+            if i % 6 == 0:
+                value = 150 if i == 30 else 70
+                lines.append(f'{ts.timestamp()},{value},,,,,,')
+        res = self.client.post('/api/wearable/backfill', data='\n'.join(lines),
+                               headers={**headers, 'Content-Type': 'text/csv'})
+        self.assertEqual(res.status_code, 201, res.json)
+        self.assertEqual((res.json['heart_rate'], res.json['imu_data']), (40, 240))
+        self.assertEqual(sorted(res.json['alerts']), ['HR_HIGH', 'INACTIVITY'])
+
+        with self.app.app_context():
+            self.assertEqual(IMUData.query.filter_by(user_id=patient_user_id).count(), 240)
+            alerts = {a.type: a for a in Alert.query.filter_by(user_id=patient_user_id)}
+            self.assertEqual(alerts['HR_HIGH'].message, 'Heart rate high: 150.0')
+            self.assertEqual(alerts['HR_HIGH'].timestamp.replace(tzinfo=timezone.utc), start + timedelta(minutes=5))
+            self.assertEqual(alerts['INACTIVITY'].timestamp.replace(tzinfo=timezone.utc), start + timedelta(minutes=30))
+            buckets = SensorRollup.query.filter_by(user_id=patient_user_id, metric='heart_rate', bucket_seconds=60).all()
+            self.assertEqual(sum(b.count for b in buckets), 40)
+
+        # The alerts are still open: a later recording raises no duplicates.
+        # A malformed line stops the import, the rows before it are kept.
+        later = start + timedelta(hours=1)
+        path = os.path.join(tempfile.mkdtemp(), 'recording.ndjson')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'timestamp': later.isoformat(), 'value': 160}) + '\n')
+            f.write(json.dumps({'timestamp': later.isoformat(), 'x_axis': 0, 'y_axis': 0}) + '\n')
+            f.write(json.dumps({'timestamp': later.isoformat(), 'value': 70}) + '\n')
+        result = self.app.test_cli_runner().invoke(
+            args=['import-recording', '--user-id', str(patient_user_id), path])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('Imported 1 heart rate and 0 IMU rows, alerts: none', result.output)
+        self.assertIn('line 2', result.output)
+        with self.app.app_context():
+            self.assertEqual(HeartRate.query.filter_by(user_id=patient_user_id).count(), 41)
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id).count(), 2)
+
+        res = self.client.post('/api/wearable/backfill', data='{}', headers={**headers, 'Content-Type': 'application/json'})
+        self.assertEqual(res.status_code, 415)
+
+        # Numeric timestamps out of range are a line error too
+        for timestamp in ('1e20', 'NaN'):
+            res = self.client.post('/api/wearable/backfill', data=f'{{"timestamp": {timestamp}, "value": 70}}',
+                                   headers={**headers, 'Content-Type': 'application/x-ndjson'})
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json['message'], 'line 1: timestamp must be ISO 8601 or epoch seconds')
+
+    def test_backfill_with_stream_owner(self):
+        headers, patient_user_id = self.setup_patient()
+        path = os.path.join(tempfile.mkdtemp(), 'shared.db')
+        backend = SQLiteBackend(path)
+        backend.set_value(CURSOR, json.dumps({'heart_rate': 0, 'imu_data': 0}))
+        backend.close()
+        app = create_app({'SHARED_STATE_URL': f'sqlite:///{path}', 'STREAM_OWNER_POLL_INTERVAL': 0.01,
+                          'BACKFILL_CHUNK_SIZE': 50})
+        client = app.test_client()
+        start = datetime(2024, 5, 1, 8, 0, tzinfo=timezone.utc)
+        lines = ['timestamp,value'] + [f'{(start + timedelta(seconds=i)).timestamp()},{150 if i == 120 else 70}'
+                                       for i in range(1000)]
+        try:
+            res = client.post('/api/wearable/backfill', data='\n'.join(lines),
+                              headers={**headers, 'Content-Type': 'text/csv'})
+            self.assertEqual(res.status_code, 201, res.json)
+            # The stream owner raises the rule alerts, the import none of its own
+            self.assertEqual(res.json['alerts'], [])
+            for _ in range(100):
+                if shared_state.get_value(CURSOR)['heart_rate'] == 1000:
+                    break
+                threading.Event().wait(0.05)
+        finally:
+            stream_owner.stop()
+            shared_state.stop()
+        with app.app_context():
+            alerts = Alert.query.filter_by(user_id=patient_user_id).all()
+            self.assertEqual([(a.type, a.message) for a in alerts], [('HR_HIGH', 'Heart rate high: 150.0')])
+
+    def test_alert_rule_engine(self):
+        self.register_user('caregiver1', 'pass', 'caregiver')
+        caregiver_headers = {'Authorization': f"Bearer {self.login_user('caregiver1', 'pass').json['access_token']}"}
+        headers, patient_user_id = self.setup_patient()
+
+        res = self.client.put(f'/api/patients/{patient_user_id}/thresholds', headers=caregiver_headers,
+                              json={'alert_rules': [{'type': 'X', 'metric': 'heart_rate', 'above': 'weight'}]})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('rule 0', res.json['message'])
+        # Values are floats, so an integer format is rejected up front...
+        res = self.client.put(f'/api/patients/{patient_user_id}/thresholds', headers=caregiver_headers,
+                              json={'alert_rules': [{'type': 'X', 'metric': 'heart_rate', 'above': 100,
+                                                     'message': 'hr {value:d}'}]})
+        self.assertEqual(res.status_code, 400)
+        # ...and one stored before that falls back to the default message
+        rule = ThresholdRule({'type': 'X', 'metric': 'heart_rate', 'above': 100, 'message': 'hr {value:d}'}, 'above')
+        self.assertEqual(rule.format_message(120.0), 'X: 120.0')
+        rules = [
+            {'type': 'TACHYCARDIA', 'metric': 'heart_rate', 'above': 100, 'for_seconds': 60},
+            {'type': 'HR_JUMP', 'metric': 'heart_rate', 'rise': 30, 'within_seconds': 20,
+             'message': 'Heart rate jumped to {value}'},
+        ]
+        res = self.client.put(f'/api/patients/{patient_user_id}/thresholds', headers=caregiver_headers,
+                              json={'alert_rules': rules})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json['patient']['alert_rules'], rules)
+
+        now = datetime.now(timezone.utc)
+        statements = []
+        with self.app.app_context():
+            def record(*args):
+                statements.append(args[2])
+            for offset, value in ((0, 105), (30, 108), (50, 95), (55, 104), (90, 110), (120, 112)):
+                if offset == 30:
+                    event.listen(db.engine, 'before_cursor_execute', record)
+                self.client.post('/api/wearable/heart_rate', headers=headers, json={
+                    'value': value, 'timestamp': (now + timedelta(seconds=offset)).isoformat()})
+            event.remove(db.engine, 'before_cursor_execute', record)
+        # Rules are evaluated from memory: no reads per sample
+        self.assertFalse([s for s in statements if s.lstrip().upper().startswith('SELECT')])
+
+        with self.app.app_context():
+            alerts = Alert.query.filter_by(user_id=patient_user_id).all()
+            # The run above 100 restarted at 55 s: a minute later, at 120 s
+            self.assertEqual([(a.type, a.timestamp.replace(tzinfo=timezone.utc)) for a in alerts],
+                             [('TACHYCARDIA', now + timedelta(seconds=120))])
+
+        # One batch: a rise of 30 within 20 s, the global HR_HIGH rule still applies
+        body = b''.join(struct.pack('<qf', int((now.timestamp() + 200 + i * 5) * 1000), value)
+                        for i, value in enumerate((70, 80, 102, 130)))
+        self.client.post('/api/wearable/heart_rate', data=body,
+                         headers={**headers, 'Content-Type': 'application/vnd.wristlet.hr'})
+        with self.app.app_context():
+            jump = Alert.query.filter_by(user_id=patient_user_id, type='HR_JUMP').one()
+            self.assertEqual(jump.message, 'Heart rate jumped to 102.0')
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id, type='HR_HIGH').count(), 1)
+
+        # Global rules from ALERT_RULES_FILE replace the defaults
+        path = os.path.join(tempfile.mkdtemp(), 'rules.json')
+        with open(path, 'w') as f:
+            json.dump([{'type': 'IMPACT', 'metric': 'imu_magnitude', 'above': 30, 'cooldown_seconds': 0}], f)
+        app = create_app({'ALERT_RULES_FILE': path})
+        client = app.test_client()
+        client.post('/api/wearable/heart_rate', headers=headers, json={'value': 20})
+        client.post('/api/wearable/imu', headers=headers, json={'x_axis': 0, 'y_axis': 0, 'z_axis': 40})
+        with app.app_context():
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id, type='IMPACT').count(), 1)
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id, type='HR_LOW').count(), 0)
+
+    def test_hr_baseline_anomaly(self):
+        headers, patient_user_id = self.setup_patient()
+        app = create_app({'HR_BASELINE_MIN_SAMPLES': 20, 'HR_ANOMALY_SECONDS': 60, 'HR_BASELINE_SNAPSHOT_SECONDS': 0})
+        client = app.test_client()
+        start = datetime(2024, 5, 1, 10, 0, tzinfo=timezone.utc)
+
+        def send(first, values):
+            body = b''.join(struct.pack('<qf', int((start.timestamp() + first + i) * 1000), value)
+                            for i, value in enumerate(values))
+            return client.post('/api/wearable/heart_rate', data=body,
+                               headers={**headers, 'Content-Type': 'application/vnd.wristlet.hr'})
+
+        # Two minutes around 70 bpm, then 112 bpm: within max_hr, but far off the baseline
+        self.assertEqual(send(0, [70 + (i % 5) - 2 for i in range(120)]).status_code, 201)
+        samples, mean, std = hr_baseline.baseline(patient_user_id, hour=10)
+        self.assertEqual(samples, 120)
+        self.assertAlmostEqual(mean, 70, delta=1)
+        send(120, [112] * 30)
+        with app.app_context():
+            self.assertEqual(Alert.query.filter_by(user_id=patient_user_id).count(), 0)
+        send(150, [112] * 40)
+        with app.app_context():
+            alerts = Alert.query.filter_by(user_id=patient_user_id).all()
+            self.assertEqual([a.type for a in alerts], ['HR_ANOMALY'])
+            # The deviation started at 120 s and lasted a minute
+            self.assertEqual(alerts[0].timestamp.replace(tzinfo=timezone.utc), start + timedelta(seconds=180))
+            # Outlying samples barely move the baseline
+            self.assertRegex(alerts[0].message, r'^Heart rate 112 deviates from baseline 7\d \(z=\+\d+\.\d\)$')
+
+        # Snapshots let a restart resume where it stopped
+        with app.app_context():
+            self.assertEqual(hr_baseline.snapshot(), 1)
+        before = hr_baseline.baseline(patient_user_id)
+        create_app({'HR_BASELINE_SNAPSHOT_SECONDS': 0})
+        self.assertEqual(hr_baseline.baseline(patient_user_id), before)
+
+    def test_hr_baseline_single_owner(self):
+        headers, patient_user_id = self.setup_patient()
+        path = os.path.join(tempfile.mkdtemp(), 'shared.db')
+        # Another worker holds the stream owner lease, with no rows read yet
+        other = SQLiteBackend(path)
+        self.assertTrue(other.acquire_lease('stream-owner', 'other-worker', 0.5))
+        other.set_value(CURSOR, json.dumps({'heart_rate': 0, 'imu_data': 0}))
+        app = create_app({'SHARED_STATE_URL': f'sqlite:///{path}', 'STREAM_OWNER_POLL_INTERVAL': 0.05,
+                          'HR_BASELINE_SNAPSHOT_SECONDS': 0})
+        client = app.test_client()
+        # Nothing is loaded at start-up only for the owner to drop it
+        self.assertFalse(inactivity_tracker.is_tracked(patient_user_id))
+        self.assertEqual(len(hr_baseline), 0)
+        try:
+            body = b''.join(struct.pack('<qf', int((datetime.now(timezone.utc).timestamp() + i) * 1000), 70)
+                            for i in range(10))
+            res = client.post('/api/wearable/heart_rate', data=body,
+                              headers={**headers, 'Content-Type': 'application/vnd.wristlet.hr'})
+            self.assertEqual(res.status_code, 201)
+            # Not the owner: no baseline kept, none written over the owner's
+            self.assertIsNone(hr_baseline.baseline(patient_user_id))
+            with app.app_context():
+                self.assertEqual(hr_baseline.snapshot(), 0)
+
+            # Once the lease expires this worker takes over and folds in the stored samples
+            for _ in range(100):
+                if hr_baseline.baseline(patient_user_id):
+                    break
+                threading.Event().wait(0.05)
+            self.assertEqual(hr_baseline.baseline(patient_user_id)[0], 10)
+            self.assertFalse(other.acquire_lease('stream-owner', 'other-worker', 60))
+        finally:
+            stream_owner.stop()
+            shared_state.stop()
+            other.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,223 @@
+"""
+Wearable ingest logic shared by the Flask routes (routes.py) and the asyncio
+ingest service (asgi_ingest.py): payload parsing into HeartRate/IMUData
+column dicts, the alerting rules and the in-memory bookkeeping done for
+every stored batch. Nothing here touches the database session; callers
+store the rows and add the returned alerts in their own transaction. The
+stream detectors (sample_alerts) run in the request, or in the stream
+owner process when there are several (see stream_owner).
+"""
+import logging
+from datetime import datetime, timezone
+
+from models import Alert, HeartRate, IMUData
+from inactivity import inactivity_tracker
+from fall_detection import fall_detector
+from sensor_buffers import sensor_buffers
+from alert_cache import alert_state_cache
+from alert_rules import rule_engine, should_create_alert
+from hr_baseline import hr_baseline
+from metrics import metrics
+from app_logging import get_logger, log_event
+import packed_ingest
+
+ingest_log = get_logger('ingest')
+alert_log = get_logger('alerts')
+
+IMU_FIELDS = ('x_axis', 'y_axis', 'z_axis', 'gx', 'gy', 'gz')
+
+
+class IngestError(Exception):
+    """A rejected upload; `message` is returned to the device with `status`."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# --- Parsing ---
+
+def parse_timestamp(timestamp_str) -> datetime:
+    """
+    Parse an optional ISO timestamp sent by the device. Missing or malformed
+    values fall back to the current time; naive values are treated as UTC.
+    """
+    if timestamp_str:
+        try:
+            timestamp = datetime.fromisoformat(timestamp_str)
+        except (TypeError, ValueError):
+            return datetime.now(timezone.utc)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return timestamp
+    return datetime.now(timezone.utc)
+
+
+def check_batch_size(count: int, max_samples: int) -> None:
+    if not count:
+        raise IngestError('At least one sample required')
+    if count > max_samples:
+        raise IngestError(f'Too many samples (max {max_samples})', 413)
+
+
+def packed_rows(model, user_id: int, mimetype: str, body: bytes, max_samples: int) -> list:
+    """Decode a packed upload (see packed_ingest) for `model`."""
+    try:
+        if model is HeartRate:
+            rows = packed_ingest.decode_heart_rate(body, mimetype, user_id)
+        else:
+            rows = packed_ingest.decode_imu(body, mimetype, user_id)
+    except packed_ingest.PackedFormatError as e:
+        raise IngestError(str(e))
+    check_batch_size(len(rows), max_samples)
+    return rows
+
+
+def heart_rate_rows(user_id: int, data: dict) -> list:
+    value = data.get('value')
+    if value is None:
+        raise IngestError('Value required')
+    return [{'user_id': user_id, 'value': value, 'timestamp': parse_timestamp(data.get('timestamp'))}]
+
+
+def imu_rows(user_id: int, data: dict) -> list:
+    if data.get('x_axis') is None or data.get('y_axis') is None or data.get('z_axis') is None:
+        raise IngestError('Accelerometer data required')
+    row = {field: data.get(field) for field in IMU_FIELDS}
+    row.update(user_id=user_id, timestamp=parse_timestamp(data.get('timestamp')))
+    return [row]
+
+
+def _imu_samples_from_payload(data):
+    """
+    Normalize a batch payload into a list of per-sample dicts. Two layouts are
+    accepted:
+      row-wise:  {"samples": [{"x_axis": .., "timestamp": ..}, ...]}
+      columnar:  {"timestamp": [...], "x_axis": [...], "y_axis": [...], ...}
+    """
+    if 'samples' in data:
+        samples = data['samples']
+        if not isinstance(samples, list):
+            raise IngestError('samples must be a list')
+        return samples
+
+    length = len(data.get('x_axis') or [])
+    columns = {}
+    for key in IMU_FIELDS + ('timestamp',):
+        column = data.get(key)
+        if column is None:
+            continue
+        if not isinstance(column, list) or len(column) != length:
+            raise IngestError(f'{key} must be a list of {length} values')
+        columns[key] = column
+    return [{key: column[i] for key, column in columns.items()} for i in range(length)]
+
+
+def imu_batch_rows(user_id: int, data, max_samples: int) -> list:
+    """Rows of a JSON /api/wearable/imu/batch upload, in upload order."""
+    if not isinstance(data, dict):
+        raise IngestError('JSON object required')
+    samples = _imu_samples_from_payload(data)
+    check_batch_size(len(samples), max_samples)
+
+    rows = []
+    for i, sample in enumerate(samples):
+        if not isinstance(sample, dict) or any(sample.get(axis) is None for axis in ('x_axis', 'y_axis', 'z_axis')):
+            raise IngestError(f'Accelerometer data required (sample {i})')
+        rows.append({
+            'user_id': user_id,
+            'timestamp': parse_timestamp(sample.get('timestamp')),
+            'x_axis': sample['x_axis'],
+            'y_axis': sample['y_axis'],
+            'z_axis': sample['z_axis'],
+            'gx': sample.get('gx'),
+            'gy': sample.get('gy'),
+            'gz': sample.get('gz'),
+        })
+    return rows
+
+
+# --- Alerting rules ---
+
+def heart_rate_alerts(patient, rows: list) -> list:
+    """
+    Alerts raised over freshly stored heart rate rows by the rules (see
+    alert_rules) and by the patient's baseline (see hr_baseline).
+    """
+    return rule_engine.evaluate(patient, HeartRate, rows) + hr_baseline.observe(patient, rows)
+
+
+def imu_alerts(patient, rows: list) -> list:
+    """
+    Feed time-ordered IMU rows to the inactivity tracker and the fall
+    detector (which reads the sensor buffers, so they must have been
+    appended to) and return the INACTIVITY/FALL alerts they raise, after those of
+    the IMU rules (see alert_rules). Inactivity is checked once, at the
+    newest sample.
+    """
+    alerts = rule_engine.evaluate(patient, IMUData, rows)
+    for row in rows:
+        inactivity_tracker.observe(patient, row['x_axis'], row['y_axis'], row['z_axis'], row['timestamp'])
+
+    # A declared rule of the same type may already have raised one in this batch
+    raised = {alert.type for alert in alerts}
+    timestamp = rows[-1]['timestamp']
+    if ('INACTIVITY' not in raised and inactivity_tracker.is_inactive(patient, timestamp)
+            and not alert_state_cache.has_open(patient.user_id, 'INACTIVITY')):
+        alerts.append(Alert(user_id=patient.user_id, type='INACTIVITY', message='Patient inactive', timestamp=timestamp))
+
+    falls = fall_detector.detect(patient.user_id)
+    if falls and 'FALL' not in raised and should_create_alert(patient.user_id, 'FALL', falls[0]['timestamp']):
+        fall = falls[0]
+        message = f"Fall detected by server (impact={fall['peak_g']:.1f}g, tilt={fall['tilt_degrees']:.0f}deg)"
+        alerts.append(Alert(user_id=patient.user_id, type='FALL', message=message, timestamp=fall['timestamp']))
+    return alerts
+
+
+def sample_alerts(model, patient, rows: list) -> list:
+    """
+    Run freshly stored, time-ordered HeartRate/IMUData rows of `patient`
+    through the stream detectors: append them to the sensor buffers, then
+    return the alerts of heart_rate_alerts or imu_alerts (not yet added).
+    """
+    sensor_buffers.append(model.__tablename__, patient.user_id, rows)
+    if model is HeartRate:
+        return heart_rate_alerts(patient, rows)
+    return imu_alerts(patient, rows)
+
+
+def button_alert(user_id: int, timestamp: datetime) -> Alert:
+    return Alert(user_id=user_id, type='BUTTON', message='Panic button pressed', timestamp=timestamp)
+
+
+def reported_inactivity_alert(user_id: int, timestamp: datetime):
+    """INACTIVITY alert for an inactivity reported by the wristlet, or None during the cooldown."""
+    if not should_create_alert(user_id, 'INACTIVITY', timestamp):
+        log_event(alert_log, logging.DEBUG, 'inactivity_alert_skipped', user_id=user_id, reason='cooldown')
+        return None
+    log_event(alert_log, logging.INFO, 'inactivity_alert_created', user_id=user_id)
+    return Alert(user_id=user_id, type='INACTIVITY', message='Patient inactivity detected by wristlet', timestamp=timestamp)
+
+
+def device_fall_alert(user_id: int, probability: float, bpm, timestamp: datetime):
+    """FALL alert for a fall reported by the wristlet, or None during the cooldown."""
+    if not should_create_alert(user_id, 'FALL', timestamp):
+        return None
+    message = f'Fall detected (p={probability:.2f}'
+    if bpm is not None:
+        message += f', bpm={bpm}'
+    message += ')'
+    return Alert(user_id=user_id, type='FALL', message=message, timestamp=timestamp)
+
+
+# --- Bookkeeping ---
+
+def record_samples(model, rows: list) -> None:
+    """In-memory side of storing `rows`: metrics and the (sampled) ingest log."""
+    if not rows:
+        return
+    user_id = rows[0]['user_id']
+    metrics.count_samples(model.__tablename__, len(rows))
+    # Sampled, see LOG_INGEST_SAMPLE_EVERY
+    log_event(ingest_log, logging.INFO, 'samples_stored', kind=model.__tablename__, user_id=user_id, count=len(rows))